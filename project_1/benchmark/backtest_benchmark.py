@@ -0,0 +1,36 @@
+import os
+import sys
+import time
+from argparse import ArgumentParser
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import numpy as np
+from backtest import PriceMatrix, sweep, periods_per_year
+from store import TickerBlock
+from signal_benchmark import build_frames
+from constant import *
+
+
+def main(tickers, bars, interval, processes):
+    frames = build_frames(tickers, bars, interval)
+    matrix = PriceMatrix.from_blocks([TickerBlock.from_frame(df) for df in frames.values()])
+    day = int(NUM_MIN_TRADING_DAY / interval_map[interval])
+    windows = [day // 2, day, 2 * day, 3 * day]
+    bands = [0.5, 1.0, 1.5, 2.0]
+    caps = [5, 10, 20, np.inf]
+    print("tickers={0} bars/ticker={1} configurations={2}".format(
+        tickers, bars, len(windows) * len(bands) * len(caps)))
+    for n in processes:
+        start = time.perf_counter()
+        result = sweep(matrix, windows, bands, caps, periods=periods_per_year(interval), processes=n)
+        print("processes={0:<3d} {1:.3f}s".format(n, time.perf_counter() - start))
+    print(result.sort_values('sharpe', ascending=False).head().to_string(index=False))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--tickers', type=int, default=200, help='number of synthetic tickers')
+    parser.add_argument('--bars', type=int, default=2000, help='number of bars per ticker')
+    parser.add_argument('--interval', default='30min', choices=list(interval_map.keys()))
+    parser.add_argument('--processes', type=int, nargs='*', default=[1, 2, 4], help='worker process counts to time')
+    args = parser.parse_args()
+    main(args.tickers, args.bars, args.interval, args.processes)
@@ -0,0 +1,75 @@
+import os
+import sys
+import time
+import tempfile
+from argparse import ArgumentParser
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import numpy as np
+import pandas as pd
+from history import HistoryStore
+from signal_engine import SignalEngine
+from suite_benchmark import session_bars
+from constant import *
+
+
+def rss_mb():
+    """ Resident set of this process in MB, from /proc on Linux """
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return float('nan')
+
+
+def main(tickers, years, interval, chunk, queries, seed):
+    window = int(NUM_MIN_TRADING_DAY / interval_map[interval])
+    engine = SignalEngine(window)
+    ts = pd.DatetimeIndex(np.concatenate([day.values for day in session_bars(252 * years, interval)])).asi8
+    names = ['T{0:04d}'.format(i) for i in range(tickers)]
+    rng = np.random.default_rng(seed)
+    with tempfile.TemporaryDirectory() as path:
+        store = HistoryStore(path)
+        start = time.perf_counter()
+        for ticker in names:
+            price = 100 * np.exp(np.cumsum(rng.normal(0, 0.001, len(ts))))
+            for i in range(0, len(ts), 100000):  # arrives a pull at a time
+                store.append(ticker, ts[:i + 100000], price[:i + 100000])
+        append_time = time.perf_counter() - start
+        base = rss_mb()
+
+        # Lookups of a random day, each one through the sparse index and one stride of records
+        picks = rng.integers(0, len(ts) - 1, queries)
+        start = time.perf_counter()
+        for i, p in enumerate(picks):
+            store.range(names[i % tickers], ts[p], ts[p] + 24 * 60 * 60 * 10 ** 9)
+        lookup_time = (time.perf_counter() - start) / queries
+
+        # Signal over every bar held, a chunk of mapped records at a time
+        peak = base
+        start = time.perf_counter()
+        for ticker in names:
+            price = store.records(ticker)['price']
+            for lo in range(0, len(price), chunk):
+                engine.signal_slice(price, lo, min(lo + chunk, len(price)))
+            peak = max(peak, rss_mb())
+        scan_time = time.perf_counter() - start
+
+    num_bars = tickers * len(ts)
+    print("tickers={0} years={1} interval={2} bars={3} on disk {4:.1f} MB".format(
+        tickers, years, interval, num_bars, num_bars * 16 / 1e6))
+    print("append          {0:8.3f}s  {1:6.2f} M bars/s".format(append_time, num_bars / append_time / 1e6))
+    print("range lookup    {0:8.1f}us".format(lookup_time * 1e6))
+    print("signal scan     {0:8.3f}s  {1:6.2f} M bars/s".format(scan_time, num_bars / scan_time / 1e6))
+    print("resident set    {0:8.1f} MB before scan, {1:.1f} MB peak".format(base, peak))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--tickers', type=int, default=20, help='number of synthetic tickers')
+    parser.add_argument('--years', type=int, default=10, help='years of regular session bars per ticker')
+    parser.add_argument('--interval', default='5min', choices=list(interval_map.keys()))
+    parser.add_argument('--chunk', type=int, default=65536, help='bars per signal chunk')
+    parser.add_argument('--queries', type=int, default=10000, help='range lookups timed')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    main(args.tickers, args.years, args.interval, args.chunk, args.queries, args.seed)
@@ -0,0 +1,60 @@
+import os
+import sys
+import time
+import threading
+from argparse import ArgumentParser
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from client import Client
+from message import Query
+from constant import *
+
+
+def main(addr, clients, requests, inst, arg, mode, depth):
+    latencies = [[] for _ in range(clients)]
+
+    def client(i):
+        c = Client(addr)
+        sent = 0
+        while sent < requests:
+            batch = min(depth, requests - sent) if mode == 'pipeline' else 1
+            start = time.perf_counter()
+            if mode == 'pipeline':
+                c.pipeline([Query(inst, arg) for _ in range(batch)])
+            else:
+                c.request(inst, arg)
+                if mode == 'connect':
+                    c.close()  # fresh connection per request, the pre-persistent behaviour
+            # Pipelined batches are charged to each request in the batch
+            latencies[i].extend([(time.perf_counter() - start)] * batch)
+            sent += batch
+        c.close()
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    lat = np.concatenate([np.array(x) for x in latencies]) * 1000
+    print("mode={0} clients={1} requests/client={2} query='{3} {4}'".format(
+        mode if mode != 'pipeline' else 'pipeline x{0}'.format(depth), clients, requests, inst, arg or ''))
+    print("throughput: {0:.1f} req/s".format(len(lat) / elapsed))
+    print("latency ms: p50 {0:.2f}  p99 {1:.2f}  max {2:.2f}".format(
+        np.percentile(lat, 50), np.percentile(lat, 99), lat.max()))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('-s', '--server', dest='addr', default='127.0.0.1:8080', help='server address')
+    parser.add_argument('--clients', type=int, default=32, help='number of concurrent clients')
+    parser.add_argument('--requests', type=int, default=50, help='requests sent by each client')
+    parser.add_argument('--inst', default='data', help='instruction to send')
+    parser.add_argument('--arg', default='2024-03-08-12:30', help='instruction argument')
+    parser.add_argument('--mode', default='persistent', choices=['connect', 'persistent', 'pipeline'],
+                        help='new connection per request, one persistent connection, or pipelined batches')
+    parser.add_argument('--depth', type=int, default=8, help='requests per pipelined batch')
+    args = parser.parse_args()
+    main(args.addr, args.clients, args.requests, args.inst, args.arg, args.mode, args.depth)
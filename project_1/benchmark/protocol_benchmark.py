@@ -0,0 +1,49 @@
+import os
+import sys
+import time
+import pickle
+from argparse import ArgumentParser
+import numpy as np
+import pandas as pd
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from message import Response
+from protocol import encode_message, decode_message
+from constant import *
+
+
+def timed(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        out = func()
+    return (time.perf_counter() - start) / repeat, out
+
+
+def main(tickers, repeat):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'ticker': ['T{0:04d}'.format(i) for i in range(tickers)],
+                       'price': rng.uniform(10, 500, tickers).round(2),
+                       'signal': rng.integers(-1, 2, tickers)})
+
+    # Previous wire format: pickled Response carrying to_dict('list')
+    legacy = Response(DATA, SUCCESS, df.to_dict('list'))
+    legacy_enc, legacy_s = timed(lambda: pickle.dumps(legacy), repeat)
+    legacy_dec, _ = timed(lambda: pickle.loads(legacy_s), repeat)
+
+    framed = Response(DATA, SUCCESS, {'ticker': df['ticker'].tolist(), 'price': df['price'].to_numpy(),
+                                      'signal': df['signal'].to_numpy(dtype=np.int8)})
+    framed_enc, framed_s = timed(lambda: encode_message(framed), repeat)
+    framed_dec, _ = timed(lambda: decode_message(framed_s), repeat)
+
+    print("data snapshot of {0} tickers".format(tickers))
+    print("pickle   size {0:>9} B  encode {1:8.1f} us  decode {2:8.1f} us".format(
+        len(legacy_s), legacy_enc * 1e6, legacy_dec * 1e6))
+    print("protocol size {0:>9} B  encode {1:8.1f} us  decode {2:8.1f} us".format(
+        len(framed_s), framed_enc * 1e6, framed_dec * 1e6))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--tickers', type=int, default=1000, help='number of tickers in the snapshot')
+    parser.add_argument('--repeat', type=int, default=200, help='repetitions per measurement')
+    args = parser.parse_args()
+    main(args.tickers, args.repeat)
@@ -0,0 +1,56 @@
+import os
+import sys
+import time
+import tempfile
+from argparse import ArgumentParser
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import numpy as np
+from signal_engine import SignalEngine, RollingState
+from store import TickerBlock
+from report import CsvReportWriter, ColumnarReportWriter, open_report
+from signal_benchmark import build_frames
+from constant import *
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main(tickers, bars, interval):
+    window = int(NUM_MIN_TRADING_DAY / interval_map[interval])
+    engine = SignalEngine(window)
+    blocks = {ticker: TickerBlock.from_frame(df) for ticker, df in build_frames(tickers, bars, interval).items()}
+    engine.run_blocks(list(blocks.values()))
+    snapshot = lambda: {ticker: block.snapshot() for ticker, block in blocks.items()}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv = CsvReportWriter(os.path.join(tmp, 'report.csv'))
+        columnar = ColumnarReportWriter(os.path.join(tmp, 'report'))
+        csv_time = timed(lambda: csv.write(snapshot()))
+        columnar_time = timed(lambda: columnar.write(snapshot()))
+
+        # One new bar per ticker, as after an incremental report refresh
+        for block in blocks.values():
+            state = RollingState.from_block(block, window)
+            price = block['price'][-1:] + 0.01
+            block.append(block['ts'][-1:] + interval_map[interval] * 60 * 10 ** 9, price, state.update(price))
+        csv_append = timed(lambda: csv.write(snapshot()))
+        columnar_append = timed(lambda: columnar.write(snapshot()))
+
+        read_time = timed(lambda: [np.asarray(block['pnl']).sum() for block in open_report(columnar.path).values()])
+
+    print("tickers={0} bars/ticker={1}".format(tickers, bars))
+    print("report.csv:        full write {0:.3f}s  one new bar {1:.3f}s".format(csv_time, csv_append))
+    print("columnar report:   full write {0:.3f}s  one new bar {1:.3f}s  map and sum pnl {2:.3f}s".format(
+        columnar_time, columnar_append, read_time))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--tickers', type=int, default=200, help='number of synthetic tickers')
+    parser.add_argument('--bars', type=int, default=2000, help='number of bars per ticker')
+    parser.add_argument('--interval', default='30min', choices=list(interval_map.keys()))
+    args = parser.parse_args()
+    main(args.tickers, args.bars, args.interval)
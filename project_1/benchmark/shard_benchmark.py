@@ -0,0 +1,79 @@
+import os
+import sys
+import time
+import tempfile
+import threading
+from argparse import ArgumentParser
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import numpy as np
+import pandas as pd
+from shard import ShardedServer
+from server import Server
+from client import Client
+from constant import *
+
+
+class SyntheticRetriever(object):
+    """ Random walk bars standing in for upstream data, costs parsing and calculation but no network """
+    def __init__(self, bars):
+        self.bars = bars
+
+    def retrieve(self, ticker):
+        rng = np.random.default_rng(sum(map(ord, ticker)))
+        index = pd.date_range('2024-01-02 09:30', periods=self.bars, freq='30min', name='datetime')
+        return pd.DataFrame({'price': 100 + np.cumsum(rng.normal(0, 1, self.bars)), 'ticker': ticker}, index=index)
+
+    def process_data(self, df, ticker):
+        return df
+
+
+class NoQuote(SyntheticRetriever):
+    def retrieve(self, ticker):
+        return pd.DataFrame({'price': [], 'ticker': []}, index=pd.DatetimeIndex([], name='datetime'))
+
+
+def throughput(port, clients, requests):
+    """ data requests per second from {clients} threads each sending {requests} """
+    def work():
+        with Client('127.0.0.1:{0}'.format(port)) as c:
+            for _ in range(requests):
+                c.request('data', '2024-01-05-12:30')
+    threads = [threading.Thread(target=work) for _ in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return clients * requests / (time.perf_counter() - start)
+
+
+def main(tickers, bars, shards, clients, requests):
+    names = ['T{0:04d}'.format(i) for i in range(tickers)]
+    av, fh = SyntheticRetriever(bars), NoQuote(bars)
+    print("tickers={0} bars/ticker={1}".format(tickers, bars))
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        for n in shards:
+            start = time.perf_counter()
+            server = ShardedServer(list(names), 0, n, workers=4, av=av, fh=fh) if n else \
+                Server(list(names), 0, workers=4, av=av, fh=fh)
+            startup = time.perf_counter() - start
+            ports = []
+            threading.Thread(target=server.run, args=(ports.append,), daemon=True).start()
+            while not ports:
+                time.sleep(0.01)
+            rate = throughput(ports[0], clients, requests)
+            print("shards={0:<3d} startup {1:7.2f}s  data {2:8.1f} req/s".format(n, startup, rate))
+            if n:
+                server.close()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--tickers', type=int, default=400, help='number of synthetic tickers')
+    parser.add_argument('--bars', type=int, default=2000, help='number of bars per ticker')
+    parser.add_argument('--shards', type=int, nargs='*', default=[0, 1, 2, 4], help='shard counts, 0 is unsharded')
+    parser.add_argument('--clients', type=int, default=8, help='concurrent clients sending data requests')
+    parser.add_argument('--requests', type=int, default=50, help='data requests per client')
+    args = parser.parse_args()
+    main(args.tickers, args.bars, args.shards, args.clients, args.requests)
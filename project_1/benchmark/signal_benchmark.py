@@ -0,0 +1,99 @@
+import os
+import sys
+import time
+from argparse import ArgumentParser
+import numpy as np
+import pandas as pd
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from signal_engine import SignalEngine, RollingState, SIGNAL_COLUMNS
+from constant import *
+
+
+def legacy_calculate_all(df, window):
+    """ Row by row signal calculation the server used before vectorization """
+
+    def sig(p, avg, std):
+        if p > avg + std:
+            return 1
+        elif p < avg - std:
+            return -1
+        else:
+            return 0
+
+    df['rolling_avg'] = df['price'].rolling(window).mean()
+    df['rolling_std'] = df['price'].rolling(window).std()
+    df['signal'] = df.apply(lambda x: sig(x.price, x.rolling_avg, x.rolling_std), axis=1)
+    df['position'] = df['signal'].cumsum().shift().fillna(0)
+    df['unit_return_dollar'] = df['price'].diff()
+    df['pnl'] = df['position'].shift().fillna(0) * df['unit_return_dollar']
+    return df
+
+
+def build_frames(num_tickers, num_bars, interval):
+    """ Synthetic random walk frames in the server's data layout """
+    rng = np.random.default_rng(0)
+    index = pd.date_range('2024-01-02 09:30', periods=num_bars, freq=interval, name='datetime')
+    frames = dict()
+    for i in range(num_tickers):
+        ticker = 'T{0:04d}'.format(i)
+        df = pd.DataFrame({'price': 100 + np.cumsum(rng.normal(0, 0.5, num_bars)).round(2)}, index=index)
+        df['ticker'] = ticker
+        frames[ticker] = df
+    return frames
+
+
+def main(tickers, bars, interval):
+    window = int(NUM_MIN_TRADING_DAY / interval_map[interval])
+    frames = build_frames(tickers, bars, interval)
+
+    start = time.perf_counter()
+    legacy = {ticker: legacy_calculate_all(df.copy(), window) for ticker, df in frames.items()}
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = SignalEngine(window).run_frames({ticker: df.copy() for ticker, df in frames.items()})
+    batch_time = time.perf_counter() - start
+
+    identical = all(np.array_equal(legacy[t][col].to_numpy(), batch[t][col].to_numpy(), equal_nan=True)
+                    for t in frames for col in SIGNAL_COLUMNS)
+    print("tickers={0} bars={1} window={2}".format(tickers, bars, window))
+    print("legacy row-wise apply: {0:.3f}s".format(legacy_time))
+    print("batch engine:          {0:.3f}s".format(batch_time))
+    print("speedup:               {0:.1f}x".format(legacy_time / batch_time))
+    print("bit identical:         {0}".format(identical))
+
+
+
+def incremental_main(new_bars, interval):
+    """ Refresh cost of full recompute versus incremental update as history grows """
+    window = int(NUM_MIN_TRADING_DAY / interval_map[interval])
+    engine = SignalEngine(window)
+    print("new bars per refresh={0} window={1}".format(new_bars, window))
+    for history in (1000, 10000, 100000):
+        df = build_frames(1, history + new_bars, interval)['T0000']
+        head = engine.run_frames({'T': df.iloc[:history].copy()})['T']
+        state = RollingState.from_frame(head, window)
+
+        start = time.perf_counter()
+        engine.run_frames({'T': df.copy()})
+        full_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        state.update(df['price'].to_numpy()[history:])
+        incremental_time = time.perf_counter() - start
+        print("history={0:>6}  full recompute: {1:.4f}s  incremental: {2:.4f}s".format(
+            history, full_time, incremental_time))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--tickers', type=int, default=50, help='number of synthetic tickers')
+    parser.add_argument('--bars', type=int, default=2000, help='number of bars per ticker')
+    parser.add_argument('--interval', default='5min', choices=list(interval_map.keys()))
+    parser.add_argument('--incremental', type=int, default=0, metavar='NEW_BARS',
+                        help='benchmark incremental refresh with this many new bars instead')
+    args = parser.parse_args()
+    if args.incremental:
+        incremental_main(args.incremental, args.interval)
+    else:
+        main(args.tickers, args.bars, args.interval)
@@ -0,0 +1,45 @@
+import os
+import sys
+import time
+from argparse import ArgumentParser
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from signal_engine import SignalEngine
+from store import ColumnarStore, TickerBlock
+from signal_benchmark import build_frames
+from constant import *
+
+
+def main(tickers, bars, interval):
+    window = int(NUM_MIN_TRADING_DAY / interval_map[interval])
+    engine = SignalEngine(window)
+    frames = build_frames(tickers, bars, interval)
+
+    # Previous layout: dict of per ticker DataFrames with the analytics columns added
+    start = time.perf_counter()
+    engine.run_frames(frames)
+    frame_time = time.perf_counter() - start
+    frame_bytes = sum(df.memory_usage(deep=True).sum() for df in frames.values())
+
+    store = ColumnarStore()
+    for ticker, df in frames.items():
+        store.put(ticker, TickerBlock.from_frame(df))
+    start = time.perf_counter()
+    engine.run_blocks([store.block(ticker) for ticker in store])
+    store_time = time.perf_counter() - start
+    store_bytes = store.nbytes()
+
+    num_bars = tickers * bars
+    print("tickers={0} bars/ticker={1}".format(tickers, bars))
+    print("dict of DataFrames: {0:8.1f} MB  {1:5.1f} bytes/bar  calculate {2:.3f}s".format(
+        frame_bytes / 1e6, frame_bytes / num_bars, frame_time))
+    print("columnar store:     {0:8.1f} MB  {1:5.1f} bytes/bar  calculate {2:.3f}s".format(
+        store_bytes / 1e6, store_bytes / num_bars, store_time))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--tickers', type=int, default=1000, help='number of synthetic tickers')
+    parser.add_argument('--bars', type=int, default=2000, help='number of bars per ticker')
+    parser.add_argument('--interval', default='5min', choices=list(interval_map.keys()))
+    args = parser.parse_args()
+    main(args.tickers, args.bars, args.interval)
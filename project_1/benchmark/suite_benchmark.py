@@ -0,0 +1,215 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import threading
+import subprocess
+from argparse import ArgumentParser
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import numpy as np
+import pandas as pd
+from server import Server
+from client import Client
+from data_retriever import DataRetrieverPdAV, DataRetrieverPdFH
+from report import REPORT_WRITERS, BackgroundReporter
+from constant import *
+
+SAVED_DT_FORMAT = '%Y-%m-%d %H:%M'  # as in the files under project_1/data
+SRC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+REPORTS = ['report', 'report.csv']
+
+
+def session_bars(days, interval, end='2024-03-08'):
+    """ Bar starts of the regular session of the {days} business days up to {end}, one index per day """
+    step = pd.Timedelta(minutes=interval_map[interval])
+    return [pd.date_range(day + pd.Timedelta(hours=9, minutes=30), day + pd.Timedelta(hours=16) - step, freq=step)
+            for day in pd.bdate_range(end=end, periods=days)]
+
+
+def build_dataset(path, tickers, days, interval, seed):
+    """ Write av_price_/fh_price_ files of {tickers} synthetic tickers over {days} days to {path}, the layout the
+        Pd retrievers replay: Alpha Vantage trailing bars newest first up to the day before, Finn Hub the last
+        quote flat filled over the last day. A dataset already at {path} with the same parameters is reused.
+    """
+    params = {'tickers': tickers, 'days': days, 'interval': interval, 'seed': seed}
+    manifest = os.path.join(path, 'dataset.json')
+    names = ['T{0:04d}'.format(i) for i in range(tickers)]
+    if os.path.exists(manifest):
+        with open(manifest) as f:
+            if json.load(f) == params:
+                return names
+    os.makedirs(path, exist_ok=True)
+    sessions = session_bars(days, interval)
+    trailing = sessions[:-1][::-1]
+    av_index = pd.DatetimeIndex(np.concatenate([day[::-1].values for day in trailing]), name='datetime')
+    fh_index = sessions[-1].rename('datetime')
+    for i, ticker in enumerate(names):
+        rng = np.random.default_rng(seed + i)
+        walk = 100 * np.exp(np.cumsum(rng.normal(0, 0.002, len(av_index) + 1)))
+        av = pd.DataFrame({'price': walk[:-1][::-1].round(2), 'ticker': ticker}, index=av_index)
+        fh = pd.DataFrame({'price': walk[-1].round(2), 'ticker': ticker}, index=fh_index)
+        av.to_csv(os.path.join(path, 'av_price_' + ticker + '.csv'), date_format=SAVED_DT_FORMAT)
+        fh.to_csv(os.path.join(path, 'fh_price_' + ticker + '.csv'), date_format=SAVED_DT_FORMAT)
+    with open(manifest, 'w') as f:
+        json.dump(params, f)
+    return names
+
+
+def summary(samples):
+    """ Seconds {samples} of one measurement, reduced to the statistics compared between runs """
+    samples = np.asarray(samples, dtype=np.float64)
+    return {'n': len(samples), 'min': samples.min(), 'median': float(np.median(samples)), 'mean': samples.mean(),
+            'p90': float(np.percentile(samples, 90)), 'p99': float(np.percentile(samples, 99)), 'max': samples.max()}
+
+
+def clear(paths):
+    """ Remove report and cache {paths} of earlier starts in the working directory """
+    for path in paths:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+
+def settle(server):
+    """ Wait for {server}'s background threads and report writes, raises if a report write failed """
+    server.close()
+    if server.reporter.error is not None:
+        raise RuntimeError("Report write failed: {0}".format(server.reporter.error))
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def version():
+    """ Commit the benchmarked tree is at, None outside a git checkout """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(tickers, days, interval, data, repeat, queries, workers, seed):
+    names = build_dataset(data, tickers, days, interval, seed)
+    start_server = lambda **kwargs: Server(names, 0, workers, av=DataRetrieverPdAV(data),
+                                           fh=DataRetrieverPdFH(data), interval=interval, **kwargs)
+    query_dts = lambda n: [dt.strftime('%Y-%m-%d-%H:%M') for dt in
+                           pd.to_datetime(rng.integers(lo, hi, n)).floor('min')]
+    rng = np.random.default_rng(seed)
+    results = {'import_server': summary([timed(lambda: subprocess.check_call(
+        [sys.executable, '-c', 'import server'], cwd=SRC_PATH)) for _ in range(repeat)])}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as work:
+        os.chdir(work)  # frame cache and report land here, the first start finds the cache cold
+        try:
+            server = None
+            starts = {'startup_cold': [], 'startup_warm_cache': [], 'startup_warm_snapshot': []}
+            for name, samples in starts.items():
+                for _ in range(repeat if name != 'startup_cold' else 1):
+                    server = None  # let the last one go before holding another copy of every ticker
+                    if name == 'startup_warm_cache':
+                        clear(REPORTS)  # nothing to warm start from, frames come from the cache
+                    start = time.perf_counter()
+                    server = start_server()
+                    samples.append(time.perf_counter() - start)
+                    settle(server)
+            results.update({name: summary(samples) for name, samples in starts.items()})
+
+            # Fast start from nothing, this server stays up for the rest of the measurements
+            server = None
+            clear(REPORTS + ['.cache'])
+            start = time.perf_counter()
+            server = start_server(fast_start=True)
+            ready = threading.Event()
+            threading.Thread(target=server.run, kwargs={'ready': lambda port: ready.set()}, daemon=True).start()
+            ready.wait()
+            c = Client('127.0.0.1:{0}'.format(server.port))
+            c.request('data', '2024-03-08-12:30')
+            results['first_response_fast_start'] = summary([time.perf_counter() - start])
+            server.loader.join()
+            results['fast_start_loaded'] = summary([time.perf_counter() - start])
+            server.reporter.flush()
+            ts = server.data.block(names[0])['ts']
+            lo, hi = ts[0], ts[-1]
+
+            results['calculate_all'] = summary([timed(server.calculate_all_tickers) for _ in range(repeat)])
+            picks = rng.integers(0, len(names), queries)
+            dts = query_dts(queries)
+            results['query'] = summary([timed(lambda: server.query(names[i], dt)) for i, dt in zip(picks, dts)])
+            results['snapshot'] = summary([timed(lambda: server.snapshot(dt)) for dt in dts[:repeat * 10]])
+
+            # A full report write each time, into a fresh report as the first save after startup is
+            writer, path = REPORT_WRITERS[server.cfg['report_format']]
+            saves = []
+            for i in range(repeat):
+                server.reporter = BackgroundReporter(writer('save{0}_{1}'.format(i, path)))
+                saves.append(timed(lambda: (server.save_data(), server.reporter.flush())))
+                if server.reporter.error is not None:
+                    raise RuntimeError("Report write failed: {0}".format(server.reporter.error))
+            results['save_data'] = summary(saves)
+
+            with c:
+                results['round_trip_data'] = summary([timed(lambda: c.request('data', dt)) for dt in dts])
+                results['round_trip_report'] = summary([timed(lambda: c.request('report')) for _ in range(repeat)])
+            settle(server)  # the reports written in the background land before the directory goes
+        finally:
+            os.chdir(cwd)
+
+    meta = {'version': version(), 'python': platform.python_version(), 'numpy': np.__version__,
+            'pandas': pd.__version__, 'cpus': os.cpu_count(), 'tickers': tickers, 'days': days,
+            'interval': interval, 'bars': int(sum(len(server.data.block(t)) for t in server.tickers)),
+            'repeat': repeat, 'queries': queries, 'workers': workers, 'seed': seed}
+    return {'meta': meta, 'results': results}
+
+
+def compare(report, baseline, tolerance):
+    """ Print median seconds against {baseline}, returns the measurements more than {tolerance} slower """
+    regressions = []
+    print("{0:<20}{1:>12}{2:>12}{3:>9}".format('measurement', 'baseline', 'current', 'ratio'))
+    for name, current in report['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        ratio = current['median'] / before['median'] if before['median'] else float('inf')
+        flag = ''
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print("{0:<20}{1:>12.6f}{2:>12.6f}{3:>9.2f}{4}".format(name, before['median'], current['median'], ratio, flag))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--tickers', type=int, default=1000, help='number of synthetic tickers')
+    parser.add_argument('--days', type=int, default=252, help='trading days of bars per ticker')
+    parser.add_argument('--interval', default='5min', choices=list(interval_map.keys()))
+    parser.add_argument('--data', default=os.path.join(tempfile.gettempdir(), 'trading_server_bench'),
+                        help='directory the dataset is generated in, reused while the parameters match')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each whole server measurement')
+    parser.add_argument('--queries', type=int, default=1000, help='queries and data round trips timed')
+    parser.add_argument('--workers', type=int, default=0, help='server request worker threads')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare medians against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='slowdown over the baseline counted as a '
+                                                                      'regression, 0.2 is 20%%')
+    args = parser.parse_args()
+    report = main(args.tickers, args.days, args.interval, args.data, args.repeat, args.queries, args.workers,
+                  args.seed)
+    text = json.dumps(report, indent=2, default=float)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+    if args.baseline:
+        with open(args.baseline) as f:
+            if compare(report, json.load(f), args.tolerance):
+                sys.exit(1)
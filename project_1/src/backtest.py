@@ -0,0 +1,142 @@
+import os
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from constant import *
+
+SWEEP_COLUMNS = ['window', 'band', 'cap', 'pnl', 'sharpe', 'turnover']
+TRADING_DAYS_PER_YEAR = 252
+
+
+def periods_per_year(interval):
+    """ Number of {interval} bars in a year of regular trading days, annualizes Sharpe """
+    return TRADING_DAYS_PER_YEAR * NUM_MIN_TRADING_DAY / interval_map[interval]
+
+
+class PriceMatrix(object):
+    """ Prices of all tickers as one bars x tickers array for evaluating many strategy configurations at once
+
+        Every ticker's bars start at row 0 and are NaN padded after its last bar, so rolling windows count the
+        ticker's own bars exactly as SignalEngine does. Portfolio PnL is summed across tickers by bar time.
+    """
+
+    def __init__(self, prices, ts):
+        n = len(prices)
+        rows = max((len(p) for p in prices), default=0)
+        self.prices = np.full((rows, n), np.nan)
+        self.valid = np.zeros((rows, n), dtype=bool)
+        self.slot = np.zeros((rows, n), dtype=np.int64)  # row of each bar's time in self.times
+        self.times, inverse = np.unique(np.concatenate(ts) if n else np.empty(0, dtype=np.int64),
+                                        return_inverse=True)
+        start = 0
+        for j, p in enumerate(prices):
+            self.prices[:len(p), j] = p
+            self.valid[:len(p), j] = True
+            self.slot[:len(p), j] = inverse[start:start + len(p)]
+            start += len(p)
+        self.window = None  # window of the rolling statistics held, kept across configurations sharing it
+        self.avg = None
+        self.std = None
+
+    @classmethod
+    def from_blocks(cls, blocks):
+        """ Matrix of the prices in a list of store TickerBlocks """
+        return cls([block['price'] for block in blocks], [block['ts'] for block in blocks])
+
+    @classmethod
+    def from_history(cls, history, tickers, start, end):
+        """ Matrix of {tickers}' bars in HistoryStore {history} from int64 ns {start} to {end}, copied out of the
+            mapped slices
+        """
+        slices = [history.slice(ticker, start, end) for ticker in tickers]
+        return cls([s['price'] for s in slices], [s['ts'] for s in slices])
+
+    def rolling(self, window):
+        """ Rolling mean and standard deviation over {window} bars of every ticker """
+        if self.window != window:
+            rolling = pd.DataFrame(self.prices).rolling(window, min_periods=window)
+            self.avg = rolling.mean().to_numpy()
+            self.std = rolling.std().to_numpy()
+            self.window = window
+        return self.avg, self.std
+
+
+def positions(signal, cap):
+    """ Position(t+1) = Position(t) + signal(t), held within [-{cap}, {cap}] """
+    position = np.zeros(signal.shape, dtype=np.float64)
+    if np.isinf(cap):
+        np.cumsum(signal[:-1], axis=0, dtype=np.float64, out=position[1:])
+        return position
+    # Capping makes each position depend on the last, step through bars with all tickers at once
+    for t in range(1, len(signal)):
+        np.clip(position[t - 1] + signal[t - 1], -cap, cap, out=position[t])
+    return position
+
+
+def evaluate(matrix, window, band, caps, periods):
+    """ PnL, annualized Sharpe of per bar portfolio PnL and turnover of one window and band for each of {caps}
+
+        Signal is +1 above avg + {band} * std and -1 below avg - {band} * std, position and PnL follow
+        calculate_position and calculate_pnl. Turnover is the total absolute position change in units.
+    """
+    prices = matrix.prices
+    avg, std = matrix.rolling(window)
+    with np.errstate(invalid='ignore'):
+        signal = (prices > avg + band * std).astype(np.int8) - (prices < avg - band * std).astype(np.int8)
+    unit_return = np.full(prices.shape, np.nan)
+    unit_return[1:] = prices[1:] - prices[:-1]
+
+    rows = []
+    for cap in caps:
+        position = positions(signal, cap)
+        # PnL(t+1) = Position(t) * [S(t+1) - S(t)]
+        prev_position = np.zeros(position.shape)
+        prev_position[1:] = position[:-1]
+        pnl = np.where(matrix.valid, np.nan_to_num(prev_position * unit_return), 0.0)
+        bar_pnl = np.bincount(matrix.slot[matrix.valid], weights=pnl[matrix.valid], minlength=len(matrix.times))
+        sd = bar_pnl.std(ddof=1) if len(bar_pnl) > 1 else 0.0
+        sharpe = bar_pnl.mean() / sd * math.sqrt(periods) if sd > 0 else np.nan
+        turnover = np.abs(np.diff(position, axis=0, prepend=0.0))[matrix.valid].sum()
+        rows.append((window, band, cap, pnl.sum(), sharpe, turnover))
+    return rows
+
+
+def backtest_pool(processes):
+    """ Pool of {processes} worker processes for sweeps, spawned rather than forked, the server calling this runs
+        many threads
+    """
+    return ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'))
+
+
+def _evaluate_tasks(matrix, tasks):
+    """ Rows of a sweep worker's share of {tasks}, price {matrix} sent once along with them """
+    return [evaluate(matrix, *task) for task in tasks]
+
+
+def sweep(matrix, windows, bands=(1.0,), caps=(np.inf,), periods=None, processes=1, pool=None):
+    """ Evaluate every combination of {windows}, {bands} and position {caps} over price {matrix}
+
+        Window and band pairs are spread over {processes} worker processes, 0 uses every core, of {pool} when one
+        is kept by the caller and of a pool started for this sweep otherwise. Caps of one pair share its signals,
+        consecutive pairs of one window share its rolling statistics. Returns a DataFrame of SWEEP_COLUMNS, one row
+        per configuration in grid order, inf cap means uncapped.
+    """
+    periods = periods if periods is not None else periods_per_year('30min')
+    tasks = [(int(window), float(band), [float(cap) for cap in caps], periods) for window in windows for band in bands]
+    processes = processes or os.cpu_count()
+    if processes > 1 and len(tasks) > 1:
+        size = math.ceil(len(tasks) / min(processes, len(tasks)))
+        shares = [tasks[i:i + size] for i in range(0, len(tasks), size)]  # consecutive, each worker gets one
+        kept = pool is not None
+        pool = pool if kept else backtest_pool(len(shares))
+        try:
+            futures = [pool.submit(_evaluate_tasks, matrix, share) for share in shares]
+            results = [rows for future in futures for rows in future.result()]
+        finally:
+            if not kept:
+                pool.shutdown()
+    else:
+        results = [evaluate(matrix, *task) for task in tasks]
+    return pd.DataFrame([row for rows in results for row in rows], columns=SWEEP_COLUMNS)
@@ -0,0 +1,173 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from urllib.parse import quote
+
+# On-disk layout of one cached bar frame, read back memory-mapped
+CACHE_DTYPE = np.dtype([('ts', '<i8'), ('price', '<f8')])  # bar time in ns since epoch, price
+
+
+class FrameCache(object):
+    """ On-disk cache of processed bar frames keyed by provider, ticker and interval
+
+        Each frame is one .npy file of (ts, price) records. An entry older than its provider's TTL is a miss,
+        files are dropped least recently used first once the cache holds more than {max_bytes}.
+    """
+
+    def __init__(self, path, ttl, max_bytes):
+        self.path = path
+        self.ttl = ttl  # provider -> seconds an entry stays fresh, 0 disables caching for the provider
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()  # eviction scans the directory, pulls write entries from many threads
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(path, exist_ok=True)
+
+    def file(self, provider, ticker, interval):
+        """ Path of the entry for {provider}, {ticker}, {interval} """
+        return os.path.join(self.path, '{0}_{1}_{2}.npy'.format(provider, quote(ticker, safe=''), interval))
+
+    def get(self, provider, ticker, interval):
+        """ Cached frame, None when absent or older than the provider's TTL """
+        path = self.file(provider, ticker, interval)
+        try:
+            written = os.path.getmtime(path)
+            if time.time() - written > self.ttl.get(provider, 0):
+                return None
+            records = np.load(path, mmap_mode='r')
+            os.utime(path, (time.time(), written))  # access time orders eviction, modified time is the age
+        except (OSError, ValueError):
+            return None  # missing, evicted meanwhile or partially written by a crashed process
+        index = pd.DatetimeIndex(records['ts'].view('datetime64[ns]'), name='datetime')
+        return pd.DataFrame({'price': np.array(records['price']), 'ticker': ticker}, index=index)
+
+    def put(self, provider, ticker, interval, df):
+        """ Write bar frame {df}, a DataFrame of price by datetime, then evict down to the size limit """
+        if not self.ttl.get(provider, 0):
+            return
+        records = np.empty(len(df), dtype=CACHE_DTYPE)
+        records['ts'] = np.asarray(pd.to_datetime(df.index, format='%Y-%m-%d %H:%M:%S').values).astype(
+            'datetime64[ns]').view(np.int64)
+        records['price'] = df['price'].to_numpy(dtype=np.float64)
+        path = self.file(provider, ticker, interval)
+        tmp = '{0}.{1}.tmp'.format(path, threading.get_ident())
+        with open(tmp, 'wb') as f:
+            np.save(f, records)
+        os.replace(tmp, path)  # readers see the old entry or the new one, never half of it
+        self.evict()
+
+    def fetch(self, provider, ticker, interval, load):
+        """ Cached frame if fresh, otherwise the frame returned by {load}() which is then cached """
+        df = self.get(provider, ticker, interval)
+        with self.lock:
+            if df is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if df is not None:
+            return df
+        df = load()
+        self.put(provider, ticker, interval, df)
+        return df
+
+    def evict(self):
+        """ Drop expired entries, then least recently used ones until the cache fits in {max_bytes} """
+        with self.lock:
+            now = time.time()
+            entries = []
+            for name in os.listdir(self.path):
+                if not name.endswith('.npy'):
+                    continue
+                path = os.path.join(self.path, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if now - st.st_mtime > self.ttl.get(name.split('_', 1)[0], 0):
+                    self.remove(path)
+                else:
+                    entries.append((st.st_atime, st.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self.remove(path)
+                total -= size
+
+    @staticmethod
+    def remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def nbytes(self):
+        """ Bytes held on disk """
+        return sum(os.path.getsize(os.path.join(self.path, name)) for name in os.listdir(self.path)
+                   if name.endswith('.npy'))
+
+
+class ResponseCache(object):
+    """ Encoded replies kept in memory by key, at most {max_entries} of them, least recently used dropped first
+
+        Concurrent misses on one key are coalesced: the first computes, the others wait for its result. clear()
+        drops every entry, and a computation running across it is handed to the waiters that joined it before
+        the clear but not kept, requests after the clear compute afresh.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.flights = dict()  # (generation, key) -> [done event, value, error] of the computation under way
+        self.generation = 0  # bumped by clear, results computed before it are not kept
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key, compute):
+        """ Value cached for {key}, or the one {compute}() returns, computed once however many ask at a time """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            generation = self.generation
+            flight = self.flights.get((generation, key))
+            leader = flight is None
+            if leader:
+                flight = self.flights[(generation, key)] = [threading.Event(), None, None]
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            flight[0].wait()
+            if flight[2] is not None:
+                raise flight[2]
+            return flight[1]
+        try:
+            flight[1] = compute()
+        except Exception as e:
+            flight[2] = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[(generation, key)]
+                if flight[2] is None and generation == self.generation:
+                    self.entries[key] = flight[1]
+                    while len(self.entries) > self.max_entries:
+                        self.entries.popitem(last=False)
+            flight[0].set()
+        return flight[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.generation += 1
+
+    def nbytes(self):
+        with self.lock:
+            return sum(len(value) for value in self.entries.values())
@@ -1,22 +1,220 @@
 import socket
+import select
+from collections import deque
 from argparse import ArgumentParser
-import pickle
 from message import Query
+from protocol import send_message, recv_message, ProtocolError
 import pandas as pd
 from constant import *
 import datetime
-
-parser = ArgumentParser()
-parser.add_argument('-s', '--server', dest='addr', default='127.0.0.1:8080',
-                    help="Server address to query from, default local host port 8080")
-args = parser.parse_args()
+from metrics import summarize
 
 
 class Client(object):
-    """ Clinet CLI"""
+    """ Clinet CLI and programmatic API over one persistent connection, one Client per thread
+
+        Example:
+            with Client('127.0.0.1:8080') as c:
+                snapshot = c.data('2024-03-08-12:30')
+                bars = c.data_range('IBM', '2024-03-01-09:30', '2024-03-08-16:00', interval='60min')
+                responses = c.pipeline([Query('data', dt) for dt in datetimes])
+    """
     def __init__(self, addr):
         [self.host, self.port] = addr.split(":")
         self.port = int(self.port)
+        self.sock = None
+        self.next_id = 0
+        self.responses = dict()  # replies that arrived ahead of the one being waited on, by request id
+        self.chunks = dict()  # request id -> streamed parts of its reply not yet taken, the reply follows them
+        self.updates = deque()  # bars pushed for subscribed tickers, not yet taken by next_update
+
+    def connect(self):
+        """ Open the persistent connection if not already open """
+        if self.sock is None:
+            self.sock = socket.create_connection((self.host, self.port))
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return self
+
+    def close(self):
+        """ Close the connection, the next request reconnects """
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            self.responses.clear()
+            self.chunks.clear()
+            self.updates.clear()
+
+    def __enter__(self):
+        return self.connect()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def send(self, query):
+        """ Send {query} without waiting for the reply, returns its request id """
+        self.connect()
+        self.next_id += 1
+        query.req_id = self.next_id
+        try:
+            send_message(self.sock, query)
+        except OSError:
+            self.close()
+            raise
+        return query.req_id
+
+    def read(self):
+        """ Read one message, pushed bars go to self.updates, reply chunks to self.chunks and replies to
+            self.responses
+        """
+        try:
+            response = recv_message(self.sock)
+        except (OSError, ProtocolError):
+            self.close()
+            raise
+        if response is None:
+            self.close()
+            raise ConnectionError("Server closed the connection")
+        if response.inst == UPDATE:
+            self.updates.append(response.data)
+        elif response.inst == CHUNK:
+            self.chunks.setdefault(response.req_id, deque()).append(response)
+        else:
+            self.responses[response.req_id] = response
+
+    def receive(self, req_id):
+        """ Wait for the reply to request {req_id}, buffering replies to other requests that arrive first """
+        while req_id not in self.responses:
+            self.read()
+        return self.responses.pop(req_id)
+
+    def receive_stream(self, req_id):
+        """ Chunks streamed for request {req_id} as they arrive, then its reply, all as Responses """
+        while True:
+            chunks = self.chunks.get(req_id)
+            if chunks:
+                yield chunks.popleft()
+            elif req_id in self.responses:  # the reply comes after every chunk
+                self.chunks.pop(req_id, None)
+                yield self.responses.pop(req_id)
+                return
+            else:
+                self.read()
+
+    def request(self, inst, arg=None):
+        """ Send one request and wait for its reply """
+        return self.receive(self.send(Query(inst, arg)))
+
+    def pipeline(self, queries):
+        """ Send all {queries} back to back then collect the replies, returned in the order of {queries} """
+        req_ids = [self.send(query) for query in queries]
+        return [self.receive(req_id) for req_id in req_ids]
+
+    def data(self, dt_str):
+        """ Price and signal of every ticker at the bar closest to {dt_str} (YYYY-MM-DD-HH:MM) as a DataFrame """
+        response = self.request('data', dt_str)
+        if response.result != SUCCESS:
+            raise RuntimeError(response.data)
+        data = dict(response.data)
+        return pd.DataFrame(data, index=data.pop('ticker'))
+
+    def range_chunks(self, ticker, start, end, interval=None):
+        """ {ticker}'s bars from {start} to {end} (YYYY-MM-DD-HH:MM, inclusive) as DataFrames, one per chunk
+            the server streams, OHLC bars of {interval} if given
+        """
+        req_id = self.send(Query('data', {'ticker': ticker, 'from': start, 'to': end, 'interval': interval}))
+        for response in self.receive_stream(req_id):
+            if response.result != SUCCESS:
+                raise RuntimeError(response.data)
+            if response.inst == CHUNK:
+                data = dict(response.data)
+                yield pd.DataFrame(data, index=pd.DatetimeIndex(data.pop('datetime'), name='datetime'))
+
+    def data_range(self, ticker, start, end, interval=None):
+        """ {ticker}'s bars from {start} to {end} as one DataFrame, see range_chunks """
+        return pd.concat(list(self.range_chunks(ticker, start, end, interval)))
+
+    def add(self, ticker):
+        """ Ask the server to start tracking {ticker} """
+        return self.request('add', ticker)
+
+    def delete(self, ticker):
+        """ Ask the server to drop {ticker} """
+        return self.request('delete', ticker)
+
+    def report(self):
+        """ Ask the server to refresh data and save the report """
+        return self.request('report')
+
+    def subscribe(self, ticker):
+        """ Have the server push {ticker}'s bars as they complete, collect them with next_update """
+        response = self.request('subscribe', ticker)
+        if response.result != SUCCESS:
+            raise RuntimeError(response.data)
+        return response.data
+
+    def unsubscribe(self, ticker):
+        """ Stop pushes of {ticker} """
+        return self.request('unsubscribe', ticker)
+
+    def next_update(self, timeout=None):
+        """ Next pushed bars of a subscribed ticker as a dict of ticker and column arrays, None after {timeout}
+            seconds without one
+        """
+        while not self.updates:
+            readable, _, _ = select.select([self.sock], [], [], timeout)
+            if not readable:
+                return None
+            self.read()  # once a message starts arriving it is read whole
+        return self.updates.popleft()
+
+    def stats(self, fmt=None):
+        """ Server metrics snapshot, or Prometheus text when {fmt} is 'prometheus' """
+        response = self.request('stats', fmt)
+        if response.result != SUCCESS:
+            raise RuntimeError(response.data)
+        return response.data
+
+    def backtest(self, windows=None, bands=None, caps=None, start=None, end=None):
+        """ Ask the server to sweep the strategy over a grid of parameters, returns a DataFrame per configuration
+
+            With {start} and {end} (YYYY-MM-DD-HH:MM) the sweep runs over the server's history of that span.
+        """
+        grid = {'windows': windows, 'bands': bands, 'caps': caps}
+        if start is not None or end is not None:
+            grid.update({'from': start, 'to': end})
+        response = self.request('backtest', grid)
+        if response.result != SUCCESS:
+            raise RuntimeError(response.data)
+        return pd.DataFrame(response.data)
+
+    def macro(self, asset, country, start=None, end=None, **params):
+        """ Daily macro overlay of {asset} against {country}'s macro regime from {start} to {end} (YYYY-MM-DD) as a
+            DataFrame, {params} are window, lookback, corr_window and against
+        """
+        response = self.request('macro', dict(params, asset=asset, country=country, **{'from': start, 'to': end}))
+        if response.result != SUCCESS:
+            raise RuntimeError(response.data)
+        data = dict(response.data)
+        return pd.DataFrame(data, index=pd.DatetimeIndex(data.pop('datetime'), name='datetime'))
+
+    def portfolio(self, ticker_cap=None, gross_cap=None, net_cap=None, start=None, end=None):
+        """ Portfolio PnL, equity, drawdown and exposure by bar time from {start} to {end} (YYYY-MM-DD-HH:MM) as a
+            DataFrame, and the last position of each ticker as a Series. Caps left out are the server's, inf uncaps
+        """
+        arg = {name: cap for name, cap in [('ticker_cap', ticker_cap), ('gross_cap', gross_cap),
+                                           ('net_cap', net_cap)] if cap is not None}
+        arg.update({'from': start, 'to': end})
+        response = self.request('portfolio', arg)
+        if response.result != SUCCESS:
+            raise RuntimeError(response.data)
+        return self.portfolio_frames(response.data)
+
+    @staticmethod
+    def portfolio_frames(data):
+        """ Bar time DataFrame and ticker position Series of a portfolio reply """
+        data = dict(data)
+        position = pd.Series(data.pop('position'), index=data.pop('ticker'), name='position')
+        return pd.DataFrame(data, index=pd.DatetimeIndex(data.pop('datetime'), name='datetime')), position
 
     def prep_request(self, msg):
 
@@ -27,9 +225,18 @@ class Client(object):
         inst = msg[0]
         arg = None
 
+        if inst == 'backtest':  # backtest [WINDOWS [BANDS [CAPS]]], comma separated lists
+            return self.prep_backtest(msg[1:])
+        if inst == 'data' and len(msg) in (4, 5):  # data TICKER FROM TO [INTERVAL]
+            return self.prep_range(msg[1:])
+        if inst == 'macro':  # macro ASSET COUNTRY [FROM [TO]]
+            return self.prep_macro(msg[1:])
+        if inst == 'portfolio':  # portfolio [TICKER_CAP [GROSS_CAP [NET_CAP]]]
+            return self.prep_portfolio(msg[1:])
+
         # Check num of args
         if len(msg) == 1:
-            if inst != 'report':
+            if inst not in ('report', 'stats'):
                 return self.error_prompt("Invalid command")
         elif (len(msg) == 0) or (len(msg) > 2) :
             return self.error_prompt("Incorrect number of arguments")
@@ -42,6 +249,49 @@ class Client(object):
 
         return Query(inst, arg)
 
+    def prep_backtest(self, lists):
+        """ Parameter grid of a backtest request from comma separated {lists} of windows, bands and caps """
+        if len(lists) > 3:
+            return self.error_prompt("Incorrect number of arguments")
+        grid = dict()
+        try:
+            for key, cast, values in zip(['windows', 'bands', 'caps'], [int, float, float], lists):
+                grid[key] = [cast(v) for v in values.split(',')]
+        except ValueError:
+            return self.error_prompt("Backtest parameters must be comma separated numbers")
+        return Query('backtest', grid)
+
+    def prep_portfolio(self, caps):
+        """ Portfolio query with ticker, gross and net caps from {caps}, inf for uncapped """
+        if len(caps) > 3:
+            return self.error_prompt("Incorrect number of arguments")
+        try:
+            arg = {name: float(cap) for name, cap in zip(['ticker_cap', 'gross_cap', 'net_cap'], caps)}
+        except ValueError:
+            return self.error_prompt("Portfolio caps must be numbers")
+        return Query('portfolio', arg)
+
+    def prep_range(self, args):
+        """ Range query of ticker, from and to datetimes and optional downsampling interval in {args} """
+        if not (self.validate_dt_string(args[1]) and self.validate_dt_string(args[2])):
+            return self.error_prompt("Datetime format incorrect")
+        interval = args[3] if len(args) == 4 else None
+        if interval is not None and interval not in resample_map:
+            return self.error_prompt("Interval must be one of " + ', '.join(resample_map))
+        return Query('data', {'ticker': args[0], 'from': args[1], 'to': args[2], 'interval': interval})
+
+    def prep_macro(self, args):
+        """ Macro overlay query of asset, country and optional from and to dates in {args} """
+        if not 2 <= len(args) <= 4:
+            return self.error_prompt("Incorrect number of arguments")
+        for day in args[2:]:
+            try:
+                datetime.datetime.strptime(day, '%Y-%m-%d')
+            except ValueError:
+                return self.error_prompt("Date format incorrect, YYYY-MM-DD")
+        days = args[2:] + [None] * (4 - len(args))
+        return Query('macro', {'asset': args[0], 'country': args[1], 'from': days[0], 'to': days[1]})
+
     def validate_dt_string(self, dt_str):
         """ helper method to validate datetime format of {dt_str}"""
         try:
@@ -55,9 +305,8 @@ class Client(object):
         print(error_message)
         return None
 
-    def process_response(self, response_s):
+    def process_response(self, response):
         """ Process response sent back from the server """
-        response = pickle.loads(response_s)
 
         if response.result == SUCCESS:
             if response.inst == DATA:
@@ -65,34 +314,97 @@ class Client(object):
                 print(pd.DataFrame(response.data, index=ticker_index))
             elif (response.inst == ADD) or (response.inst == DELETE):
                 print(response.data)
+            elif (response.inst == SUBSCRIBE) or (response.inst == UNSUBSCRIBE):
+                print(response.data)
+            elif response.inst == STATS:
+                self.print_stats(response.data)
+            elif response.inst == BACKTEST:
+                print(pd.DataFrame(response.data).to_string(index=False))
+            elif response.inst == PORTFOLIO:
+                frame, position = self.portfolio_frames(response.data)
+                print(frame)
+                print("max drawdown {0:.2f}".format(frame['drawdown'].min() if len(frame) else 0.0))
+                print(position.to_string())
+            elif response.inst == MACRO:
+                data = dict(response.data)
+                print(pd.DataFrame(data, index=pd.DatetimeIndex(data.pop('datetime'), name='datetime')))
             elif response.inst == REPORT:
-                print("report refreshed")  # TODO: Should I put this into response.data and print that?
+                print("report refreshed")
+                for ticker, reason in (response.data or dict()).items():
+                    print("  {0} not refreshed: {1}".format(ticker, reason))
         else:
             print("Action failed: " + response.data)
 
+    def print_range(self, query):
+        """ Print the chunks of range {query} as they arrive """
+        arg = query.arg
+        header = True
+        try:
+            for frame in self.range_chunks(arg['ticker'], arg['from'], arg['to'], arg['interval']):
+                if len(frame):
+                    print(frame.to_string(header=header))
+                    header = False
+        except RuntimeError as e:
+            print("Action failed: {0}".format(e))
+
+    def watch(self, ticker):
+        """ Print bars pushed for {ticker} until Ctrl-C, then unsubscribe """
+        print("Streaming {0}, Ctrl-C to stop".format(ticker))
+        try:
+            while True:
+                data = dict(self.next_update())
+                data.pop('ticker')
+                print(pd.DataFrame(data).set_index('datetime').assign(ticker=ticker).to_string(header=False))
+        except KeyboardInterrupt:
+            self.unsubscribe(ticker)
+
+    @staticmethod
+    def print_stats(data):
+        """ Print a stats reply, Prometheus text as is, a snapshot as a latency table and the gauges """
+        if isinstance(data, str):
+            print(data)
+            return
+        snapshots = [('', data)] if 'histograms' in data else \
+            [('front', data['front'])] + [('shard {0}'.format(i), s) for i, s in enumerate(data['shards'])]
+        for title, snapshot in snapshots:
+            if title:
+                print(title)
+            rows = summarize(snapshot)
+            if rows:
+                print(pd.DataFrame(rows).to_string(index=False))
+            for kind in ['counters', 'gauges']:
+                for name, series_list in sorted(snapshot[kind].items()):
+                    for series in series_list:
+                        labels = ','.join('{0}={1}'.format(k, v) for k, v in sorted(series['labels'].items()))
+                        print('{0}{1} {2}'.format(name, '{' + labels + '}' if labels else '', series['value']))
+
     def run(self):
         """ Run client CLI """
 
-        while True:  # Infinite loop to open connection, send request, process response, and close connection
-            # One connection per request to free up socket resources given blocking implementation
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-
+        while True:  # Infinite loop to read instruction, send request and process response on one connection
             msg = input(">>")
-            s.connect((self.host, self.port))
             query = self.prep_request(msg)
             if not query:
-                s.close()
                 continue
 
-            query_s = pickle.dumps(query)
-            print('Sending message of size: {0}'.format(len(query_s)))
-            s.sendall(query_s)
-            data = s.recv(PACKET_SIZE)
-            self.process_response(data)
-            s.close()
+            try:
+                if query.inst == 'data' and isinstance(query.arg, dict):
+                    self.print_range(query)
+                    continue
+                response = self.receive(self.send(query))
+                self.process_response(response)
+                if query.inst == 'subscribe' and response.result == SUCCESS:
+                    self.watch(query.arg)
+            except (OSError, ProtocolError) as e:
+                # Connection is dropped and reopened on the next request
+                self.error_prompt("Connection to server lost: {0}".format(e))
 
 
 if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('-s', '--server', dest='addr', default='127.0.0.1:8080',
+                        help="Server address to query from, default local host port 8080")
+    args = parser.parse_args()
     client_args = vars(args)
     c = Client(**client_args)
     c.run()
@@ -1,6 +1,8 @@
 NUM_HOURS_TRADING_DAY = 6.5  # 9:30 to 4:00
 NUM_MIN_TRADING_DAY = NUM_HOURS_TRADING_DAY * 60
-PACKET_SIZE = 4096
+PROTOCOL_VERSION = 1
+FRAME_SIZE = 64 * 1024  # max payload bytes per wire frame, larger messages are streamed over several frames
+MAX_MESSAGE_SIZE = 256 * 1024 * 1024  # refuse to reassemble anything bigger
 SUCCESS = 0
 ERROR = -1
 DATA = 1
@@ -8,9 +10,22 @@ ADD = 2
 DELETE = 3
 REPORT = 4
 UNKNOWN = 5
+BACKTEST = 6
+SUBSCRIBE = 7
+UNSUBSCRIBE = 8
+UPDATE = 9  # bars pushed to subscribers, not a reply to a request
+STATS = 10
+CHUNK = 11  # part of a reply streamed in pieces, the reply itself follows the last one
+MACRO = 12
+PORTFOLIO = 13
+INSTRUCTIONS = ['data', 'add', 'delete', 'report', 'subscribe', 'unsubscribe', 'backtest', 'stats', 'macro',
+                'portfolio']
 
 interval_map = {'5min': 5,
                 '10min': 10,
                 '15min': 15,
                 '30min': 30,
                 '60min': 60}
+
+# Intervals range queries can be downsampled to
+resample_map = dict(interval_map, **{'120min': 120, 'day': 24 * 60})
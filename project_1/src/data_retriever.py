@@ -1,26 +1,66 @@
-import requests
 import pandas as pd
 import os
-DATA_PATH = '../data'
+import threading
+import time
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+
+
+class RateLimiter(object):
+    """ Token bucket allowing {calls} per {period} seconds, shared by every thread calling acquire """
+    def __init__(self, calls, period=60.0):
+        self.calls = calls
+        self.period = period
+        self.tokens = float(calls)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """ Block until a call is allowed """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.calls, self.tokens + (now - self.updated) * self.calls / self.period)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) * self.period / self.calls
+            time.sleep(wait)
 
 
 class DataRetriever(object):
-    """ Base class for the server to retrieve data"""
-    def __init__(self, key, url, interval):
+    """ Base class for the server to retrieve data
+
+        Requests go through one pooled HTTP session holding at most {max_connections} connections, so the
+        retriever can be called from many threads at once. {rate_limit} caps calls per minute to the provider.
+    """
+    def __init__(self, key, url, interval, rate_limit=None, max_connections=8, timeout=30):
         self.params = dict()
         self.params['key'] = key
         self.params['base_url'] = url
         self.params['interval'] = interval
 
+        self.timeout = timeout
+        self.limiter = RateLimiter(rate_limit) if rate_limit else None
+        import requests  # imported on first use, a server started from its snapshot may never call upstream
+        from requests.adapters import HTTPAdapter
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections, pool_block=True)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
     def build_url(self, ticker):
         """ Build API request URL using params specified in self.params """
         url = self.params['base_url'] + '&'.join([param_key + '=' + param for param_key, param in self.params.items()
-                                                  if param_key != 'url']) + '&symbol=' + ticker
+                                                  if param_key != 'base_url']) + '&symbol=' + ticker
         return url
 
     def retrieve(self, ticker):
         """ Retrieve raw data using ticker information and api details stored in the class"""
-        r = requests.get(self.build_url(ticker))
+        if self.limiter:
+            self.limiter.acquire()
+        r = self.session.get(self.build_url(ticker), timeout=self.timeout)
+        r.raise_for_status()
         return r.json()
 
     def process_data(self, data, ticker):
@@ -30,8 +70,8 @@ class DataRetriever(object):
 
 class DataRetrieverAV(DataRetriever):
     """ Data Retriever class for Alpha Vantage """
-    def __init__(self, key, url, interval):
-        super(DataRetrieverAV, self).__init__(key, url, interval)
+    def __init__(self, key, url, interval, **kwargs):
+        super(DataRetrieverAV, self).__init__(key, url, interval, **kwargs)
         # Define desired behavior, for example - regular trading day, full outputsize=trailing one month intraday data
         self.params['function'] = 'TIME_SERIES_INTRADAY'
         self.params['outputsize'] = 'full'
@@ -41,7 +81,12 @@ class DataRetrieverAV(DataRetriever):
     def process_data(self, data, ticker):
         """ Process Alpha Vantage Specific JSON format stock price data into standard dataframe format"""
 
-        df = pd.DataFrame(data["Time Series ({0})".format(self.params['interval'])]).transpose()
+        series_key = "Time Series ({0})".format(self.params['interval'])
+        if series_key not in data:
+            # Alpha Vantage answers 200 with a note when the call limit is hit or the symbol is unknown
+            raise ValueError(data.get('Note') or data.get('Information') or data.get('Error Message') or
+                             "No {0} in response for {1}".format(series_key, ticker))
+        df = pd.DataFrame(data[series_key]).transpose()
         df.drop(["1. open", "2. high", "3. low", "5. volume"], axis=1, inplace=True)
         df.rename({"4. close": "price"}, axis=1, inplace=True)
         df["ticker"] = ticker
@@ -53,8 +98,8 @@ class DataRetrieverAV(DataRetriever):
 class DataRetrieverFH(DataRetriever):
     """ Data Retriever class for Finn Hub """
 
-    def __init__(self, key, url, interval):
-        super(DataRetrieverFH, self).__init__(key, url, interval)
+    def __init__(self, key, url, interval, **kwargs):
+        super(DataRetrieverFH, self).__init__(key, url, interval, **kwargs)
         self.params['token'] = self.params.pop('key')
 
     def process_data(self, data, ticker):
@@ -79,28 +124,32 @@ class DataRetrieverFH(DataRetriever):
 
 class DataRetrieverPdAV(object):
     """ Pandas Data Retriever used for testing server logic, used to preserve api request"""
-    def __init__(self):
-        self.data_path = DATA_PATH
+    def __init__(self, data_path=DATA_PATH):
+        self.data_path = data_path
 
     def retrieve(self, ticker):
         return pd.read_csv(os.path.join(self.data_path, 'av_price_' + ticker + '.csv'), index_col=0)
 
     def process_data(self, df, ticker):
-        print("passing through df for {0}".format(ticker))
-        return df
+        """ Parse the saved datetime strings so the frame matches what the live retriever hands back """
+        df.index = pd.to_datetime(df.index, format='%Y-%m-%d %H:%M')
+        df.index.names = ['datetime']
+        return df[df.index.notna()]  # saved files can carry blank trailing rows
 
 
 class DataRetrieverPdFH(object):
     """ Pandas Data Retriever used for testing server logic, used to preserve api requests"""
-    def __init__(self):
-        self.data_path = DATA_PATH
+    def __init__(self, data_path=DATA_PATH):
+        self.data_path = data_path
 
     def retrieve(self, ticker):
         return pd.read_csv(os.path.join(self.data_path, 'fh_price_' + ticker + '.csv'), index_col=0)
 
     def process_data(self, df, ticker):
-        print("passing through df for {0}".format(ticker))
-        return df
+        """ Parse the saved datetime strings so the frame matches what the live retriever hands back """
+        df.index = pd.to_datetime(df.index, format='%Y-%m-%d %H:%M')
+        df.index.names = ['datetime']
+        return df[df.index.notna()]  # saved files can carry blank trailing rows
 
 
 if __name__ == '__main__':
@@ -0,0 +1,122 @@
+import os
+import threading
+import numpy as np
+from urllib.parse import quote, unquote
+
+# One record per bar, little-endian so the files read the same on any host
+HISTORY_DTYPE = np.dtype([('ts', '<i8'), ('price', '<f8')])
+INDEX_STRIDE = 4096  # records per time index entry
+
+
+class HistoryStore(object):
+    """ Append-only bar history on disk, one file of fixed width (ts, price) records per ticker
+
+        Bars are only ever appended in time order. Readers map the files and take zero-copy slices, a map is
+        dropped with the last slice of it, so the resident set follows the pages touched rather than the history
+        held. Next to each file a time index holds every {stride}-th timestamp, a time lookup searches it and
+        then one stride of records instead of the whole file.
+    """
+
+    def __init__(self, path='history', stride=INDEX_STRIDE):
+        self.path = os.path.abspath(path)  # resolved against today's cwd like the report
+        self.stride = stride
+        self.lock = threading.Lock()  # appends, and the row counts readers map up to
+        self.rows = dict()  # ticker -> records fully written
+        self.index = dict()  # ticker -> int64 timestamps of records 0, stride, 2 * stride, ...
+        os.makedirs(self.path, exist_ok=True)
+
+    def file(self, ticker, ext='hist'):
+        """ Path of {ticker}'s file of {ext}, the ticker escaped so it stays a name in the history directory """
+        return os.path.join(self.path, '{0}.{1}'.format(quote(ticker, safe=''), ext))
+
+    def __contains__(self, ticker):
+        return self.num_rows(ticker) > 0
+
+    def tickers(self):
+        """ Tickers with a history file """
+        return sorted(unquote(name[:-len('.hist')]) for name in os.listdir(self.path) if name.endswith('.hist'))
+
+    def num_rows(self, ticker):
+        """ Records of {ticker} held, 0 if it has no history """
+        with self.lock:
+            return self._open(ticker)
+
+    def _open(self, ticker):
+        """ Row count of {ticker}, reading it and its time index from disk on first use. Call with the lock """
+        rows = self.rows.get(ticker)
+        if rows is not None:
+            return rows
+        try:
+            rows = os.path.getsize(self.file(ticker)) // HISTORY_DTYPE.itemsize  # a torn last record is dropped
+        except OSError:
+            rows = 0
+        index = np.fromfile(self.file(ticker, 'hidx'), dtype='<i8') if os.path.exists(self.file(ticker, 'hidx')) \
+            else np.empty(0, dtype=np.int64)
+        if len(index) != -(-rows // self.stride):  # interrupted append, rebuild from the records
+            index = np.array(self._map(ticker, rows)['ts'][::self.stride], dtype=np.int64)
+            index.astype('<i8').tofile(self.file(ticker, 'hidx'))
+        self.rows[ticker] = rows
+        self.index[ticker] = index
+        return rows
+
+    def _map(self, ticker, rows):
+        if not rows:
+            return np.empty(0, dtype=HISTORY_DTYPE)
+        return np.memmap(self.file(ticker), dtype=HISTORY_DTYPE, mode='r', shape=(rows,))
+
+    def append(self, ticker, ts, price):
+        """ Append the bars of ascending int64 ns {ts} and {price} later than the last one held, returns the number
+            added. Only the bars appended are read, {ts} may be a mapped column
+        """
+        with self.lock:
+            rows = self._open(ticker)
+            if rows:
+                first = int(np.searchsorted(ts, self._map(ticker, rows)['ts'][-1], 'right'))
+                ts, price = ts[first:], price[first:]
+            if not len(ts):
+                return 0
+            records = np.empty(len(ts), dtype=HISTORY_DTYPE)
+            records['ts'] = ts
+            records['price'] = price
+            with open(self.file(ticker), 'r+b' if rows else 'wb') as f:
+                f.truncate(rows * HISTORY_DTYPE.itemsize)  # drop a record torn by an interrupted write
+                f.seek(0, os.SEEK_END)
+                f.write(records.tobytes())
+            # Index entries for the strides starting among the new records, written after the records they name
+            first = -(-rows // self.stride) * self.stride
+            entries = ts[first - rows::self.stride]
+            if len(entries):
+                with open(self.file(ticker, 'hidx'), 'ab') as f:
+                    f.write(entries.astype('<i8').tobytes())
+                self.index[ticker] = np.concatenate([self.index[ticker], entries])
+            self.rows[ticker] = rows + len(ts)
+            return len(ts)
+
+    def records(self, ticker):
+        """ Every record of {ticker} as a read-only memory-mapped array, empty if it has no history """
+        with self.lock:
+            rows = self._open(ticker)
+        return self._map(ticker, rows)
+
+    def locate(self, ticker, t, side='left'):
+        """ Position of the first record at or after ('left'), or after ('right'), int64 ns {t} """
+        with self.lock:
+            rows = self._open(ticker)
+            index = self.index[ticker]
+        block = max(int(np.searchsorted(index, t, side)) - 1, 0)
+        lo = block * self.stride
+        ts = np.array(self._map(ticker, rows)['ts'][lo:lo + self.stride + 1])  # one stride read from disk
+        return lo + int(np.searchsorted(ts, t, side))
+
+    def range(self, ticker, start, end):
+        """ Slice [lo, hi) of {ticker}'s records from int64 ns {start} to {end}, both inclusive """
+        return self.locate(ticker, start, 'left'), self.locate(ticker, end, 'right')
+
+    def slice(self, ticker, start, end):
+        """ Zero-copy records of {ticker} from int64 ns {start} to {end} """
+        lo, hi = self.range(ticker, start, end)
+        return self.records(ticker)[lo:hi]
+
+    def nbytes(self):
+        """ Bytes of history on disk """
+        return sum(os.path.getsize(os.path.join(self.path, name)) for name in os.listdir(self.path))
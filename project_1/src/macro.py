@@ -0,0 +1,179 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+MACRO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'project_2')
+COUNTRIES = ['US', 'CA']
+MACRO_SERIES = ['Unemployment', 'IndustrialProduction', 'GDP', 'HomeSales']
+LEADING = ['IndustrialProduction', 'HomeSales']  # the regime indicator is the sum of their z-scores
+LEVEL_SERIES = ['CA_HomeSales']  # released as a level, turned into percent growth like the others
+COUNTRY_ASSETS = {'US': ['ES1', 'DXY'], 'CA': ['PT1', 'CADUSD']}  # equity future and currency of each country
+MACRO_COLUMNS = ['datetime', 'price', 'return', 'momentum', 'indicator', 'regime', 'corr', 'position', 'pnl']
+
+
+def pct_returns(prices):
+    """ Return of each day over the day before, NaN on the first """
+    ret = np.full(len(prices), np.nan)
+    ret[1:] = prices[1:] / prices[:-1] - 1
+    return ret
+
+
+def rolling_zscore(values, window):
+    """ Z-score of each value against the {window} values up to and including it, NaN until the window fills """
+    rolling = pd.Series(values).rolling(window, min_periods=window)
+    return (values - rolling.mean().to_numpy()) / rolling.std().to_numpy()
+
+
+def rolling_corr(x, y, window):
+    """ Correlation of {x} and {y} over the trailing {window} days, NaN until the window holds no gap """
+    return pd.Series(x).rolling(window, min_periods=window).corr(pd.Series(y)).to_numpy()
+
+
+def asof(release_ts, values, ts):
+    """ {values} of the latest release on or before each of int64 ns {ts}, NaN before the first release """
+    if not len(values):
+        return np.full(len(ts), np.nan)
+    idx = np.searchsorted(release_ts, ts, 'right') - 1
+    return np.where(idx >= 0, values[np.maximum(idx, 0)], np.nan)
+
+
+class MacroPanel(object):
+    """ Daily asset prices and macro releases, loaded once into aligned arrays
+
+        {prices} is days x assets with NaN before an asset trades, {releases} maps '<country>_<series>' to the
+        int64 ns release dates and released values. Release dates are when a number became known, so joining
+        on them as of each day never looks ahead.
+    """
+
+    def __init__(self, ts, prices, assets, releases):
+        self.ts = ts
+        self.prices = prices
+        self.assets = assets
+        self.releases = releases
+        self.lock = threading.Lock()  # appends, and the day count readers take
+
+    @classmethod
+    def load(cls, path=MACRO_PATH):
+        """ Panel of asset_prices.csv and the <country>_<series>.csv release files under {path} """
+        df = pd.read_csv(os.path.join(path, 'asset_prices.csv'), index_col=0)
+        df.index = pd.to_datetime(df.index, format='%m/%d/%Y')
+        df = df.sort_index()
+        assets = [col.split(' ')[0] for col in df.columns]  # 'ES1 Index' -> 'ES1'
+        releases = dict()
+        for country in COUNTRIES:
+            for series in MACRO_SERIES:
+                name = '{0}_{1}'.format(country, series)
+                file = os.path.join(path, name + '.csv')
+                if not os.path.exists(file):
+                    continue
+                r = pd.read_csv(file)
+                ts = pd.to_datetime(r['dates'], format='%Y-%m-%d').to_numpy().astype('datetime64[ns]').view(np.int64)
+                value = r['actual_value'].to_numpy(dtype=np.float64)
+                order = np.argsort(ts, kind='stable')
+                ts, value = ts[order], value[order]
+                last = np.r_[ts[1:] != ts[:-1], True]  # a revision released the same day replaces the first print
+                ts, value = ts[last], value[last]
+                if name in LEVEL_SERIES:
+                    ts, value = ts[1:], (value[1:] / value[:-1] - 1) * 100
+                releases[name] = (ts, value)
+        ts = df.index.to_numpy().astype('datetime64[ns]').view(np.int64)
+        return cls(ts, df.to_numpy(dtype=np.float64), assets, releases)
+
+    def __len__(self):
+        return len(self.ts)
+
+    def column(self, asset):
+        """ Position of {asset} in the price columns, raises ValueError for an unknown one """
+        if asset not in self.assets:
+            raise ValueError("Unknown asset {0}, one of {1}".format(asset, ', '.join(self.assets)))
+        return self.assets.index(asset)
+
+    def append(self, ts, prices):
+        """ Add the day at int64 ns {ts} with one price per asset, later than the last day held """
+        with self.lock:
+            if len(self.ts) and ts <= self.ts[-1]:
+                raise ValueError("Day is not after the last one held")
+            self.ts = np.append(self.ts, np.int64(ts))
+            self.prices = np.vstack([self.prices, np.asarray(prices, dtype=np.float64)])
+
+    def release(self, name, ts, value):
+        """ Add a release of series {name} at int64 ns {ts}, after the last day held and its last release """
+        with self.lock:
+            release_ts, values = self.releases.get(name, (np.empty(0, dtype=np.int64), np.empty(0)))
+            if len(self.ts) and ts <= self.ts[-1] or len(release_ts) and ts <= release_ts[-1]:
+                raise ValueError("Release is older than the data held")  # would change days already calculated
+            self.releases[name] = (np.append(release_ts, np.int64(ts)), np.append(values, float(value)))
+
+    def snapshot(self):
+        """ Days, prices and releases held now, consistent with each other """
+        with self.lock:
+            return self.ts, self.prices, dict(self.releases)
+
+
+class MacroEngine(object):
+    """ Macro overlay of an asset: momentum traded only in the direction of the country's macro regime
+
+        The regime indicator is the sum of rolling z-scores of the country's leading releases over {window}
+        releases, each joined as of every day; regime is its sign. Momentum is the {lookback} day return and corr
+        the rolling correlation of daily returns with another asset. Results are kept per parameter set and days
+        added to the panel are calculated from the bars they need only, as RollingState does for intraday bars.
+    """
+
+    def __init__(self, panel):
+        self.panel = panel
+        self.results = dict()  # parameters -> column dict up to the days held when calculated
+        self.lock = threading.Lock()
+
+    def overlay(self, asset, country, window=36, lookback=63, corr_window=63, against=None):
+        """ Daily MACRO_COLUMNS of {asset} against {country}'s regime, correlated with {against} (default the
+            country's other asset). Raises ValueError on an unknown asset, country or a bad parameter
+        """
+        if country not in COUNTRY_ASSETS:
+            raise ValueError("Unknown country {0}, one of {1}".format(country, ', '.join(COUNTRY_ASSETS)))
+        if against is None:
+            against = next(a for a in COUNTRY_ASSETS[country] + COUNTRY_ASSETS['US'] if a != asset)
+        for name in (asset, against):
+            self.panel.column(name)  # an unknown one raises
+        if min(window, lookback, corr_window) < 2:
+            raise ValueError("Windows and lookback must be at least 2")
+        key = (asset, country, int(window), int(lookback), int(corr_window), against)
+        ts, prices, releases = self.panel.snapshot()
+        with self.lock:
+            held = self.results.get(key)
+        done = len(held['datetime']) if held is not None else 0
+        if done < len(ts):
+            tail = self.calculate(key, ts, prices, releases, done)
+            held = tail if held is None else {col: np.concatenate([held[col], tail[col]]) for col in MACRO_COLUMNS}
+            with self.lock:
+                self.results[key] = held
+        return held
+
+    def calculate(self, key, ts, prices, releases, lo):
+        """ Columns of days [{lo}, len({ts})), reading only the days before {lo} that the windows need """
+        asset, country, window, lookback, corr_window, against = key
+        lead = min(lo, max(lookback, corr_window) + 1)
+        ts = ts[lo - lead:]
+        price = prices[lo - lead:, self.panel.column(asset)]
+        other = prices[lo - lead:, self.panel.column(against)]
+
+        ret = pct_returns(price)
+        momentum = np.full(len(price), np.nan)
+        momentum[lookback:] = price[lookback:] / price[:-lookback] - 1
+        corr = rolling_corr(ret, pct_returns(other), corr_window)
+
+        indicator = np.zeros(len(ts))
+        for series in LEADING:
+            release_ts, values = releases.get('{0}_{1}'.format(country, series), (np.empty(0, np.int64), np.empty(0)))
+            indicator += asof(release_ts, rolling_zscore(values, window), ts)  # NaN until every series has a score
+        regime = np.nan_to_num(np.sign(indicator)).astype(np.int8)
+
+        # Follow momentum only when the regime agrees with it, flat otherwise or while either is unknown
+        trend = np.nan_to_num(np.sign(momentum)).astype(np.int8)
+        position = np.where(trend == regime, regime, 0).astype(np.int8)
+        # Trade at the close, PnL on the next day's return
+        pnl = np.full(len(price), np.nan)
+        pnl[1:] = position[:-1] * ret[1:]
+        columns = {'datetime': ts.view('datetime64[ns]'), 'price': price, 'return': ret, 'momentum': momentum,
+                   'indicator': indicator, 'regime': regime, 'corr': corr, 'position': position, 'pnl': pnl}
+        return {col: np.ascontiguousarray(columns[col][lead:]) for col in MACRO_COLUMNS}
@@ -1,13 +1,29 @@
 class Query(object):
     """ Query protocol definition """
-    def __init__(self, inst, arg=None):
+    def __init__(self, inst, arg=None, req_id=None):
         self.inst = inst
         self.arg = arg
+        self.req_id = req_id  # echoed back on the response so pipelined replies can be matched
+
+    def to_dict(self):
+        return {'inst': self.inst, 'arg': self.arg, 'req_id': self.req_id}
+
+    @classmethod
+    def from_dict(cls, fields):
+        return cls(fields['inst'], fields['arg'], fields.get('req_id'))
 
 
 class Response(object):
     """ Response protocol definition """
-    def __init__(self, inst, res, data=None):
+    def __init__(self, inst, res, data=None, req_id=None):
         self.inst = inst
         self.result = res
         self.data = data
+        self.req_id = req_id
+
+    def to_dict(self):
+        return {'inst': self.inst, 'result': self.result, 'data': self.data, 'req_id': self.req_id}
+
+    @classmethod
+    def from_dict(cls, fields):
+        return cls(fields['inst'], fields['result'], fields['data'], fields.get('req_id'))
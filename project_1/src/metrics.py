@@ -0,0 +1,166 @@
+import time
+import math
+import threading
+from bisect import bisect_left
+
+# Upper bounds of histogram buckets, an observation counts in the first bucket at or above it
+LATENCY_BUCKETS = [1e-5 * 2 ** i for i in range(24)] + [math.inf]  # 10us to ~84s
+SIZE_BUCKETS = [64 * 4 ** i for i in range(12)] + [math.inf]  # 64B to 256MB
+
+
+class Histogram(object):
+    """ Bucketed distribution of observed values, count and sum, Prometheus histogram semantics """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)  # per bucket, not cumulative
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Timer(object):
+    """ with block timing for Metrics.timer, a plain class as a generator based context manager costs more """
+    __slots__ = ('metrics', 'name', 'labels', 'start')
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class Metrics(object):
+    """ Registry of histograms, counters and gauges keyed by name and labels
+
+        Recording is a lock and a bisect, cheap enough for every request. snapshot() copies everything out as plain
+        dicts and lists so it can be sent over the wire, merged across shards and rendered.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = dict()  # (name, labels) -> Histogram
+        self.counters = dict()  # (name, labels) -> value
+        self.gauges = dict()  # (name, labels) -> value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        """ Record {value} in histogram {name} """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram(buckets)
+            hist.observe(value)
+
+    def timer(self, name, **labels):
+        """ Context manager recording the seconds spent in the with block in histogram {name} """
+        return Timer(self, name, labels)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def snapshot(self):
+        """ Copy of every metric, {'histograms'|'counters'|'gauges': {name: [series]}}, a histogram series is a
+            dict of labels, buckets, per bucket counts, count and sum, others of labels and value
+        """
+        out = {'histograms': dict(), 'counters': dict(), 'gauges': dict()}
+        with self.lock:
+            for (name, labels), hist in self.histograms.items():
+                out['histograms'].setdefault(name, []).append(
+                    {'labels': dict(labels), 'buckets': list(hist.buckets), 'counts': list(hist.counts),
+                     'count': hist.count, 'sum': hist.sum})
+            for kind, series in [('counters', self.counters), ('gauges', self.gauges)]:
+                for (name, labels), value in series.items():
+                    out[kind].setdefault(name, []).append({'labels': dict(labels), 'value': value})
+        return out
+
+
+def quantile(series, q):
+    """ Estimated {q} quantile of a histogram series, interpolated within the bucket it falls in """
+    if not series['count']:
+        return math.nan
+    rank = q * series['count']
+    seen = 0
+    lower = 0.0
+    for bound, count in zip(series['buckets'], series['counts']):
+        if count and seen + count >= rank:
+            if math.isinf(bound):
+                return lower
+            return lower + (bound - lower) * (rank - seen) / count
+        seen += count
+        lower = bound
+    return lower
+
+
+def summarize(snapshot):
+    """ One row per histogram series of {snapshot}: name, labels, count, mean, p50, p90, p99 """
+    rows = []
+    for name, series_list in sorted(snapshot['histograms'].items()):
+        for series in series_list:
+            count = series['count']
+            rows.append({'metric': name,
+                         'labels': ','.join('{0}={1}'.format(k, v) for k, v in sorted(series['labels'].items())),
+                         'count': count,
+                         'mean': series['sum'] / count if count else math.nan,
+                         'p50': quantile(series, 0.5),
+                         'p90': quantile(series, 0.9),
+                         'p99': quantile(series, 0.99)})
+    return rows
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                          for k, v in sorted(labels.items())) + '}'
+
+
+def _number(value):
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus(snapshots):
+    """ Prometheus text exposition of [(snapshot, extra labels)], series of one metric grouped under one TYPE """
+    families = dict()  # name -> (type, [lines])
+    for snapshot, extra in snapshots:
+        for name, series_list in snapshot['histograms'].items():
+            lines = families.setdefault(name, ('histogram', []))[1]
+            for series in series_list:
+                labels = dict(series['labels'], **extra)
+                cumulative = 0
+                for bound, count in zip(series['buckets'], series['counts']):
+                    cumulative += count
+                    lines.append('{0}_bucket{1} {2}'.format(name, _labels(dict(labels, le=_number(bound))),
+                                                            cumulative))
+                lines.append('{0}_sum{1} {2}'.format(name, _labels(labels), _number(series['sum'])))
+                lines.append('{0}_count{1} {2}'.format(name, _labels(labels), series['count']))
+        for kind, kind_type in [('counters', 'counter'), ('gauges', 'gauge')]:
+            for name, series_list in snapshot[kind].items():
+                lines = families.setdefault(name, (kind_type, []))[1]
+                for series in series_list:
+                    lines.append('{0}{1} {2}'.format(name, _labels(dict(series['labels'], **extra)),
+                                                     _number(series['value'])))
+    text = []
+    for name, (kind_type, lines) in sorted(families.items()):
+        text.append('# TYPE {0} {1}'.format(name, kind_type))
+        text.extend(lines)
+    return '\n'.join(text) + '\n'
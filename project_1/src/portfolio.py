@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+
+PORTFOLIO_COLUMNS = ['datetime', 'pnl', 'equity', 'drawdown', 'gross', 'net']
+
+
+def apply_caps(position, price, ticker_cap, gross_cap, net_cap):
+    """ Bring one bar's {position} of every ticker within caps in place: units per ticker, then dollars of net and of
+        gross exposure at {price}. Net excess is taken off the side causing it, gross excess off every ticker
+        alike, both in proportion to size, so neither undoes the other
+    """
+    np.clip(position, -ticker_cap, ticker_cap, out=position)
+    exposure = position * price
+    net = exposure.sum()
+    if net > net_cap:
+        side = exposure > 0
+        position[side] *= (net_cap - exposure[~side].sum()) / exposure[side].sum()
+    elif net < -net_cap:
+        side = exposure < 0
+        position[side] *= (-net_cap - exposure[~side].sum()) / exposure[side].sum()
+    gross = np.abs(position * price).sum()
+    if gross > gross_cap:
+        position *= gross_cap / gross
+    return position
+
+
+class Portfolio(object):
+    """ Positions of all tickers held under per ticker, gross and net caps, and the portfolio PnL, drawdown and
+        exposure they give, over one time x ticker matrix of bars aligned by bar time
+
+        Positions follow calculate_position, Position(t+1) = Position(t) + signal(t), and are then capped. A ticker
+        without a bar at some time keeps its position and last price. update() takes in only the bars added to the
+        blocks since the last call, the whole matrix is rebuilt when the tickers or a block are replaced.
+    """
+
+    def __init__(self, ticker_cap=np.inf, gross_cap=np.inf, net_cap=np.inf):
+        self.ticker_cap = ticker_cap
+        self.gross_cap = gross_cap
+        self.net_cap = net_cap
+        self.reset([])
+
+    @property
+    def capped(self):
+        return not (np.isinf(self.ticker_cap) and np.isinf(self.gross_cap) and np.isinf(self.net_cap))
+
+    def reset(self, tickers):
+        self.tickers = list(tickers)
+        self.uids = []
+        self.consumed = np.zeros(len(tickers), dtype=np.int64)  # bars of each ticker's block taken in
+        self.position = np.zeros(len(tickers))  # position held into the next bar
+        self.signal = np.zeros(len(tickers))  # last signal, moves the position at the next bar
+        self.price = np.full(len(tickers), np.nan)  # last price
+        self.equity = 0.0
+        self.peak = 0.0
+        self.columns = {col: np.empty(0, dtype=np.int64 if col == 'datetime' else np.float64)
+                        for col in PORTFOLIO_COLUMNS}
+
+    def update(self, tickers, blocks):
+        """ Take in the bars of {tickers}' store {blocks} not seen yet, returns the columns of every bar time """
+        uids = [block.uid for block in blocks]
+        last = self.columns['datetime'][-1] if len(self.columns['datetime']) else None
+        if tickers != self.tickers or uids != self.uids or last is not None and any(
+                len(block) > n and block['ts'][n] <= last for block, n in zip(blocks, self.consumed)):
+            self.reset(tickers)  # replaced, or a bar arrived for a time already taken in
+        self.uids = uids
+        new = [(block['ts'][n:], block['price'][n:], block['signal'][n:]) for block, n in zip(blocks, self.consumed)]
+        self.consumed = np.array([len(block) for block in blocks], dtype=np.int64)
+        times = np.unique(np.concatenate([ts for ts, _, _ in new])) if new else np.empty(0, dtype=np.int64)
+        if len(times):
+            self.extend(times, new)
+        return self.columns
+
+    def extend(self, times, new):
+        """ Append the rows of bar {times} built from each ticker's {new} (ts, price, signal) bars """
+        rows, n = len(times), len(self.tickers)
+        price = np.full((rows, n), np.nan)
+        signal = np.zeros((rows, n))
+        for j, (ts, p, s) in enumerate(new):
+            slot = np.searchsorted(times, ts)
+            price[slot, j] = p
+            signal[slot, j] = s
+        # Carry last prices through the times a ticker has no bar
+        price = pd.DataFrame(np.vstack([self.price, price])).ffill().to_numpy()
+        prev_price, price = price[:-1], price[1:]
+
+        # Position of each row from the previous row's position and signal
+        step = np.vstack([self.signal, signal[:-1]])
+        if self.capped:
+            position = np.empty((rows, n))
+            held = self.position
+            for t in range(rows):
+                held = apply_caps(held + step[t], np.nan_to_num(price[t]), self.ticker_cap, self.gross_cap,
+                                  self.net_cap)
+                position[t] = held
+        else:
+            position = self.position + np.cumsum(step, axis=0)
+        prev_position = np.vstack([self.position, position[:-1]])
+
+        # PnL(t+1) = Position(t) * [S(t+1) - S(t)] summed over tickers, nothing before a ticker's first bar
+        pnl = np.nansum(prev_position * (price - prev_price), axis=1)
+        equity = self.equity + np.cumsum(pnl)
+        peak = np.maximum.accumulate(np.maximum(equity, self.peak))
+        exposure = position * np.nan_to_num(price)
+        rows = {'datetime': times, 'pnl': pnl, 'equity': equity, 'drawdown': equity - peak,
+                'gross': np.abs(exposure).sum(axis=1), 'net': exposure.sum(axis=1)}
+        self.columns = {col: np.concatenate([self.columns[col], rows[col]]) for col in PORTFOLIO_COLUMNS}
+        self.position = position[-1]
+        self.signal = signal[-1]
+        self.price = price[-1]
+        self.equity = equity[-1]
+        self.peak = peak[-1]
@@ -0,0 +1,352 @@
+import struct
+import sys
+from array import array
+import numpy as np
+from message import Query, Response
+from constant import *
+
+# Frame header: magic, protocol version, flags, payload length of this frame
+HEADER = struct.Struct('<2sBBI')
+MAGIC = b'TS'
+FLAG_FINAL = 1  # last frame of a message
+
+_INT = struct.Struct('<q')
+_FLOAT = struct.Struct('<d')
+_LEN = struct.Struct('<I')
+
+# Value tags
+T_NONE = b'N'
+T_TRUE = b'T'
+T_FALSE = b'F'
+T_INT = b'i'
+T_FLOAT = b'd'
+T_STR = b's'
+T_BYTES = b'b'
+T_LIST = b'l'
+T_DICT = b'm'
+T_FLOAT_LIST = b'D'  # list of floats packed as float64
+T_INT_LIST = b'Q'  # list of ints packed as int64
+T_STR_LIST = b'S'  # list of strings, utf-8 joined on NUL
+T_NDARRAY = b'a'  # numeric numpy array, raw little-endian buffer
+
+# Message kinds
+K_QUERY = b'q'
+K_RESPONSE = b'r'
+
+NDARRAY_KINDS = 'biufM'  # bool, int, uint, float, datetime64, never object arrays
+MAX_DEPTH = 32
+INT64_MIN = -2 ** 63
+INT64_MAX = 2 ** 63 - 1
+LITTLE_ENDIAN = sys.byteorder == 'little'
+_DTYPES = dict()
+
+
+class ProtocolError(Exception):
+    """ Malformed, oversized or wrong version frame or payload """
+
+
+def _packed(typecode, values):
+    """ Pack homogeneous {values} into little-endian bytes """
+    arr = array(typecode, values)
+    if not LITTLE_ENDIAN:
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _encode(obj, out, depth):
+    if depth > MAX_DEPTH:
+        raise ProtocolError("Payload nested too deep")
+    t = type(obj)
+    if obj is None:
+        out += T_NONE
+    elif t is bool or t is np.bool_:
+        out += T_TRUE if obj else T_FALSE
+    elif t is int or isinstance(obj, np.integer):
+        if not INT64_MIN <= obj <= INT64_MAX:
+            raise ProtocolError("Integer out of int64 range")
+        out += T_INT
+        out += _INT.pack(int(obj))
+    elif t is float or isinstance(obj, np.floating):
+        out += T_FLOAT
+        out += _FLOAT.pack(float(obj))
+    elif t is str:
+        b = obj.encode('utf-8')
+        out += T_STR
+        out += _LEN.pack(len(b))
+        out += b
+    elif t is bytes or t is bytearray:
+        out += T_BYTES
+        out += _LEN.pack(len(obj))
+        out += obj
+    elif t is np.ndarray:
+        if obj.dtype.kind not in NDARRAY_KINDS:
+            raise ProtocolError("Unsupported array dtype {0}".format(obj.dtype))
+        arr = obj.astype(obj.dtype.newbyteorder('<'), copy=False)
+        dtype = arr.dtype.str.encode('ascii')
+        out += T_NDARRAY
+        out += bytes([len(dtype)])
+        out += dtype
+        out += bytes([arr.ndim])
+        for dim in arr.shape:
+            out += _LEN.pack(dim)
+        out += arr.tobytes()
+    elif t is list or t is tuple:
+        # Homogeneous lists are packed in one go, the first element decides which packing to try
+        first = type(obj[0]) if obj else None
+        if first is float and all(type(x) is float for x in obj):
+            out += T_FLOAT_LIST
+            out += _LEN.pack(len(obj))
+            out += _packed('d', obj)
+            return
+        if first is int and all(type(x) is int for x in obj) and INT64_MIN <= min(obj) and max(obj) <= INT64_MAX:
+            out += T_INT_LIST
+            out += _LEN.pack(len(obj))
+            out += _packed('q', obj)
+            return
+        if first is str:
+            try:
+                joined = '\x00'.join(obj)  # TypeError if anything is not a string
+            except TypeError:
+                joined = None
+            if joined is not None and joined.count('\x00') == len(obj) - 1:
+                joined = joined.encode('utf-8')
+                out += T_STR_LIST
+                out += _LEN.pack(len(obj))
+                out += _LEN.pack(len(joined))
+                out += joined
+                return
+        out += T_LIST
+        out += _LEN.pack(len(obj))
+        for x in obj:
+            _encode(x, out, depth + 1)
+    elif t is dict:
+        out += T_DICT
+        out += _LEN.pack(len(obj))
+        for k, v in obj.items():
+            _encode(k, out, depth + 1)
+            _encode(v, out, depth + 1)
+    else:
+        raise ProtocolError("Cannot encode type {0}".format(t.__name__))
+
+
+def encode(obj):
+    """ Encode plain python values and numeric numpy arrays into bytes """
+    out = bytearray()
+    _encode(obj, out, 0)
+    return bytes(out)
+
+
+class _Decoder(object):
+    """ Bounds checked reader over an encoded payload """
+
+    def __init__(self, buf):
+        self.buf = memoryview(buf)
+        self.pos = 0
+
+    def take(self, n):
+        end = self.pos + n
+        if end > len(self.buf):
+            raise ProtocolError("Truncated payload")
+        chunk = self.buf[self.pos:end]
+        self.pos = end
+        return chunk
+
+    def length(self):
+        return _LEN.unpack(self.take(4))[0]
+
+    def unpacked(self, typecode, n, itemsize):
+        arr = array(typecode)
+        arr.frombytes(self.take(n * itemsize))
+        if not LITTLE_ENDIAN:
+            arr.byteswap()
+        return arr
+
+    def dtype(self, name):
+        """ Parse and vet an array dtype, cached as only a handful ever show up """
+        dtype = _DTYPES.get(name)
+        if dtype is None:
+            try:
+                dtype = np.dtype(str(name, 'ascii'))
+            except (TypeError, ValueError, UnicodeDecodeError):
+                raise ProtocolError("Bad array dtype")
+            if dtype.kind not in NDARRAY_KINDS:
+                raise ProtocolError("Unsupported array dtype {0}".format(dtype))
+            if len(_DTYPES) < 64:
+                _DTYPES[name] = dtype
+        return dtype
+
+    def value(self, depth=0):
+        if depth > MAX_DEPTH:
+            raise ProtocolError("Payload nested too deep")
+        tag = bytes(self.take(1))
+        if tag == T_NONE:
+            return None
+        elif tag == T_TRUE:
+            return True
+        elif tag == T_FALSE:
+            return False
+        elif tag == T_INT:
+            return _INT.unpack(self.take(8))[0]
+        elif tag == T_FLOAT:
+            return _FLOAT.unpack(self.take(8))[0]
+        elif tag == T_STR:
+            return str(self.take(self.length()), 'utf-8')
+        elif tag == T_BYTES:
+            return bytes(self.take(self.length()))
+        elif tag == T_FLOAT_LIST:
+            return self.unpacked('d', self.length(), 8).tolist()
+        elif tag == T_INT_LIST:
+            return self.unpacked('q', self.length(), 8).tolist()
+        elif tag == T_STR_LIST:
+            n = self.length()
+            result = str(self.take(self.length()), 'utf-8').split('\x00')
+            if len(result) != n:
+                raise ProtocolError("String list length mismatch")
+            return result
+        elif tag == T_NDARRAY:
+            dtype = self.dtype(bytes(self.take(self.take(1)[0])))
+            shape = tuple(self.length() for _ in range(self.take(1)[0]))
+            count = 1
+            for dim in shape:
+                count *= dim
+            return np.frombuffer(self.take(count * dtype.itemsize), dtype=dtype).reshape(shape)
+        elif tag == T_LIST:
+            return [self.value(depth + 1) for _ in range(self.length())]
+        elif tag == T_DICT:
+            n = self.length()
+            result = dict()
+            for _ in range(n):
+                k = self.value(depth + 1)
+                result[k] = self.value(depth + 1)
+            return result
+        raise ProtocolError("Unknown tag {0!r}".format(tag))
+
+
+def decode(buf):
+    """ Decode bytes produced by encode() """
+    decoder = _Decoder(buf)
+    obj = decoder.value()
+    if decoder.pos != len(decoder.buf):
+        raise ProtocolError("Trailing bytes after payload")
+    return obj
+
+
+def encode_message(msg):
+    """ Encode a Query or Response into a message payload """
+    if isinstance(msg, Query):
+        return K_QUERY + encode(msg.to_dict())
+    elif isinstance(msg, Response):
+        return K_RESPONSE + encode(msg.to_dict())
+    raise ProtocolError("Cannot encode message type {0}".format(type(msg).__name__))
+
+
+def encode_response(response):
+    """ Payload of {response} up to its request id, the same for every request it answers. Completed by
+        send_encoded, the request id is the last field so the rest is encoded once
+    """
+    fields = response.to_dict()
+    del fields['req_id']
+    out = bytearray(K_RESPONSE)
+    out += T_DICT
+    out += _LEN.pack(len(fields) + 1)
+    for k, v in fields.items():
+        _encode(k, out, 1)
+        _encode(v, out, 1)
+    _encode('req_id', out, 1)
+    return bytes(out)
+
+
+def decode_message(payload):
+    """ Decode a message payload back into a Query or Response, anything malformed raises ProtocolError """
+    kind = bytes(payload[:1])
+    try:
+        fields = decode(memoryview(payload)[1:])
+    except (TypeError, ValueError, UnicodeDecodeError, struct.error) as e:  # an unhashable key, bad UTF-8
+        raise ProtocolError("Malformed payload: {0}".format(e)) from e
+    if not isinstance(fields, dict):
+        raise ProtocolError("Message fields must be a mapping")
+    try:
+        if kind == K_QUERY:
+            return Query.from_dict(fields)
+        elif kind == K_RESPONSE:
+            return Response.from_dict(fields)
+    except (KeyError, TypeError, ValueError) as e:
+        raise ProtocolError("Message fields incomplete") from e
+    raise ProtocolError("Unknown message kind {0!r}".format(kind))
+
+
+def send_payload(sock, payload):
+    """ Write {payload} as a sequence of frames of at most FRAME_SIZE bytes """
+    view = memoryview(payload)
+    total = len(view)
+    pos = 0
+    while True:
+        chunk = view[pos:pos + FRAME_SIZE]
+        pos += len(chunk)
+        flags = FLAG_FINAL if pos >= total else 0
+        sock.sendall(HEADER.pack(MAGIC, PROTOCOL_VERSION, flags, len(chunk)) + chunk)
+        if flags & FLAG_FINAL:
+            return
+
+
+def recv_exact(sock, n):
+    """ Read exactly {n} bytes, None if the peer closed the connection before the first byte """
+    buf = bytearray(n)
+    view = memoryview(buf)
+    pos = 0
+    while pos < n:
+        read = sock.recv_into(view[pos:], n - pos)
+        if not read:
+            if pos == 0:
+                return None
+            raise ProtocolError("Connection closed mid frame")
+        pos += read
+    return buf
+
+
+def recv_payload(sock):
+    """ Read frames until the final one and return the reassembled payload, None on a clean close """
+    parts = []
+    size = 0
+    while True:
+        header = recv_exact(sock, HEADER.size)
+        if header is None:
+            if parts:
+                raise ProtocolError("Connection closed mid message")
+            return None
+        magic, version, flags, length = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise ProtocolError("Bad frame magic")
+        if version != PROTOCOL_VERSION:
+            raise ProtocolError("Unsupported protocol version {0}".format(version))
+        size += length
+        if size > MAX_MESSAGE_SIZE:
+            raise ProtocolError("Message larger than {0} bytes".format(MAX_MESSAGE_SIZE))
+        chunk = recv_exact(sock, length) if length else bytearray()
+        if chunk is None:
+            raise ProtocolError("Connection closed mid frame")
+        parts.append(chunk)
+        if flags & FLAG_FINAL:
+            return parts[0] if len(parts) == 1 else b''.join(parts)
+
+
+def send_message(sock, msg):
+    """ Encode and send a Query or Response, returns the payload size """
+    payload = encode_message(msg)
+    send_payload(sock, payload)
+    return len(payload)
+
+
+def send_encoded(sock, prefix, req_id):
+    """ Send the reply {prefix} from encode_response tagged with {req_id}, returns the payload size """
+    payload = prefix + encode(req_id)
+    send_payload(sock, payload)
+    return len(payload)
+
+
+def recv_message(sock):
+    """ Receive and decode one Query or Response, None when the peer closed the connection """
+    payload = recv_payload(sock)
+    if payload is None:
+        return None
+    return decode_message(payload)
@@ -0,0 +1,168 @@
+import os
+import json
+import threading
+import numpy as np
+import pandas as pd
+from urllib.parse import quote, unquote
+from store import BLOCK_DTYPES, REPORT_COLUMNS, TickerBlock
+
+MANIFEST = 'manifest.json'
+
+
+def column_file(path, ticker, name):
+    """ File of column {name} of {ticker} in the columnar report at {path}, the ticker escaped so it stays a name """
+    return os.path.join(path, '{0}.{1}.bin'.format(quote(ticker, safe=''), name))
+
+
+class CsvReportWriter(object):
+    """ Whole report as one text file, every ticker's bars stacked, rewritten on each write """
+
+    def __init__(self, path='report.csv', meta=None):
+        self.path = os.path.abspath(path)  # writes run later on another thread, resolve against today's cwd
+        self.meta = meta  # not kept, a csv has nowhere to put it
+
+    def write(self, blocks):
+        """ Write {blocks}, a dict of ticker to TickerBlock snapshot """
+        if blocks:
+            df = pd.concat([block.frame(ticker) for ticker, block in blocks.items()])
+        else:
+            df = pd.DataFrame(columns=REPORT_COLUMNS, index=pd.DatetimeIndex([], name='datetime'))
+        tmp = self.path + '.tmp'
+        df.to_csv(tmp)
+        os.replace(tmp, self.path)
+
+
+class ColumnarReportWriter(object):
+    """ Report as a directory of raw little-endian column files, one per ticker and column, and a manifest
+
+        Bars appended to a ticker since the last write are appended to its files, a ticker whose block was
+        replaced, after a full recalculation or a re-add, is rewritten. The manifest holding the row count of
+        every ticker is swapped in last, so a reader never sees rows that are not completely written. {meta},
+        the bar interval for one, is kept in the manifest for readers to check against.
+    """
+
+    def __init__(self, path='report', meta=None):
+        self.path = os.path.abspath(path)  # writes run later on another thread, resolve against today's cwd
+        self.meta = meta
+        self.written = dict()  # ticker -> (block uid, rows on disk)
+        os.makedirs(path, exist_ok=True)
+
+    def file(self, ticker, name):
+        return column_file(self.path, ticker, name)
+
+    def adopt(self, blocks):
+        """ Take {blocks}, opened from this report, as written so later writes append to their files """
+        for ticker, block in blocks.items():
+            self.written[ticker] = (block.uid, len(block))
+
+    def write(self, blocks):
+        """ Write {blocks}, a dict of ticker to TickerBlock snapshot """
+        for ticker, block in blocks.items():
+            uid, rows = self.written.get(ticker, (None, 0))
+            if uid != block.uid or rows > len(block):
+                rows = 0  # different bars, rewrite from the start
+            elif rows == len(block):
+                continue  # nothing new
+            for name, _ in BLOCK_DTYPES:
+                self.append(self.file(ticker, name), block[name][rows:], rows)
+            self.written[ticker] = (block.uid, len(block))
+
+        for ticker in set(self.written) - set(blocks):  # deleted since the last write
+            del self.written[ticker]
+        manifest = {'columns': [[name, np.dtype(dtype).newbyteorder('<').str] for name, dtype in BLOCK_DTYPES],
+                    'tickers': {ticker: rows for ticker, (_, rows) in self.written.items()},
+                    'meta': self.meta}
+        tmp = os.path.join(self.path, MANIFEST + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp, os.path.join(self.path, MANIFEST))
+
+        for name in os.listdir(self.path):  # files of deleted tickers, no longer listed so nobody maps them
+            if name.endswith('.bin') and unquote(name.rsplit('.', 2)[0]) not in self.written:
+                os.remove(os.path.join(self.path, name))
+
+    @staticmethod
+    def append(path, values, start):
+        """ Write {values} to {path} from row {start} on, dropping anything past it
+
+            A rewrite goes to a new file swapped in, anyone mapping the old one keeps valid pages.
+        """
+        values = values.astype(values.dtype.newbyteorder('<'), copy=False)
+        if not start or not os.path.exists(path):
+            with open(path + '.tmp', 'wb') as f:
+                f.write(values.tobytes())
+            os.replace(path + '.tmp', path)
+            return
+        with open(path, 'r+b') as f:
+            f.truncate(start * values.itemsize)  # bytes past the manifest's rows are from an interrupted write
+            f.seek(0, os.SEEK_END)
+            f.write(values.tobytes())
+
+
+def read_manifest(path='report'):
+    """ Manifest of the columnar report at {path}: columns, rows per ticker and the writer's meta """
+    with open(os.path.join(path, MANIFEST)) as f:
+        return json.load(f)
+
+
+def open_report(path='report', mode='r', manifest=None):
+    """ Latest report written by ColumnarReportWriter, a dict of ticker to memory-mapped TickerBlock
+
+        Read-only by default, mode 'c' maps copy-on-write so the blocks can be written without touching the files.
+    """
+    manifest = manifest or read_manifest(path)
+    blocks = dict()
+    for ticker, rows in manifest['tickers'].items():
+        cols = dict()
+        for name, dtype in manifest['columns']:
+            if rows:
+                cols[name] = np.memmap(column_file(path, ticker, name), dtype=dtype, mode=mode, shape=(rows,))
+            else:
+                cols[name] = np.empty(0, dtype=dtype)
+        blocks[ticker] = TickerBlock.from_columns(cols, rows)
+    return blocks
+
+
+REPORT_WRITERS = {'csv': (CsvReportWriter, 'report.csv'),
+                  'columnar': (ColumnarReportWriter, 'report')}
+
+
+class BackgroundReporter(object):
+    """ Runs a report writer on its own thread, so saving the report does not hold up requests
+
+        Only the latest submitted snapshot is pending, one submitted while a write is running replaces any older
+        one still waiting. Snapshots share the server's arrays rather than copying them.
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.cond = threading.Condition()
+        self.pending = None
+        self.busy = False
+        self.error = None  # last write failure, kept for diagnostics
+        threading.Thread(target=self.loop, daemon=True).start()
+
+    def submit(self, blocks):
+        """ Queue {blocks}, a dict of ticker to TickerBlock snapshot, to be written """
+        with self.cond:
+            self.pending = blocks
+            self.cond.notify_all()
+
+    def flush(self, timeout=None):
+        """ Wait until everything submitted is written, False on timeout """
+        with self.cond:
+            return self.cond.wait_for(lambda: self.pending is None and not self.busy, timeout)
+
+    def loop(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.pending is not None)
+                blocks, self.pending, self.busy = self.pending, None, True
+            try:
+                self.writer.write(blocks)
+            except Exception as e:  # a failed write must not stop later reports
+                self.error = e
+                print("Unable to save report: {0}".format(e))
+            with self.cond:
+                self.busy = False
+                self.cond.notify_all()
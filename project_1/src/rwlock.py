@@ -0,0 +1,47 @@
+import threading
+from contextlib import contextmanager
+
+
+class ReadWriteLock(object):
+    """ Shared lock for readers, exclusive lock for writers
+
+        Waiting writers block new readers so a steady stream of data queries cannot starve add/delete/report.
+        Not reentrant, do not take the read lock while holding the write lock or vice versa.
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.readers = 0
+        self.writer = False
+        self.waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        """ Hold the lock shared for the duration of the with block """
+        with self.cond:
+            while self.writer or self.waiting_writers:
+                self.cond.wait()
+            self.readers += 1
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.readers -= 1
+                if not self.readers:
+                    self.cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        """ Hold the lock exclusively for the duration of the with block """
+        with self.cond:
+            self.waiting_writers += 1
+            while self.writer or self.readers:
+                self.cond.wait()
+            self.waiting_writers -= 1
+            self.writer = True
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.writer = False
+                self.cond.notify_all()
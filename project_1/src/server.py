@@ -1,78 +1,333 @@
+import numpy as np
 import pandas as pd
 import socket
 import yaml
 import os
+import time
+import bisect
+import datetime
+import logging
+import threading
 from argparse import ArgumentParser
-import pickle
-from data_retriever import DataRetrieverAV, DataRetrieverFH, DataRetrieverPdAV, DataRetrieverPdFH
-from message import Query, Response
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from data_retriever import DataRetrieverAV, DataRetrieverFH
+from message import Response
+from protocol import send_message, recv_message, encode_response, send_encoded, ProtocolError
+from signal_engine import SignalEngine, RollingState
+from store import ColumnarStore, TickerBlock, ANALYTIC_COLUMNS, frame_ts
+from cache import FrameCache, ResponseCache
+from history import HistoryStore
+from macro import MacroPanel, MacroEngine
+from portfolio import Portfolio
+from report import BackgroundReporter, ColumnarReportWriter, REPORT_WRITERS, MANIFEST, read_manifest, open_report
+from stream import QuoteStream, FinnHubQuoteFeed
+from metrics import Metrics, render_prometheus, SIZE_BUCKETS
+from rwlock import ReadWriteLock
+from timeindex import parse_query_datetime, to_int64, nearest_positions, range_positions, downsample
 from constant import *
 
-parser = ArgumentParser()
-parser.add_argument('-t', '--tickers', dest='tickers', nargs='*',
-                    help="list of tickers", default=['IBM'])  # Assuming a default server set up on IBM prices
-parser.add_argument('-p', '--port', dest='port', default=8080, type=int,
-                    help='port to bind the server to, use any value over 1023')
-args = parser.parse_args()
+
+def join_chunks(chunks):
+    """ Columns of the streamed {chunks} of a reply concatenated into one dict """
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
 
 
 class Server(object):
 
     # TODO: Add Unit Test
-    def __init__(self, tickers, port):
+    def __init__(self, tickers, port, workers=0, av=None, fh=None, feed=None, interval=None, fast_start=None):
+        self.started = time.perf_counter()  # time to first response is counted from here
         # Initialization of config parameters
-        _path = os.getcwd()
+        _path = os.path.dirname(os.path.abspath(__file__))
         with open(os.path.join(_path, r'../cfg/server_cfg.yaml')) as f:
             self.cfg = yaml.safe_load(f)
-        self.interval = self.cfg['interval']
-        self.tickers = tickers
+        self.interval = interval or self.cfg['interval']  # bar interval, config default unless given
+        self.incremental = self.cfg['incremental_refresh']
+        self.pull_workers = self.cfg['pull_workers']
+        self.chunk_rows = self.cfg['range_chunk_rows']
+        # Processed upstream frames kept on disk, relative to the working directory like the report
+        self.cache = FrameCache(self.cfg['cache_dir'], self.cfg['cache_ttl'],
+                                self.cfg['cache_max_mb'] * 1024 * 1024) if self.cfg['cache'] else None
+        # Every bar pulled or streamed is appended to disk, ranges reaching back past the held bars read from it
+        self.history = HistoryStore(self.cfg['history_dir']) if self.cfg['history'] else None
+        self.macro = None  # daily asset and macro release panel with its analytics, loaded on the first macro query
+        self.macro_lock = threading.Lock()
+        self.portfolios = OrderedDict()  # caps -> Portfolio kept up to date with the held bars on each query
+        self.portfolio_lock = threading.Lock()
+        self.tickers = []
+        self.rank = {ticker: i for i, ticker in enumerate(tickers)}  # startup tickers are held in this order
+        self.next_rank = len(tickers)  # tickers added later go after every one held
+        self.ranks = []  # rank of each held ticker in the order of tickers, sorted, where a new one goes is a bisect
+        self.pending = dict()  # startup ticker not loaded yet -> Event set once it is, fast start loads them later
+        self.loading = set()  # pending tickers being pulled, by the background loader or on first access
+        self.first_response = None
+        self.version = 0  # bumped whenever the held data changes, cached replies are only valid for one version
+        # Encoded data snapshot replies by the bars they resolve to, identical concurrent requests are computed once
+        self.snapshots = ResponseCache(self.cfg['snapshot_cache']) if self.cfg['snapshot_cache'] else None
+        self.breaks = None  # (version, times where some ticker's closest bar changes) of the last snapshot asked for
+        self.metrics = Metrics()  # request latencies, pull and calculate stage timings, payload sizes
+        # Backtest sweeps share worker processes started once the server is bound, 0 runs them in this process
+        self.backtest_processes = self.cfg['backtest_processes']
+        self.backtest_pool = None
 
         # Initialize data
-        self.data = dict()
+        self.data = ColumnarStore()  # bars and analytics of every ticker, one contiguous array per column
+        self.states = dict()  # running window state per ticker for incremental refresh
+        self.lock = ReadWriteLock()  # data queries share, add/delete/report swap data in exclusively
+        writer, path = REPORT_WRITERS[self.cfg['report_format']]
+        # report saved off the request path, the interval recorded so a warm start never mixes bar sizes
+        self.reporter = BackgroundReporter(writer(path, meta={'interval': self.interval}))
 
         self.av_cfg = dict()
         self.fh_cfg = dict()
         self.init_dr_cfg(tickers, self.interval)
 
-        self.av = DataRetrieverAV(**self.av_cfg)
-        self.fh = DataRetrieverFH(**self.fh_cfg)
-        # self.av = DataRetrieverPdAV()          # Testing server using pandas data retriever
-        # self.fh = DataRetrieverPdFH()
-        for ticker in self.tickers:
-            self.data[ticker] = self.pull_data(ticker)
-
-        # Calculate Signal, Position, PnL
-        for ticker in self.tickers:
-            self.calculate_all(ticker)
-
-        self.save_data()  # Save data to report.csv
+        # Default retrievers are built on first use, a warm start may not need them
+        self.retrievers = {'av': av, 'fh': fh}
+        self.retriever_lock = threading.Lock()
+        # Testing server using pandas data retriever: av=DataRetrieverPdAV(), fh=DataRetrieverPdFH()
+        self.engine = SignalEngine(self.window_size())
+
+        # Tickers in a recent report start from it, the rest are pulled and calculated for all tickers in one
+        # batch, before serving or with fast start in the background
+        held = self.warm_start(tickers) if self.cfg['warm_start'] else []
+        rest = [ticker for ticker in tickers if ticker not in held]
+        # Warm started tickers are as old as the report, refreshed in the background once the server is bound
+        self.warm = threading.Thread(target=self.refresh_warm, args=(held,), daemon=True) if held else None
+        self.loader = None
+        if fast_start if fast_start is not None else self.cfg['fast_start']:
+            self.pending.update((ticker, threading.Event()) for ticker in rest)
+            self.loader = threading.Thread(target=self.load_pending, args=(rest,), daemon=True)
+        elif rest:
+            self.load(rest)
+        if self.loader is None:
+            self.rank.clear()  # startup is over, a startup ticker deleted and added again goes last
+
+        # Live quotes built into bars and pushed to subscribed connections, started with the server
+        self.subscribers = dict()  # ticker -> {conn: send lock}
+        self.sub_lock = threading.Lock()
+        if feed is None and self.cfg['stream']:
+            feed = FinnHubQuoteFeed(self.fh)
+        self.stream = QuoteStream(feed, interval_map[self.interval], self.held_tickers, self.ingest_bars,
+                                  self.cfg['stream_period']) if feed is not None else None
 
         # Initialize Network
         self.host = "127.0.0.1"
         self.port = port
-
-    def pull_data(self, ticker):
-        """ pull ticker price data from Alpha Vantage and Finn Hub, stitch together"""
-
-        # Call Alpha Vantage and Finn Hub data retriever instances
-        _df = pd.concat([self.av.process_data(self.av.retrieve(ticker), ticker),
-                         self.fh.process_data(self.fh.retrieve(ticker), ticker)])
+        self.workers = workers  # 0 handles requests in order on each connection's own thread
+        self.pool = None
+
+        if self.loader is not None:
+            self.loader.start()
+        self.metrics.set('trading_startup_seconds', time.perf_counter() - self.started)
+
+    @property
+    def av(self):
+        return self.retriever('av')
+
+    @property
+    def fh(self):
+        return self.retriever('fh')
+
+    def retriever(self, provider):
+        """ Data retriever of {provider}, 'av' or 'fh', the default one built on first use """
+        with self.retriever_lock:
+            if self.retrievers[provider] is None:
+                self.retrievers[provider] = DataRetrieverAV(**self.av_cfg) if provider == 'av' else \
+                    DataRetrieverFH(**self.fh_cfg)
+            return self.retrievers[provider]
+
+    def warm_start(self, tickers):
+        """ Hold {tickers} found in a columnar report of the same interval younger than warm_start_max_age, as
+            they were saved, without pulling or calculating. Returns the tickers held
+
+            Columns are mapped copy-on-write, pages are read from disk on first access and a ticker moves to
+            memory when bars are appended, so startup does not grow with the history held.
+        """
+        writer = self.reporter.writer
+        if not isinstance(writer, ColumnarReportWriter):
+            return []
+        try:
+            age = time.time() - os.path.getmtime(os.path.join(writer.path, MANIFEST))
+            manifest = read_manifest(writer.path)
+        except (OSError, ValueError):
+            return []  # no report yet or an unreadable one, pull as usual
+        if age > self.cfg['warm_start_max_age'] or manifest.get('meta') != writer.meta:
+            return []
+        blocks = {ticker: block for ticker, block in open_report(writer.path, 'c', manifest).items()
+                  if ticker in self.rank and len(block)}
+        with self.lock.write():
+            for ticker, block in blocks.items():
+                self.hold(ticker, block, RollingState.from_block(block, self.window_size()))
+        writer.adopt(blocks)  # bars already on disk, later saves append to them
+        return list(blocks)
+
+    def refresh_warm(self, tickers):
+        """ Bring warm started {tickers} up to date and wait for the report write, run once the server is bound """
+        self.refresh_data(tickers, True)
+        self.reporter.flush()
+
+    def load(self, tickers, pending=False):
+        """ Pull, calculate and hold {tickers}, returns the failure reason of each ticker that did not pull
+
+            With {pending} only tickers still waiting to load and not being pulled already are pulled and held, one
+            deleted or loaded on first access meanwhile is left as it is.
+        """
+        if pending:
+            with self.lock.write():
+                tickers = [ticker for ticker in tickers if ticker in self.pending and ticker not in self.loading]
+                self.loading.update(tickers)
+        frames, failures = self.pull_many(tickers)
+        for ticker, reason in failures.items():
+            print("Unable to pull ticker {0}, skipped: {1}".format(ticker, reason))
+        blocks, states = self.prepare_blocks(frames)
+        with self.lock.write():
+            for ticker in tickers:
+                self.loading.discard(ticker)
+                if pending and ticker not in self.pending:
+                    continue
+                self.loaded(ticker)
+                if ticker in blocks:
+                    self.hold(ticker, blocks[ticker], states[ticker])
+            self.save_data()  # Save data to the report
+        return failures
+
+    def load_pending(self, tickers):
+        """ Background loader of fast start, loads {tickers} a batch at a time so queries see them as they land """
+        start = time.perf_counter()
+        batch = self.pull_workers * 4
+        for i in range(0, len(tickers), batch):
+            self.load(tickers[i:i + batch], pending=True)
+        with self.lock.write():
+            self.rank.clear()  # startup is over, a startup ticker deleted and added again goes last
+        self.metrics.set('trading_load_seconds', time.perf_counter() - start)
+        print("Loaded {0} tickers in {1:.1f}s".format(len(tickers), time.perf_counter() - start))
+
+    def require(self, ticker):
+        """ Load {ticker} now if it is still waiting for the background loader, its first access waits for it. One
+            the loader is pulling already is waited for rather than pulled again
+        """
+        with self.lock.read():
+            done = self.pending.get(ticker)
+        if done is None:
+            return
+        self.load([ticker], pending=True)
+        done.wait()
+
+    def loaded(self, ticker):
+        """ {ticker} waits to load no longer, loaded, failed or deleted, wake its first accesses. Call with the
+            write lock
+        """
+        done = self.pending.pop(ticker, None)
+        if done is not None:
+            done.set()
+
+    def hold(self, ticker, block, state):
+        """ Hold {block} and its rolling {state} as {ticker}'s, startup tickers keep the order they were given in
+            and others go after every ticker held, in the order they are added. Call with the write lock
+        """
+        self.loaded(ticker)
+        if ticker not in self.data:
+            rank = self.rank.pop(ticker, None)
+            if rank is None:
+                rank, self.next_rank = self.next_rank, self.next_rank + 1
+            pos = bisect.bisect_right(self.ranks, rank)
+            self.tickers.insert(pos, ticker)
+            self.ranks.insert(pos, rank)
+        self.data.put(ticker, block)
+        self.states[ticker] = state
+        self.changed()
+
+    def changed(self):
+        """ Held data or tickers changed, replies cached so far are stale. Call with the write lock """
+        self.version += 1
+        if self.snapshots is not None:
+            self.snapshots.clear()
+
+    def fetch(self, provider, ticker):
+        """ Retrieve {ticker} from {provider}, 'av' or 'fh', and process it into standard bar format
+
+            A fresh cached frame skips both the upstream call and the parsing.
+        """
+        retriever = self.retriever(provider)
+
+        def load():
+            with self.metrics.timer('trading_pull_stage_seconds', stage='retrieve', provider=provider):
+                raw = retriever.retrieve(ticker)
+            with self.metrics.timer('trading_pull_stage_seconds', stage='process_data', provider=provider):
+                return retriever.process_data(raw, ticker)
+
+        if self.cache is None:
+            return load()
+        with self.metrics.timer('trading_pull_stage_seconds', stage='cached_fetch', provider=provider):
+            return self.cache.fetch(provider, ticker, self.interval, load)
+
+    def pull_many(self, tickers):
+        """ Pull {tickers} concurrently, every provider call is a task on a pool of {pull_workers} threads
+
+            The retrievers bound connections and rate limit per provider. A failed ticker does not stop the
+            others, returns frames of the tickers pulled and the failure reason of each ticker that was not.
+        """
+        frames, failures = dict(), dict()
+        if not tickers:
+            return frames, failures
+        with ThreadPoolExecutor(max_workers=self.pull_workers) as pool:
+            futures = {ticker: (pool.submit(self.fetch, 'av', ticker), pool.submit(self.fetch, 'fh', ticker))
+                       for ticker in tickers}
+            for ticker, (av_future, fh_future) in futures.items():
+                try:
+                    frames[ticker] = self.stitch(av_future.result(), fh_future.result())
+                    self.record_history(ticker, av_future.result())
+                except Exception as e:
+                    failures[ticker] = "{0}: {1}".format(type(e).__name__, e)
+        return frames, failures
+
+    def stitch(self, av_df, fh_df):
+        """ Combine trailing bars {av_df} with the latest quote {fh_df} into one sorted bar frame """
+        timer = self.metrics.timer
+        # Convert index to datetime from date time string, on each side so duplicates compare equal whether a
+        # frame came parsed from upstream or from the cache
+        with timer('trading_pull_stage_seconds', stage='concat'):
+            _df = pd.concat([df.set_axis(pd.to_datetime(df.index, format='%Y-%m-%d %H:%M:%S'), axis=0)
+                             for df in [av_df, fh_df]])
+            _df.index.name = 'datetime'
         # Assuming the server can be queried during or outside a trading day
         # 1. If during trading day, Alpha Vantage pulls 30 day trailing data up to day t-1
         #    And Finn Hub pulls latest quote, flat fill back to beginning of the trading day
         #
         # 2. If outside trading day, then Alpha Vantage pulls data up to the end of the last trading day
         #    Then Finn Hub pulled duplicate data and need to drop duplicate
-        _df = _df[~_df.index.duplicated(keep='first')]
-
-        # Convert index to datetime from date time string
-        _df.index = pd.to_datetime(_df.index, format='%Y-%m-%d %H:%M:%S')
-        _df.sort_index(inplace=True)
+        with timer('trading_pull_stage_seconds', stage='dedupe'):
+            _df = _df[~_df.index.duplicated(keep='first')]
+        with timer('trading_pull_stage_seconds', stage='sort'):
+            _df = _df.sort_index()
         return _df
 
+    @staticmethod
+    def session_start():
+        """ Start of today in exchange time as int64 ns, bars from it on may belong to a session still in progress """
+        return to_int64(pd.Timestamp.now(tz='EST').tz_localize(None).normalize())
+
+    def record_history(self, ticker, av_df):
+        """ Append the bars of pulled Alpha Vantage frame {av_df} before today's session and newer than the last one
+            in {ticker}'s history, if history is kept
+
+            History is append only, so only final bars go in: Finn Hub's flat fill and the bars of a session still
+            in progress would never be corrected. Streamed bars are final and are appended as they complete.
+        """
+        if self.history is not None:
+            with self.metrics.timer('trading_pull_stage_seconds', stage='history'):
+                ts = to_int64(pd.to_datetime(av_df.index, format='%Y-%m-%d %H:%M:%S'))
+                final = ts < self.session_start()
+                self.history.append(ticker, ts[final], av_df['price'].to_numpy(dtype=np.float64)[final])
+
     def save_data(self):
-        """ Save data to report.csv """
-        pd.concat([df for df in self.data.values()]).to_csv('report.csv')
+        """ Queue the bars and analytics held now to be saved to the report in the background
+
+            Snapshots share the held arrays, call with the data lock held so no swap is half way through.
+        """
+        self.reporter.submit({ticker: self.data.block(ticker).snapshot() for ticker in self.data})
 
     def init_dr_cfg(self, tickers, interval):
         """ Initialize data retriever config """
@@ -82,68 +337,425 @@ class Server(object):
         self.fh_cfg['url'] = self.cfg['FH_URL']
         self.av_cfg['interval'] = interval
         self.fh_cfg['interval'] = interval
+        self.av_cfg['rate_limit'] = self.cfg['AV_RATE_LIMIT']
+        self.fh_cfg['rate_limit'] = self.cfg['FH_RATE_LIMIT']
+        self.av_cfg['max_connections'] = self.cfg['pull_workers']
+        self.fh_cfg['max_connections'] = self.cfg['pull_workers']
 
-    def calculate_signal(self, ticker):
-        """ Calculate signal on price series"""
-
-        def sig(p, avg, std):
-            """ Momentum Signal """
-            if p > avg + std:
-                return 1
-            elif p < avg - std:
-                return -1
-            else:
-                return 0
-
-        df = self.data[ticker]
-        # Calculate size of 24-hur lookback window depending on interval
-        window = int(NUM_MIN_TRADING_DAY / interval_map[self.interval])
-
-        df['rolling_avg'] = df['price'].rolling(window).mean()
-        df['rolling_std'] = df['price'].rolling(window).std()
-
-        df['signal'] = df.apply(lambda x: sig(x.price, x.rolling_avg, x.rolling_std), axis=1)
-        self.data[ticker] = df
-
-    def calculate_position(self, ticker):
-        """ Calculate position based on signal """
-        # Assuming infinite long short
-        # TODO: incorporate long/short cap
-
-        df = self.data[ticker]
-        # Position(t+1) = Position(t) + signal(t), need to shift down
-        df['position'] = df['signal'].cumsum().shift().fillna(0)
-        self.data[ticker] = df
-
-    def calculate_pnl(self, ticker):
-        """ Calculate pnl based on position """
-
-        df = self.data[ticker]
-        df['unit_return_dollar'] = df['price'].diff()
-
-        # PnL(t+1) = Position(t) * [S(t+1) - S(t)], need to shift down
-        df['pnl'] = df['position'].shift().fillna(0) * df['unit_return_dollar']
-        self.data[ticker] = df
+    def window_size(self):
+        """ Calculate size of 24-hour lookback window depending on interval """
+        return int(NUM_MIN_TRADING_DAY / interval_map[self.interval])
 
     def calculate_all(self, ticker):
         """ Calculate signal, position, and PnL """
-        self.calculate_signal(ticker)
-        self.calculate_position(ticker)
-        self.calculate_pnl(ticker)
+        with self.metrics.timer('trading_calculate_seconds', scope='ticker'):
+            block = self.data.block(ticker)
+            self.engine.run_blocks([block])
+            self.states[ticker] = RollingState.from_block(block, self.window_size())
+
+    def calculate_all_tickers(self):
+        """ Calculate signal, position, and PnL for every ticker in one vectorized pass """
+        with self.metrics.timer('trading_calculate_seconds', scope='batch'):
+            blocks = [self.data.block(ticker) for ticker in self.data]
+            self.engine.run_blocks(blocks)
+            for ticker, block in zip(self.data, blocks):
+                self.states[ticker] = RollingState.from_block(block, self.window_size())
+
+    def prepare_blocks(self, frames):
+        """ Columnar blocks with analytics and their rolling states for pulled {frames}, nothing shared is touched """
+        with self.metrics.timer('trading_calculate_seconds', scope='batch'):
+            blocks = {ticker: TickerBlock.from_frame(df) for ticker, df in frames.items()}
+            self.engine.run_blocks(list(blocks.values()))
+            states = {ticker: RollingState.from_block(block, self.window_size()) for ticker, block in blocks.items()}
+        return blocks, states
+
+    def append_bars(self, ticker, df):
+        """ Append bars of {df} newer than the last bar held for {ticker}, calculate analytics on new bars only """
+        return self.append_prices(ticker, frame_ts(df), df['price'].to_numpy(dtype=np.float64))
+
+    def append_prices(self, ticker, ts, price):
+        """ Append bars at int64 ns {ts} newer than the last bar held for {ticker}, returns the number of bars
+            appended or recalculated, the last ones of the block
+
+            Held bars the pull gives another price for, Finn Hub's flat filled bars of the session once Alpha
+            Vantage has the real ones, are revised and late bars falling between held ones are merged in: the bars
+            before the first revised or late one are kept with their analytics, the rest are merged with the pulled
+            ones, a pulled bar replacing a held one of the same time, and recalculated from the rolling state at
+            that point in a new block.
+        """
+        block = self.data.block(ticker)
+        held = block['ts']
+        pos = np.searchsorted(held, ts)
+        at = np.minimum(pos, len(held) - 1)
+        known = held[at] == ts
+        changed = (known & (block['price'][at] != price)) | (~known & (ts < held[-1]))
+        if changed.any():
+            keep = int(pos[changed].min())
+            pulled = pos >= keep  # the pulled bars before it are held already at the same price
+            merged_ts, first = np.unique(np.concatenate([ts[pulled], held[keep:]]), return_index=True)
+            merged_price = np.concatenate([price[pulled], block['price'][keep:]])[first]  # pulled ones come first
+            rebuilt = TickerBlock(keep + len(merged_ts))
+            rebuilt.append(held[:keep], block['price'][:keep], {col: block[col][:keep] for col in ANALYTIC_COLUMNS})
+            state = RollingState.from_block(rebuilt, self.window_size())
+            rebuilt.append(merged_ts, merged_price, state.update(merged_price))
+            self.data.put(ticker, rebuilt)
+            self.states[ticker] = state
+            return len(merged_ts)
+        new = ts > held[-1]
+        if not new.any():
+            return 0
+        block.append(ts[new], price[new], self.states[ticker].update(price[new]))
+        return int(new.sum())
+
+    def held_tickers(self):
+        with self.lock.read():
+            return list(self.tickers)
+
+    def ingest_bars(self, bars):
+        """ Append streamed {bars}, ticker -> (int64 ns bar starts, prices), calculate analytics for them only and
+            push them to the ticker's subscribers
+        """
+        updates = dict()
+        with self.lock.write():
+            for ticker, (ts, price) in bars.items():
+                if ticker not in self.tickers:
+                    continue
+                if self.history is not None:
+                    self.history.append(ticker, ts, price)
+                if ticker in self.states and len(self.data.block(ticker)):
+                    count = self.append_prices(ticker, ts, price)
+                else:
+                    self.data.put(ticker, TickerBlock.from_prices(ts, price))
+                    self.calculate_all(ticker)
+                    count = len(ts)
+                block = self.data.block(ticker)  # a revision replaces the block
+                start = len(block) - count
+                if count:
+                    self.changed()
+                    updates[ticker] = {'ticker': ticker,
+                                       'datetime': block['ts'][start:].view('datetime64[ns]').copy(),
+                                       'price': block['price'][start:].copy(),
+                                       'signal': block['signal'][start:].copy(),
+                                       'position': block['position'][start:].copy(),
+                                       'pnl': block['pnl'][start:].copy()}
+        if updates:
+            with self.lock.read():
+                self.save_data()
+            self.publish(updates)
+        return updates
+
+    def subscribe(self, ticker, conn, send_lock):
+        """ Push bars streamed for {ticker} to connection {conn} """
+        self.require(ticker)
+        with self.lock.read():
+            if ticker not in self.tickers:
+                return ERROR, "Ticker {0} is not held, add it first".format(ticker)
+        with self.sub_lock:
+            self.subscribers.setdefault(ticker, dict())[conn] = send_lock
+        if self.stream is None:
+            return SUCCESS, "Subscribed to {0}, no quote stream is running".format(ticker)
+        return SUCCESS, "Subscribed to {0}".format(ticker)
+
+    def unsubscribe(self, ticker, conn):
+        """ Stop pushing {ticker}, every ticker when None, to connection {conn} """
+        with self.sub_lock:
+            for t in [ticker] if ticker is not None else list(self.subscribers):
+                self.subscribers.get(t, dict()).pop(conn, None)
+        return SUCCESS, "Unsubscribed from {0}".format(ticker)
+
+    def publish(self, updates):
+        """ Send each ticker's new bars in {updates} to its subscribers, dropping connections that fail """
+        for ticker, data in updates.items():
+            with self.sub_lock:
+                targets = list(self.subscribers.get(ticker, dict()).items())
+            for conn, send_lock in targets:
+                try:
+                    with send_lock:
+                        send_message(conn, Response(UPDATE, SUCCESS, data))
+                except OSError:
+                    self.unsubscribe(None, conn)
+
+    def rows(self, ticker, idx):
+        """ {ticker}'s price and signal at bar positions {idx} as a DataFrame """
+        block = self.data.block(ticker)
+        index = pd.DatetimeIndex(block['ts'][idx].view('datetime64[ns]'), name='datetime')
+        return pd.DataFrame({'ticker': ticker, 'price': block['price'][idx], 'signal': block['signal'][idx]},
+                            index=index)
+
+    def locate(self, ticker, dt):
+        """ Positions of {ticker}'s bars closest to parsed Timestamp or DatetimeIndex {dt} """
+        return nearest_positions(self.data.block(ticker)['ts'], to_int64(dt))
 
     def query(self, ticker, datetime):
         """ Find {ticker}'s price and signal data at {datetime} or in closest proximity of {datetime} """
-        datetime = pd.to_datetime(datetime, format='%Y-%m-%d-%H:%M')
-        idx = pd.Series(datetime - self.data[ticker].index).abs().idxmin()  # map query datetime to nearest available
+        idx = self.locate(ticker, parse_query_datetime(datetime))  # map query datetime to nearest available
         # TODO: Potential issue where datetime is too far from the edge of available time range in dataset
-        return self.data[ticker].iloc[[idx], :][['ticker', 'price', 'signal']]
+        return self.rows(ticker, [idx])
+
+    def query_many(self, ticker, datetimes):
+        """ Find {ticker}'s price and signal data closest to each of the list of {datetimes} in one search """
+        return self.rows(ticker, self.locate(ticker, parse_query_datetime(datetimes)))
+
+    @staticmethod
+    def snapshot_time(datetime):
+        """ Snapshot request {datetime}, YYYY-MM-DD-HH:MM, as int64 ns. Raises ValueError on anything else """
+        try:
+            if not isinstance(datetime, str):
+                raise TypeError(datetime)
+            return to_int64(parse_query_datetime(datetime))
+        except (TypeError, ValueError):
+            raise ValueError("Invalid datetime {0!r}, expected YYYY-MM-DD-HH:MM".format(datetime))
+
+    def snapshot(self, datetime):
+        """ Price and signal of every ticker at the bar closest to {datetime}, one binary search per ticker. Raises
+            ValueError on a bad datetime
+        """
+        target = self.snapshot_time(datetime)
+        tickers, price, signal = [], [], []
+        for ticker in self.tickers:
+            block = self.data.block(ticker)
+            if not len(block):
+                continue
+            idx = nearest_positions(block['ts'], target)
+            tickers.append(ticker)
+            price.append(block['price'][idx])
+            signal.append(block['signal'][idx])
+        # Numeric columns go out as arrays, sent as raw buffers by the wire protocol
+        return {'ticker': tickers, 'price': np.array(price, dtype=np.float64),
+                'signal': np.array(signal, dtype=np.int8)}
+
+    def snapshot_breaks(self):
+        """ Sorted int64 ns times after which some ticker's closest bar changes, the midpoints between its bars. Every
+            time between two of them gives the same snapshot. Built once per version, call with the read lock
+        """
+        breaks = self.breaks
+        if breaks is None or breaks[0] != self.version:
+            mids = [ts[:-1] + (ts[1:] - ts[:-1]) // 2 for ts in (self.data.block(t)['ts'] for t in self.tickers)]
+            breaks = (self.version, np.unique(np.concatenate(mids)) if mids else np.empty(0, dtype=np.int64))
+            self.breaks = breaks  # readers building it at once build the same
+        return breaks[1]
+
+    def snapshot_reply(self, datetime):
+        """ Encoded reply to a data snapshot request at {datetime}, shared by every request resolving to the same
+            bars while the held data is unchanged, only the request id is added per reply. Raises ValueError on a bad
+            datetime
+        """
+        target = self.snapshot_time(datetime)
+        with self.lock.read():
+            span = int(np.searchsorted(self.snapshot_breaks(), target))  # ties go to the earlier bar, as in snapshot
+            return self.snapshots.get((span, self.version),
+                                      lambda: encode_response(Response(DATA, SUCCESS, self.snapshot(datetime))))
+
+    def range_chunks(self, ticker, start, end, interval=None):
+        """ {ticker}'s bars from {start} to {end} (YYYY-MM-DD-HH:MM, both inclusive), OHLC bars of {interval} when
+            given, as a generator of column dicts each built from at most about {chunk_rows} bars
+
+            The range is found by binary search in a snapshot of the block, or in the history when it starts
+            before the held bars, followed by the held bars after the last one in the history. Chunks are built as
+            they are consumed so a long range never sits whole in memory. Raises ValueError on a bad range or
+            interval.
+        """
+        if interval is not None and interval not in resample_map:
+            raise ValueError("Unknown interval {0}, one of {1}".format(interval, ', '.join(resample_map)))
+        if not isinstance(start, str) or not isinstance(end, str):
+            raise ValueError("Range needs from and to datetimes")
+        start, end = to_int64(parse_query_datetime(start)), to_int64(parse_query_datetime(end))
+        if start > end:
+            raise ValueError("Range start is after its end")
+        self.require(ticker)
+        with self.lock.read():
+            if ticker not in self.data:
+                raise ValueError("Ticker {0} not found".format(ticker))
+            block = self.data.block(ticker).snapshot()  # shares the held bars, valid after the lock is let go
+        step = resample_map[interval] * 60 * 10 ** 9 if interval is not None else None
+        if self.history is not None and (not len(block) or start < block['ts'][0]) and ticker in self.history:
+            # Reaches back past the held bars, read the mapped history a chunk at a time and calculate the
+            # signal of each chunk from its prices and the window before them
+            lo, hi = self.history.range(ticker, start, end)
+            records = self.history.records(ticker)  # mapped after the range, so it holds every bar in it
+            ts, price = records['ts'], records['price']
+            segments = [(ts, price, lambda pos, stop: self.engine.signal_slice(price, pos, stop),
+                         lambda t: self.history.locate(ticker, t), lo, hi)]
+            # Held bars after the last final one in the history, the session in progress, follow it
+            held = block['ts']
+            first = max(int(np.searchsorted(held, ts[-1], 'right')), int(np.searchsorted(held, start)))
+            last = int(np.searchsorted(held, end, 'right'))
+            if first < last:
+                # History bars of the bucket the first held one falls in go with it, no bucket is split
+                cut = min(max(self.history.locate(ticker, held[first] - held[first] % step), lo), hi) \
+                    if step is not None else hi
+                tail_ts = np.concatenate([ts[cut:hi], held[first:last]])
+                tail_price = np.concatenate([price[cut:hi], block['price'][first:last]])
+                tail_signal = np.concatenate([self.engine.signal_slice(price, cut, hi), block['signal'][first:last]])
+                segments = [segments[0][:4] + (lo, cut),
+                            (tail_ts, tail_price, lambda pos, stop: tail_signal[pos:stop],
+                             lambda t: int(np.searchsorted(tail_ts, t)), 0, len(tail_ts))]
+        else:
+            ts, price, signal = block['ts'], block['price'], block['signal']
+            lo, hi = range_positions(ts, start, end)
+            segments = [(ts, price, lambda pos, stop: np.asarray(signal[pos:stop]),  # plain array of a mapped block
+                         lambda t: int(np.searchsorted(ts, t)), lo, hi)]
+        segments = [segment for segment in segments if segment[4] < segment[5]] or segments[:1]
+
+        def chunks():
+            for ts, price, signal_of, position, pos, hi in segments:
+                while True:
+                    stop = min(pos + self.chunk_rows, hi)
+                    if step is not None and stop > pos:  # run on to the end of the last bucket, none is split
+                        last = ts[stop - 1]
+                        stop = min(position(last - last % step + step), hi)
+                    chunk_ts, chunk_price = np.asarray(ts[pos:stop]), np.asarray(price[pos:stop])  # mapped or held
+                    if step is None:
+                        yield {'datetime': chunk_ts.view('datetime64[ns]'), 'price': chunk_price,
+                               'signal': signal_of(pos, stop)}
+                    else:
+                        yield downsample(chunk_ts, chunk_price, signal_of(pos, stop), step)
+                    pos = stop
+                    if pos >= hi:  # an empty range still gets one empty chunk, so the columns are known
+                        break
+        return chunks()
+
+    def send_chunks(self, conn, send_lock, req_id, chunks):
+        """ Stream {chunks} of the reply to request {req_id} on {conn} one frame group at a time, returns the count """
+        count = 0
+        for chunk in chunks:
+            with send_lock:
+                size = send_message(conn, Response(CHUNK, SUCCESS, chunk, req_id))
+            self.metrics.observe('trading_response_bytes', size, buckets=SIZE_BUCKETS, inst='data')
+            count += 1
+        return count
+
+    def backtest(self, windows=None, bands=None, caps=None, start=None, end=None):
+        """ Evaluate the strategy over every combination of rolling {windows}, std {bands} and position {caps}
+            across all tickers held, defaults are the live strategy's. Returns a DataFrame of PnL, Sharpe and turnover
+
+            With {start} and {end} (YYYY-MM-DD-HH:MM) the bars come from the history over that span instead of the
+            bars held. Raises ValueError on a bad span or without history
+        """
+        from backtest import PriceMatrix, sweep, periods_per_year  # process pool machinery, loaded when used
+        if start is not None or end is not None:
+            if self.history is None:
+                raise ValueError("Backtest over a span needs history: True in the server config")
+            if not isinstance(start, str) or not isinstance(end, str):
+                raise ValueError("Backtest span needs from and to datetimes")
+            start, end = to_int64(parse_query_datetime(start)), to_int64(parse_query_datetime(end))
+            if start > end:
+                raise ValueError("Backtest span start is after its end")
+            matrix = PriceMatrix.from_history(self.history, self.held_tickers(), start, end)
+        else:
+            with self.lock.read():
+                matrix = PriceMatrix.from_blocks([self.data.block(ticker) for ticker in self.data])  # copies prices
+        processes = self.backtest_processes if self.backtest_pool is not None else 1
+        return sweep(matrix, windows or [self.window_size()], bands or [1.0], caps or [np.inf],
+                     periods=periods_per_year(self.interval), processes=processes, pool=self.backtest_pool)
+
+    def macro_engine(self):
+        """ Macro overlay engine over the panel under macro_dir, loaded on first use """
+        with self.macro_lock:
+            if self.macro is None:
+                panel = MacroPanel.load(self.cfg['macro_dir']) if self.cfg['macro_dir'] else MacroPanel.load()
+                self.macro = MacroEngine(panel)
+            return self.macro
+
+    def macro_overlay(self, arg):
+        """ Daily macro overlay columns of {arg}'s asset and country, of the days from {arg}'s from to to
+            (YYYY-MM-DD, both inclusive, either may be left out) with optional window, lookback, corr_window and
+            against parameters. Raises ValueError on a bad argument
+        """
+        if not isinstance(arg, dict) or not isinstance(arg.get('asset'), str) or \
+                not isinstance(arg.get('country'), str):
+            raise ValueError("Macro query needs an asset and a country")
+        params = {key: arg[key] for key in ('window', 'lookback', 'corr_window') if arg.get(key) is not None}
+        if not all(isinstance(value, int) for value in params.values()):
+            raise ValueError("Windows and lookback must be whole numbers")
+        columns = self.macro_engine().overlay(arg['asset'], arg['country'], against=arg.get('against'), **params)
+        days = columns['datetime']
+        lo, hi = 0, len(days)
+        try:
+            if arg.get('from') is not None:
+                lo = int(np.searchsorted(days, np.datetime64(datetime.datetime.strptime(arg['from'], '%Y-%m-%d'))))
+            if arg.get('to') is not None:
+                hi = int(np.searchsorted(days, np.datetime64(datetime.datetime.strptime(arg['to'], '%Y-%m-%d')),
+                                         'right'))
+        except (TypeError, ValueError):
+            raise ValueError("Dates must be YYYY-MM-DD")
+        return {col: values[lo:hi] for col, values in columns.items()}
+
+    def portfolio(self, arg=None):
+        """ Portfolio PnL, equity, drawdown and gross and net exposure of every bar time across the tickers held,
+            under {arg}'s ticker_cap (units), gross_cap and net_cap (dollars) or the configured ones, from {arg}'s
+            from to to (YYYY-MM-DD-HH:MM, both inclusive, either may be left out). The last position of each
+            ticker comes along. Raises ValueError on a bad argument
+        """
+        arg = arg if arg is not None else dict()
+        if not isinstance(arg, dict):
+            raise ValueError("Portfolio query takes a dict of caps and a range")
+        caps = []
+        for name in ('ticker_cap', 'gross_cap', 'net_cap'):
+            cap = arg.get(name, self.cfg['portfolio_caps'][name.split('_')[0]])
+            cap = np.inf if cap is None else cap
+            if not isinstance(cap, (int, float)) or cap < 0:
+                raise ValueError("{0} must be a number at least 0".format(name))
+            caps.append(float(cap))
+        with self.lock.read():
+            tickers = [ticker for ticker in self.tickers if len(self.data.block(ticker))]
+            blocks = [self.data.block(ticker).snapshot() for ticker in tickers]  # valid after the lock is let go
+        with self.portfolio_lock:  # one update at a time, each takes in only the bars added since the last
+            portfolio = self.portfolios.pop(tuple(caps), None) or Portfolio(*caps)
+            self.portfolios[tuple(caps)] = portfolio
+            while len(self.portfolios) > self.cfg['portfolio_cache']:
+                self.portfolios.popitem(last=False)
+            columns = portfolio.update(tickers, blocks)
+            position = portfolio.position.copy()
+        bounds = [0, len(columns['datetime'])]
+        for i, (key, side) in enumerate([('from', 'left'), ('to', 'right')]):
+            if arg.get(key) is not None:
+                if not isinstance(arg[key], str):
+                    raise ValueError("Range needs YYYY-MM-DD-HH:MM datetimes")
+                target = to_int64(parse_query_datetime(arg[key]))
+                bounds[i] = int(np.searchsorted(columns['datetime'], target, side))
+        result = {col: values[bounds[0]:bounds[1]] for col, values in columns.items()}
+        result['datetime'] = result['datetime'].view('datetime64[ns]')
+        result.update({'ticker': tickers, 'position': position})
+        return result
+
+    def stats(self, fmt=None):
+        """ Metrics snapshot with per ticker memory and cache counts, Prometheus text when {fmt} is 'prometheus' """
+        with self.lock.read():
+            for ticker in self.data:
+                block = self.data.block(ticker)
+                self.metrics.set('trading_ticker_bytes', block.nbytes(), ticker=ticker)
+                self.metrics.set('trading_ticker_bars', len(block), ticker=ticker)
+            self.metrics.set('trading_store_bytes', self.data.nbytes())
+            self.metrics.set('trading_tickers_pending', len(self.pending))
+        with self.metrics.lock:  # gauges of deleted tickers go
+            for key in [key for key in self.metrics.gauges if key[0].startswith('trading_ticker_')]:
+                if dict(key[1])['ticker'] not in self.data:
+                    del self.metrics.gauges[key]
+        if self.snapshots is not None:
+            self.metrics.set('trading_snapshot_cache_hits', self.snapshots.hits)
+            self.metrics.set('trading_snapshot_cache_misses', self.snapshots.misses)
+            self.metrics.set('trading_snapshot_cache_coalesced', self.snapshots.coalesced)
+            self.metrics.set('trading_snapshot_cache_bytes', self.snapshots.nbytes())
+        if self.cache is not None:
+            self.metrics.set('trading_cache_hits', self.cache.hits)
+            self.metrics.set('trading_cache_misses', self.cache.misses)
+            self.metrics.set('trading_cache_bytes', self.cache.nbytes())
+        snapshot = self.metrics.snapshot()
+        if fmt == 'prometheus':
+            return render_prometheus([(snapshot, dict())])
+        return snapshot
 
     def add_ticker(self, ticker):
         """ retrieve data and calculate analytics for {ticker} """
+        frames, failures = self.pull_many([ticker])
+        if ticker in failures:
+            return ERROR, "Unable to add ticker {0}: {1}".format(ticker, failures[ticker])
         try:
-            self.tickers.append(ticker)
-            self.data[ticker] = self.pull_data(ticker)
-            self.calculate_all(ticker)
+            # Pull and calculate off to the side so data queries are served meanwhile, only the swap is exclusive
+            blocks, states = self.prepare_blocks(frames)
+            with self.lock.write():
+                self.hold(ticker, blocks[ticker], states[ticker])
             return SUCCESS, "Successfully added ticker {0}".format(ticker)
         except Exception as e:  # TODO: add more specific exception handling
             return ERROR, "Unable to add ticker {0}".format(ticker)
@@ -151,26 +763,76 @@ class Server(object):
     def delete_ticker(self, ticker):
         """ delete {ticker} and its data from the server """
         try:
-            self.tickers.remove(ticker)
-            self.data.pop(ticker)
+            with self.lock.write():
+                self.rank.pop(ticker, None)  # added again it goes last
+                if ticker in self.pending:  # not loaded yet, it never will be
+                    self.loaded(ticker)
+                else:
+                    pos = self.tickers.index(ticker)
+                    del self.tickers[pos], self.ranks[pos]
+                    self.data.remove(ticker)
+                    self.states.pop(ticker, None)
+                    self.changed()
             return SUCCESS, "Successfully deleted ticker {0}".format(ticker)
         except Exception as e:  # TODO: add more specific exception handling
             return ERROR, "Unable to delete ticker {0}".format(ticker)
 
-    def refresh_data(self):
-        # refresh to latest trailing 30 day data and save to report.csv
-        for ticker in self.tickers:
-            self.data[ticker] = self.pull_data(ticker)
-            self.calculate_all(ticker)
-        self.save_data()
-
-    def process_query(self, message):
-
-        """ Client request handler method """
-
-        query = pickle.loads(message)  # load into Query instance
-        if query.inst == "data":
-            data = pd.concat([self.query(ticker, query.arg) for ticker in self.tickers]).to_dict('list')
+    def refresh_data(self, tickers=None, incremental=None):
+        """ Refresh {tickers}, every ticker held by default, to latest trailing 30 day data and save the report,
+            returns failure reason per ticker
+
+            A ticker that fails to pull keeps the data it had. {incremental} defaults to incremental_refresh.
+        """
+        with self.lock.read():
+            tickers = [ticker for ticker in self.tickers if tickers is None or ticker in tickers]
+        pulled, failures = self.pull_many(tickers)  # upstream calls hold no lock
+
+        if self.incremental if incremental is None else incremental:
+            # Only new and revised bars get analytics, cost follows their number
+            with self.lock.write():
+                for ticker, df in pulled.items():
+                    if ticker not in self.tickers:
+                        continue  # deleted while pulling
+                    if ticker in self.states and len(self.data.block(ticker)):
+                        self.append_bars(ticker, df)
+                    else:
+                        self.data.put(ticker, TickerBlock.from_frame(df))
+                        self.calculate_all(ticker)
+                self.changed()
+        else:
+            # Recalculate off to the side, only the swap is exclusive
+            blocks, states = self.prepare_blocks(pulled)
+            with self.lock.write():
+                for ticker, block in blocks.items():
+                    if ticker in self.tickers:
+                        self.data.put(ticker, block)
+                        self.states[ticker] = states[ticker]
+                self.changed()
+
+        with self.lock.read():
+            self.save_data()
+        return failures
+
+    def process_query(self, query, conn=None, send_lock=None):
+
+        """ Client request handler method, {conn} and its {send_lock} are needed by subscribe """
+
+        if query.inst == "data" and isinstance(query.arg, dict):  # range of one ticker's bars
+            arg = query.arg
+            try:
+                chunks = self.range_chunks(arg.get('ticker'), arg.get('from'), arg.get('to'), arg.get('interval'))
+            except ValueError as e:
+                return Response(DATA, ERROR, str(e))
+            if conn is None:  # not on a connection, the whole range in the reply
+                return Response(DATA, SUCCESS, join_chunks(list(chunks)))
+            return Response(DATA, SUCCESS, {'chunks': self.send_chunks(conn, send_lock, query.req_id, chunks)})
+
+        elif query.inst == "data":
+            try:
+                with self.lock.read():
+                    data = self.snapshot(query.arg)
+            except ValueError as e:
+                return Response(DATA, ERROR, str(e))
             return Response(DATA, SUCCESS, data)
 
         elif query.inst == "add":
@@ -181,41 +843,155 @@ class Server(object):
             result, msg = self.delete_ticker(query.arg)
             return Response(DELETE, result, msg)
         elif query.inst == "report":
-            self.refresh_data()
-            return Response(REPORT, SUCCESS, None)
+            failures = self.refresh_data()
+            return Response(REPORT, SUCCESS, failures or None)  # tickers that could not be refreshed, if any
+        elif query.inst == "subscribe" and conn is not None:
+            result, msg = self.subscribe(query.arg, conn, send_lock)
+            return Response(SUBSCRIBE, result, msg)
+        elif query.inst == "unsubscribe" and conn is not None:
+            result, msg = self.unsubscribe(query.arg, conn)
+            return Response(UNSUBSCRIBE, result, msg)
+        elif query.inst == "stats":
+            return Response(STATS, SUCCESS, self.stats(query.arg))
+        elif query.inst == "macro":
+            try:
+                return Response(MACRO, SUCCESS, self.macro_overlay(query.arg))
+            except ValueError as e:
+                return Response(MACRO, ERROR, str(e))
+        elif query.inst == "portfolio":
+            try:
+                return Response(PORTFOLIO, SUCCESS, self.portfolio(query.arg))
+            except ValueError as e:
+                return Response(PORTFOLIO, ERROR, str(e))
+        elif query.inst == "backtest":
+            grid = query.arg or dict()
+            try:
+                result = self.backtest(grid.get('windows'), grid.get('bands'), grid.get('caps'), grid.get('from'),
+                                       grid.get('to'))
+            except ValueError as e:
+                return Response(BACKTEST, ERROR, str(e))
+            return Response(BACKTEST, SUCCESS, {col: result[col].to_numpy() for col in result.columns})
         else:
             return Response(UNKNOWN, ERROR, "Undefined Instruction")
 
-    def run(self):
-        """ Run server, listen for client connections and service their requests """
+    def handle(self, conn, send_lock, query):
+        """ Process {query} and send the response back on {conn} tagged with the query's request id """
+        # Instruction label limited to known ones so arbitrary client input does not grow the registry
+        inst = query.inst if query.inst in INSTRUCTIONS else 'unknown'
+        response, prefix = None, None
+        try:
+            with self.metrics.timer('trading_request_seconds', inst=inst):
+                if query.inst == "data" and isinstance(query.arg, str) and self.snapshots is not None:
+                    try:
+                        prefix = self.snapshot_reply(query.arg)  # encoded already, hot snapshots skip all the work
+                    except ValueError as e:  # bad input, not a server error
+                        response = Response(DATA, ERROR, str(e))
+                else:
+                    response = self.process_query(query, conn, send_lock)
+        except Exception:  # the client gets a generic error, the traceback goes to the log
+            logging.exception("Unable to process %r request", query.inst)
+            response = Response(UNKNOWN, ERROR, "Unable to process {0} request".format(query.inst))
+        with send_lock:  # frames of concurrent responses must not interleave
+            if response is None:
+                size = send_encoded(conn, prefix, query.req_id)
+            else:
+                response.req_id = query.req_id
+                size = send_message(conn, response)  # framed, so payloads of any size stream through
+        if self.first_response is None:
+            self.first_response = time.perf_counter() - self.started
+            self.metrics.set('trading_time_to_first_response_seconds', self.first_response)
+        self.metrics.observe('trading_response_bytes', size, buckets=SIZE_BUCKETS, inst=inst)
+        if response is not None and response.result != SUCCESS:
+            self.metrics.inc('trading_request_errors_total', inst=inst)
+
+    def serve_connection(self, conn):
+        """ Service requests on persistent connection {conn} until the client closes it """
+        send_lock = threading.Lock()
+        pending = set()
+        with conn:
+            print("Connected to client")
+            while True:
+                try:
+                    query = recv_message(conn)
+                except ProtocolError as e:
+                    with send_lock:
+                        send_message(conn, Response(UNKNOWN, ERROR, "Malformed request: {0}".format(e)))
+                    break
+                except OSError:
+                    break
+                if query is None:
+                    break
+                if self.pool:
+                    # Pipelined requests run concurrently on the pool, replies go out as they complete
+                    future = self.pool.submit(self.handle, conn, send_lock, query)
+                    pending.add(future)
+                    future.add_done_callback(pending.discard)
+                else:
+                    self.handle(conn, send_lock, query)
+            wait(list(pending))  # let in-flight replies go out before closing
+            self.unsubscribe(None, conn)
+        print("Client disconnected, connection closed")
+
+    def close(self):
+        """ Stop the quote stream and wait for the background work, the fast start loader, the warm start refresh
+            and the report writes they queued, then stop the backtest worker processes
+        """
+        if self.stream is not None:
+            self.stream.stop()
+        for thread in (self.loader, self.warm):
+            if thread is not None and thread.ident is not None:  # never started when the server was not run
+                thread.join()
+        self.reporter.flush()
+        if self.backtest_pool is not None:
+            self.backtest_pool.shutdown()
+
+    def run(self, ready=None):
+        """ Run server, listen for client connections and service their requests
+
+            {ready} is called with the port once listening, port 0 binds any free port.
+        """
         s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         s.bind((self.host, self.port))
-
+        s.listen()
+        self.port = s.getsockname()[1]
+
+        # Each connection stays open for many requests and gets a thread reading from it. With workers, requests
+        # are processed on a shared thread pool so a slow add/report does not hold up data queries
+        self.pool = ThreadPoolExecutor(max_workers=self.workers) if self.workers else None
+        if self.backtest_processes > 1:
+            from backtest import backtest_pool
+            self.backtest_pool = backtest_pool(self.backtest_processes)  # spawned once, not on every backtest
+        if self.stream is not None:
+            self.stream.start()
+        if self.warm is not None:
+            self.warm.start()
         print("Server listening for request now")
+        if ready is not None:
+            ready(self.port)
         while True:
-            s.listen()
             conn, addr = s.accept()
-
-            with conn:
-                # Connected to new client, service request then close connection
-                print("Connected to client")
-                data = conn.recv(PACKET_SIZE)
-                if not data:
-                    conn.close()
-                    continue
-                response = self.process_query(data)
-                response_s = pickle.dumps(response)
-                if len(response_s) > PACKET_SIZE:
-                    # If response created by handler method is too large, alert client
-                    response_s = pickle.dumps(Response(response.inst, ERROR, "Response payload too large."))
-
-                print('Sending Message size: {0}'.format(len(response_s)))
-                conn.sendall(response_s)
-                conn.close()
-                print("Service performed, connection closed")
-
+            threading.Thread(target=self.serve_connection, args=(conn,), daemon=True).start()
 
 if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('-t', '--tickers', dest='tickers', nargs='*',
+                        help="list of tickers", default=['IBM'])  # Assuming a default server set up on IBM prices
+    parser.add_argument('-p', '--port', dest='port', default=8080, type=int,
+                        help='port to bind the server to, use any value over 1023')
+    parser.add_argument('-w', '--workers', dest='workers', default=0, type=int,
+                        help='number of worker threads processing requests, 0 handles requests in order on the '
+                             'thread of the connection they arrived on')
+    parser.add_argument('-s', '--shards', dest='shards', default=0, type=int,
+                        help='number of shard processes tickers are hash partitioned over, 0 runs unsharded in '
+                             'this process')
+    parser.add_argument('-f', '--fast-start', dest='fast_start', action='store_true', default=None,
+                        help='bind and serve at once, tickers load in the background or on first access')
+    args = parser.parse_args()
     server_args = vars(args)
-    server = Server(**server_args)
+    if server_args['shards']:
+        from shard import ShardedServer  # fast start goes to the shards, each loads its tickers in the background
+        server = ShardedServer(**server_args)
+    else:
+        server_args.pop('shards')
+        server = Server(**server_args)
     server.run()
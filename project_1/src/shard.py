@@ -0,0 +1,221 @@
+import os
+import time
+import zlib
+import queue
+import threading
+import multiprocessing
+import numpy as np
+from server import Server, join_chunks
+from client import Client
+from message import Query, Response
+from protocol import ProtocolError
+from rwlock import ReadWriteLock
+from metrics import Metrics, render_prometheus
+from constant import *
+
+
+def shard_of(ticker, shards):
+    """ Shard owning {ticker}, a stable hash so every process and restart agrees """
+    return zlib.crc32(ticker.encode()) % shards
+
+
+def run_shard(index, tickers, workers, av, fh, fast_start, ready):
+    """ Shard process, a Server over its slice of tickers in its own directory, reports its port and the tickers
+        it holds or is loading on {ready}
+    """
+    path = os.path.join('shards', str(index))  # report and cache of each shard kept apart
+    os.makedirs(path, exist_ok=True)
+    os.chdir(path)
+    server = Server(tickers, 0, workers, av=av, fh=fh, fast_start=fast_start)
+
+    def announce(port):
+        with server.lock.read():
+            held = [ticker for ticker in tickers if ticker in server.data or ticker in server.pending]
+        ready.put((index, port, held))
+
+    server.run(ready=announce)
+
+
+class ShardedServer(Server):
+    """ Front end of a sharded server, tickers are hash partitioned over {shards} Server processes
+
+        Each shard pulls, calculates and holds only its own tickers on its own core. add/delete go to the owning
+        shard, data and report fan out to every shard and the results are merged. Range queries and subscriptions
+        are relayed from the owning shard. The front end speaks the same protocol as Server, clients cannot tell the difference.
+    """
+
+    def __init__(self, tickers, port, shards, workers=0, av=None, fh=None, fast_start=None):
+        self.started = time.perf_counter()
+        self.first_response = None
+        self.host = "127.0.0.1"
+        self.port = port
+        self.workers = workers
+        self.pool = None
+        self.stream = None
+        self.warm = None  # shards warm start and refresh their own tickers
+        self.snapshots = None  # shards cache their own snapshot replies, the merge here is per request
+        self.lock = ReadWriteLock()  # guards the ticker list kept to order merged results
+        self.pending = dict()  # shards load their own tickers, none wait on the front end
+        self.backtest_processes = 0  # backtests are not available sharded
+        self.subscribers = dict()
+        self.sub_lock = threading.Lock()
+        self.feeds = dict()  # shard -> Client receiving the shard's pushes
+        self.feed_lock = threading.Lock()
+        self.local = threading.local()  # shard connections of each request thread
+        self.metrics = Metrics()  # front end request latencies, shards keep their own
+
+        # Spawned rather than forked, workers start clean of this process's threads and sockets
+        ctx = multiprocessing.get_context('spawn')
+        ready = ctx.Queue()
+        parts = [[] for _ in range(shards)]
+        for ticker in tickers:
+            parts[shard_of(ticker, shards)].append(ticker)
+        self.processes = [ctx.Process(target=run_shard, args=(i, parts[i], workers, av, fh, fast_start, ready),
+                                      daemon=True) for i in range(shards)]
+        for p in self.processes:
+            p.start()
+        self.addrs = [None] * shards
+        held = set()
+        while None in self.addrs:  # shards pull their tickers concurrently, wait for all of them
+            try:
+                index, shard_port, shard_tickers = ready.get(timeout=1)
+            except queue.Empty:
+                dead = [i for i, p in enumerate(self.processes) if self.addrs[i] is None and not p.is_alive()]
+                if dead:
+                    self.close()
+                    raise RuntimeError("Shard {0} exited during startup".format(dead[0]))
+                continue
+            self.addrs[index] = '127.0.0.1:{0}'.format(shard_port)
+            held.update(shard_tickers)
+        self.tickers = [ticker for ticker in tickers if ticker in held]
+
+    def close(self):
+        """ Stop the shard processes """
+        for p in self.processes:
+            p.terminate()
+        for p in self.processes:
+            p.join()
+
+    def client(self, shard):
+        """ This thread's connection to {shard} """
+        clients = getattr(self.local, 'clients', None)
+        if clients is None:
+            clients = self.local.clients = [Client(addr) for addr in self.addrs]
+        return clients[shard]
+
+    def fan_out(self, inst, arg=None):
+        """ Send {inst} to every shard at once, then collect the replies in shard order """
+        clients = [self.client(i) for i in range(len(self.addrs))]
+        req_ids = [c.send(Query(inst, arg)) for c in clients]
+        return [c.receive(req_id) for c, req_id in zip(clients, req_ids)]
+
+    def merge_snapshots(self, parts):
+        """ One data snapshot from the shards' {parts}, tickers in the order they were added """
+        tickers = [ticker for part in parts for ticker in part['ticker']]
+        with self.lock.read():
+            rank = {ticker: i for i, ticker in enumerate(self.tickers)}
+        order = np.argsort([rank.get(ticker, len(rank)) for ticker in tickers], kind='stable')
+        return {'ticker': [tickers[i] for i in order],
+                'price': np.concatenate([part['price'] for part in parts]).astype(np.float64)[order],
+                'signal': np.concatenate([part['signal'] for part in parts]).astype(np.int8)[order]}
+
+    def process_query(self, query, conn=None, send_lock=None):
+
+        """ Route {query} to the owning shard or fan it out and merge """
+
+        if query.inst == "data" and isinstance(query.arg, dict):  # range of one ticker, relayed from its shard
+            client = self.client(shard_of(str(query.arg.get('ticker')), len(self.addrs)))
+            chunks, count = [], 0
+            for response in client.receive_stream(client.send(Query('data', query.arg))):
+                if response.inst != CHUNK:
+                    break
+                if conn is None:
+                    chunks.append(response.data)
+                else:
+                    count += self.send_chunks(conn, send_lock, query.req_id, [response.data])
+            if response.result != SUCCESS:
+                return response
+            return Response(DATA, SUCCESS, join_chunks(chunks) if conn is None else {'chunks': count})
+
+        elif query.inst == "data":
+            responses = self.fan_out('data', query.arg)
+            for response in responses:
+                if response.result != SUCCESS:
+                    return response
+            return Response(DATA, SUCCESS, self.merge_snapshots([r.data for r in responses]))
+
+        elif query.inst in ("add", "delete"):
+            if not isinstance(query.arg, str):
+                return Response(UNKNOWN, ERROR, "Ticker required")
+            client = self.client(shard_of(query.arg, len(self.addrs)))
+            response = client.request(query.inst, query.arg)
+            if response.result == SUCCESS:
+                with self.lock.write():
+                    if query.inst == "add" and query.arg not in self.tickers:
+                        self.tickers.append(query.arg)
+                    elif query.inst == "delete" and query.arg in self.tickers:
+                        self.tickers.remove(query.arg)
+            return response
+
+        elif query.inst == "report":
+            failures = dict()
+            for response in self.fan_out('report'):
+                if response.result != SUCCESS:
+                    return response
+                failures.update(response.data or dict())
+            return Response(REPORT, SUCCESS, failures or None)
+
+        elif query.inst == "stats":
+            shards = [r.data for r in self.fan_out('stats')]
+            if query.arg == 'prometheus':
+                parts = [(self.metrics.snapshot(), {'shard': 'front'})]
+                parts += [(snapshot, {'shard': str(i)}) for i, snapshot in enumerate(shards)]
+                return Response(STATS, SUCCESS, render_prometheus(parts))
+            return Response(STATS, SUCCESS, {'front': self.metrics.snapshot(), 'shards': shards})
+
+        elif query.inst == "subscribe" and conn is not None:
+            result, msg = self.subscribe(query.arg, conn, send_lock)
+            return Response(SUBSCRIBE, result, msg)
+        elif query.inst == "unsubscribe" and conn is not None:
+            result, msg = self.unsubscribe(query.arg, conn)
+            return Response(UNSUBSCRIBE, result, msg)
+        elif query.inst == "macro":  # does not depend on the tickers held, each asset's results kept on one shard
+            asset = query.arg.get('asset') if isinstance(query.arg, dict) else None
+            return self.client(shard_of(str(asset), len(self.addrs))).request('macro', query.arg)
+        elif query.inst == "backtest":
+            # Sharpe needs the portfolio PnL of every bar across all tickers, it does not merge from shard results
+            return Response(BACKTEST, ERROR, "backtest is not available on a sharded server")
+        elif query.inst == "portfolio":
+            # Gross and net caps bind across all tickers at once, shards hold a part of them each
+            return Response(PORTFOLIO, ERROR, "portfolio is not available on a sharded server")
+        else:
+            return Response(UNKNOWN, ERROR, "Undefined Instruction")
+
+    def subscribe(self, ticker, conn, send_lock):
+        """ Relay bars pushed for {ticker} by its shard to connection {conn} """
+        result, msg = super(ShardedServer, self).subscribe(ticker, conn, send_lock)
+        if result != SUCCESS:
+            return result, msg
+        shard = shard_of(ticker, len(self.addrs))
+        with self.feed_lock:
+            feed = self.feeds.get(shard)
+            if feed is None:
+                feed = self.feeds[shard] = Client(self.addrs[shard]).connect()
+                threading.Thread(target=self.relay, args=(feed,), daemon=True).start()
+            # The relay thread does all the reading on the feed, the subscribe ack is read and dropped there
+            feed.send(Query('subscribe', ticker))
+        return SUCCESS, "Subscribed to {0}".format(ticker)
+
+    def relay(self, feed):
+        """ Publish bars pushed on a shard's {feed} connection to the front end's subscribers """
+        while True:
+            try:
+                data = feed.next_update()
+            except (OSError, ProtocolError):
+                break
+            feed.responses.clear()
+            self.publish({data['ticker']: data})
+        with self.feed_lock:
+            for shard, f in list(self.feeds.items()):
+                if f is feed:
+                    del self.feeds[shard]
@@ -0,0 +1,211 @@
+from collections import deque
+import numpy as np
+import pandas as pd
+from pandas.api.indexers import BaseIndexer
+
+SIGNAL_COLUMNS = ['rolling_avg', 'rolling_std', 'signal', 'position', 'unit_return_dollar', 'pnl']
+
+
+class SegmentWindowIndexer(BaseIndexer):
+    """ Fixed size rolling window over concatenated ticker segments, windows never cross into the previous ticker """
+
+    def get_window_bounds(self, num_values=0, min_periods=None, center=None, closed=None, step=None):
+        end = np.arange(1, num_values + 1, dtype=np.int64)
+        start = np.maximum(end - self.window_size, self.seg_start)
+        return start, end
+
+
+class SignalEngine(object):
+    """ Batch calculation of signal, position and PnL for all tickers in one pass
+
+        Prices of all tickers are laid out back to back in one array, ticker i occupying
+        prices[offsets[i]:offsets[i + 1]]. Results are identical to Server.calculate_all run ticker by ticker.
+    """
+
+    def __init__(self, window):
+        self.window = window
+
+    @staticmethod
+    def build_offsets(lengths):
+        """ Segment offsets from per ticker bar counts """
+        return np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)])
+
+    def run(self, prices, offsets):
+        """ Calculate signal, position and PnL over concatenated {prices}, returns dict of column arrays """
+        prices = np.asarray(prices, dtype=np.float64)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        n = len(prices)
+        lengths = np.diff(offsets)
+        seg_start = np.repeat(offsets[:-1], lengths)
+        first = seg_start == np.arange(n)  # first bar of each ticker
+
+        # Same rolling kernels as Series.rolling(window) so results match bit for bit
+        rolling = pd.Series(prices).rolling(SegmentWindowIndexer(window_size=self.window, seg_start=seg_start),
+                                            min_periods=self.window)
+        avg = rolling.mean().to_numpy()
+        std = rolling.std().to_numpy()
+
+        # Momentum signal, NaN statistics compare False and give 0
+        signal = np.where(prices > avg + std, 1, np.where(prices < avg - std, -1, 0)).astype(np.int64)
+
+        # Position(t+1) = Position(t) + signal(t), cumulative sum restarted for every ticker then shifted down
+        cum = np.cumsum(signal)
+        base = np.concatenate([[0], cum])[offsets[:-1]]
+        cum -= np.repeat(base, lengths)
+        position = np.zeros(n, dtype=np.float64)
+        position[1:] = cum[:-1]
+        position[first] = 0
+
+        unit_return = np.empty(n, dtype=np.float64)
+        unit_return[1:] = prices[1:] - prices[:-1]
+        unit_return[first] = np.nan
+
+        # PnL(t+1) = Position(t) * [S(t+1) - S(t)], need to shift down
+        prev_position = np.zeros(n, dtype=np.float64)
+        prev_position[1:] = position[:-1]
+        prev_position[first] = 0
+        pnl = prev_position * unit_return
+
+        return {'rolling_avg': avg,
+                'rolling_std': std,
+                'signal': signal,
+                'position': position,
+                'unit_return_dollar': unit_return,
+                'pnl': pnl}
+
+    def signal_slice(self, prices, lo, hi):
+        """ Signal of bars [{lo}, {hi}) of one long price series {prices}, a memory-mapped history for instance,
+            reading only the bars before {lo} that the first rolling window needs
+        """
+        lead = min(lo, self.window - 1)
+        return self.run(prices[lo - lead:hi], [0, hi - lo + lead])['signal'][lead:]
+
+    def run_frames(self, frames):
+        """ Calculate analytics for a dict of ticker DataFrames in place """
+        tickers = list(frames.keys())
+        if not tickers:
+            return frames
+        offsets = self.build_offsets([len(frames[ticker]) for ticker in tickers])
+        prices = np.concatenate([frames[ticker]['price'].to_numpy(dtype=np.float64) for ticker in tickers])
+        result = self.run(prices, offsets)
+        for i, ticker in enumerate(tickers):
+            df = frames[ticker]
+            for col in SIGNAL_COLUMNS:
+                df[col] = result[col][offsets[i]:offsets[i + 1]]
+        return frames
+
+    def run_blocks(self, blocks):
+        """ Calculate analytics for a list of store TickerBlocks in place """
+        if not blocks:
+            return blocks
+        offsets = self.build_offsets([len(block) for block in blocks])
+        result = self.run(np.concatenate([block['price'] for block in blocks]), offsets)
+        for i, block in enumerate(blocks):
+            block.set_analytics({col: result[col][offsets[i]:offsets[i + 1]] for col in SIGNAL_COLUMNS})
+        return blocks
+
+
+class RollingState(object):
+    """ Running window state of one ticker, updates analytics for newly arrived bars without touching history
+
+        Mean and variance of the trailing window are kept with Welford's add/remove updates and re-derived
+        from the window contents every {window} bars to stop rounding drift from accumulating.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.prices = deque(maxlen=window)
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.cum_signal = 0  # position to carry into the next bar
+        self.last_position = 0.0
+        self.last_price = np.nan
+        self.since_resync = 0
+
+    @classmethod
+    def from_arrays(cls, price, signal, position, window):
+        """ Seed state from a ticker's price history and its calculated signal and position """
+        state = cls(window)
+        if not len(price):
+            return state
+        state.prices.extend(np.asarray(price[-window:], dtype=np.float64))
+        state.resync()
+        state.cum_signal = int(position[-1]) + int(signal[-1])
+        state.last_position = float(position[-1])
+        state.last_price = float(price[-1])
+        return state
+
+    @classmethod
+    def from_frame(cls, df, window):
+        """ Seed state from a ticker frame that already carries the signal columns """
+        return cls.from_arrays(df['price'].to_numpy(), df['signal'].to_numpy(), df['position'].to_numpy(), window)
+
+    @classmethod
+    def from_block(cls, block, window):
+        """ Seed state from a store TickerBlock that already carries analytics """
+        return cls.from_arrays(block['price'], block['signal'], block['position'], window)
+
+    def resync(self):
+        """ Recompute window mean and sum of squared deviations from the prices held """
+        if self.prices:
+            values = np.fromiter(self.prices, dtype=np.float64)
+            self.mean = values.mean()
+            self.m2 = ((values - self.mean) ** 2).sum()
+        else:
+            self.mean = 0.0
+            self.m2 = 0.0
+        self.since_resync = 0
+
+    def push(self, p):
+        """ Slide the window forward by one price """
+        if len(self.prices) == self.window:
+            old = self.prices[0]
+            n = len(self.prices) - 1
+            if n:
+                delta = old - self.mean
+                self.mean -= delta / n
+                self.m2 -= delta * (old - self.mean)
+            else:
+                self.mean = 0.0
+                self.m2 = 0.0
+        self.prices.append(p)
+        n = len(self.prices)
+        delta = p - self.mean
+        self.mean += delta / n
+        self.m2 += delta * (p - self.mean)
+        self.since_resync += 1
+        if self.since_resync >= self.window:
+            self.resync()
+
+    def update(self, prices):
+        """ Calculate analytics for new {prices} following the last bar seen, returns dict of column arrays """
+        prices = np.asarray(prices, dtype=np.float64)
+        n = len(prices)
+        result = {'rolling_avg': np.full(n, np.nan),
+                  'rolling_std': np.full(n, np.nan),
+                  'signal': np.zeros(n, dtype=np.int64),
+                  'position': np.zeros(n, dtype=np.float64),
+                  'unit_return_dollar': np.empty(n, dtype=np.float64),
+                  'pnl': np.empty(n, dtype=np.float64)}
+        for i, p in enumerate(prices):
+            position = float(self.cum_signal)
+            unit_return = p - self.last_price
+            result['position'][i] = position
+            result['unit_return_dollar'][i] = unit_return
+            result['pnl'][i] = self.last_position * unit_return
+
+            self.push(p)
+            if len(self.prices) == self.window:
+                avg = self.mean
+                std = np.sqrt(max(self.m2, 0.0) / (self.window - 1)) if self.window > 1 else np.nan
+                result['rolling_avg'][i] = avg
+                result['rolling_std'][i] = std
+                if p > avg + std:
+                    result['signal'][i] = 1
+                elif p < avg - std:
+                    result['signal'][i] = -1
+
+            self.cum_signal += int(result['signal'][i])
+            self.last_position = position
+            self.last_price = p
+        return result
@@ -0,0 +1,195 @@
+import itertools
+import numpy as np
+import pandas as pd
+
+# Column layout of a ticker block, analytics are narrowed to what their values need
+BLOCK_DTYPES = [('ts', np.int64),  # bar time, nanoseconds since epoch, shared by every column
+                ('price', np.float64),
+                ('rolling_avg', np.float32),
+                ('rolling_std', np.float32),
+                ('signal', np.int8),
+                ('position', np.int32),  # running sum of signals, always whole
+                ('pnl', np.float64)]
+ANALYTIC_COLUMNS = ['rolling_avg', 'rolling_std', 'signal', 'position', 'pnl']
+REPORT_COLUMNS = ['price', 'ticker', 'rolling_avg', 'rolling_std', 'signal', 'position', 'unit_return_dollar', 'pnl']
+_block_uids = itertools.count()
+
+
+def frame_ts(df):
+    """ int64 nanosecond timestamps of a bar frame's DatetimeIndex """
+    return np.asarray(df.index.values).astype('datetime64[ns]').view(np.int64)
+
+
+class TickerBlock(object):
+    """ Bars of one ticker, one contiguous array per column, appended to with geometric growth """
+
+    def __init__(self, capacity=0):
+        self.size = 0
+        self.cols = {name: np.empty(capacity, dtype=dtype) for name, dtype in BLOCK_DTYPES}
+        # Identifies this block's bars, appends keep it while a recalculated replacement block gets a new one
+        self.uid = next(_block_uids)
+
+    @classmethod
+    def from_prices(cls, ts, price):
+        """ New block holding bars {ts}/{price}, analytics left for the signal engine """
+        block = cls(len(ts))
+        block.append(ts, price)
+        return block
+
+    @classmethod
+    def from_columns(cls, cols, size):
+        """ Block over existing arrays {cols} of {size} bars without copying, a mapped report for one """
+        block = cls.__new__(cls)
+        block.size = size
+        block.cols = cols
+        block.uid = next(_block_uids)
+        return block
+
+    @classmethod
+    def from_frame(cls, df):
+        """ New block from a bar frame with a DatetimeIndex and a price column """
+        return cls.from_prices(frame_ts(df), df['price'].to_numpy(dtype=np.float64))
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, name):
+        """ View of column {name} over the bars held """
+        return self.cols[name][:self.size]
+
+    @property
+    def capacity(self):
+        return len(self.cols['ts'])
+
+    def reserve(self, n):
+        """ Make room for {n} more bars, doubling so repeated appends cost amortized O(new bars) """
+        needed = self.size + n
+        if needed <= self.capacity:
+            return
+        capacity = max(needed, 2 * self.capacity, 16)
+        for name, arr in self.cols.items():
+            grown = np.empty(capacity, dtype=arr.dtype)
+            grown[:self.size] = arr[:self.size]
+            self.cols[name] = grown
+
+    def append(self, ts, price, analytics=None):
+        """ Append bars, with their analytics when already calculated """
+        n = len(ts)
+        self.reserve(n)
+        start = self.size
+        self.cols['ts'][start:start + n] = ts
+        self.cols['price'][start:start + n] = price
+        self.size += n
+        if analytics is not None:
+            self.set_analytics(analytics, start)
+        else:
+            for name in ANALYTIC_COLUMNS:
+                self.cols[name][start:start + n] = 0
+
+    def snapshot(self):
+        """ Block sharing the bars held now without copying, later appends to this block do not show in it
+
+            Held bars are never rewritten in place, a recalculation builds a new block, so the snapshot stays valid.
+        """
+        snap = TickerBlock.__new__(TickerBlock)
+        snap.size = self.size
+        snap.cols = {name: self[name] for name in self.cols}
+        snap.uid = self.uid
+        return snap
+
+    def set_analytics(self, analytics, start=0):
+        """ Store signal engine output for bars from {start} on, narrowing to the block's dtypes """
+        for name in ANALYTIC_COLUMNS:
+            values = analytics[name]
+            self.cols[name][start:start + len(values)] = values
+
+    def unit_return(self):
+        """ S(t) - S(t-1), derived from price rather than stored """
+        price = self['price']
+        out = np.empty(self.size, dtype=np.float64)
+        out[:1] = np.nan
+        np.subtract(price[1:], price[:-1], out=out[1:])
+        return out
+
+    def frame(self, ticker):
+        """ Bars as a DataFrame in the server's report layout """
+        index = pd.DatetimeIndex(self['ts'].view('datetime64[ns]'), name='datetime')
+        data = {'price': self['price'],
+                'ticker': ticker,
+                'rolling_avg': self['rolling_avg'],
+                'rolling_std': self['rolling_std'],
+                'signal': self['signal'],
+                'position': self['position'].astype(np.float64),
+                'unit_return_dollar': self.unit_return(),
+                'pnl': self['pnl']}
+        return pd.DataFrame(data, index=index, columns=REPORT_COLUMNS)
+
+    def nbytes(self):
+        """ Bytes held by the bars, excluding spare capacity """
+        return sum(self[name].nbytes for name, _ in BLOCK_DTYPES)
+
+
+class ColumnarStore(object):
+    """ In-memory bar store, tickers interned to integer ids each owning a TickerBlock
+
+        Ids are stable for the life of the store, a deleted then re-added ticker gets its old id back.
+    """
+
+    def __init__(self):
+        self.ids = dict()  # ticker -> id
+        self.names = []  # id -> ticker
+        self.blocks = []  # id -> TickerBlock, None while the ticker is not held
+
+    def intern(self, ticker):
+        """ Integer id of {ticker}, assigned on first sight """
+        tid = self.ids.get(ticker)
+        if tid is None:
+            tid = len(self.names)
+            self.ids[ticker] = tid
+            self.names.append(ticker)
+            self.blocks.append(None)
+        return tid
+
+    def __contains__(self, ticker):
+        tid = self.ids.get(ticker)
+        return tid is not None and self.blocks[tid] is not None
+
+    def __len__(self):
+        return sum(block is not None for block in self.blocks)
+
+    def __iter__(self):
+        return (name for name, block in zip(self.names, self.blocks) if block is not None)
+
+    def put(self, ticker, block):
+        """ Hold {block} as {ticker}'s bars, replacing what was there """
+        self.blocks[self.intern(ticker)] = block
+
+    def block(self, ticker):
+        """ {ticker}'s TickerBlock, KeyError if not held """
+        tid = self.ids.get(ticker)
+        if tid is None or self.blocks[tid] is None:
+            raise KeyError(ticker)
+        return self.blocks[tid]
+
+    def remove(self, ticker):
+        """ Drop {ticker}'s bars, KeyError if not held """
+        self.block(ticker)
+        self.blocks[self.ids[ticker]] = None
+
+    def frame(self, ticker):
+        """ {ticker}'s bars as a DataFrame in the server's report layout """
+        return self.block(ticker).frame(ticker)
+
+    def to_frame(self, tickers=None):
+        """ Bars of {tickers}, all held tickers by default, stacked into one report DataFrame """
+        tickers = list(self) if tickers is None else tickers
+        if not tickers:
+            return pd.DataFrame(columns=REPORT_COLUMNS, index=pd.DatetimeIndex([], name='datetime'))
+        return pd.concat([self.frame(ticker) for ticker in tickers])
+
+    def nbytes(self):
+        """ Bytes held by all bars """
+        return sum(block.nbytes() for block in self.blocks if block is not None)
+
+    def num_bars(self):
+        return sum(len(block) for block in self.blocks if block is not None)
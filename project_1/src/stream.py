@@ -0,0 +1,142 @@
+import threading
+from collections import defaultdict
+import numpy as np
+import pandas as pd
+
+
+def quote_time(t):
+    """ Finn Hub quote time {t}, seconds since epoch, as int64 ns in the naive EST frame bars are kept in """
+    return pd.Timestamp(t, unit='s', tz='UTC').tz_convert('EST').tz_localize(None).value
+
+
+class FinnHubQuoteFeed(object):
+    """ Live quotes polled from Finn Hub through a DataRetrieverFH, one call per ticker and poll """
+
+    def __init__(self, retriever):
+        self.retriever = retriever
+
+    def poll(self, tickers):
+        """ Latest (ticker, ts, price) of each of {tickers}, tickers failing this time are left out """
+        quotes = []
+        for ticker in tickers:
+            try:
+                data = self.retriever.retrieve(ticker)
+                quotes.append((ticker, quote_time(data['t']), float(data['c'])))
+            except Exception as e:  # a failed poll is retried on the next one
+                print("Unable to poll quote for {0}: {1}".format(ticker, e))
+        return quotes
+
+    def now(self):
+        """ Wall clock in the bars' time frame, closes bars no quote arrives after """
+        return pd.Timestamp.now(tz='EST').tz_localize(None).value
+
+
+class FakeQuoteFeed(object):
+    """ Quote feed used for testing, quotes and the clock are pushed in rather than polled from upstream """
+
+    def __init__(self):
+        self.quotes = []
+        self.clock = 0
+        self.lock = threading.Lock()
+
+    def push(self, ticker, ts, price):
+        """ Queue a quote of {price} at {ts} (int64 ns or anything pd.Timestamp accepts), moving the clock to it """
+        ts = pd.Timestamp(ts).value
+        with self.lock:
+            self.quotes.append((ticker, ts, float(price)))
+            self.clock = max(self.clock, ts)
+
+    def advance(self, ts):
+        """ Move the clock to {ts} without a quote """
+        with self.lock:
+            self.clock = max(self.clock, pd.Timestamp(ts).value)
+
+    def poll(self, tickers):
+        tickers = set(tickers)
+        with self.lock:
+            quotes = [q for q in self.quotes if q[0] in tickers]
+            self.quotes = [q for q in self.quotes if q[0] not in tickers]
+        return quotes
+
+    def now(self):
+        return self.clock
+
+
+class BarBuilder(object):
+    """ Builds {minutes} bars from quotes, a bar is labelled by its start like the flat filled intraday bars and
+        its price is the last quote in it. A bar is complete once a quote for a later bar arrives or the clock
+        passes its end, quotes for bars already completed are dropped.
+    """
+
+    def __init__(self, minutes):
+        self.step = int(minutes) * 60 * 10 ** 9
+        self.open = dict()  # ticker -> [bar start, last price]
+        self.closed = dict()  # ticker -> start of the last completed bar
+
+    def add(self, ticker, ts, price):
+        """ Add a quote, returns [(bar start, price)] of a bar it completes """
+        start = ts - ts % self.step
+        if start <= self.closed.get(ticker, -1):
+            return []
+        bar = self.open.get(ticker)
+        if bar is None or bar[0] == start:
+            self.open[ticker] = [start, price]
+            return []
+        if start < bar[0]:
+            return []  # late quote for an earlier bar than the open one
+        self.open[ticker] = [start, price]
+        self.closed[ticker] = bar[0]
+        return [(bar[0], bar[1])]
+
+    def close_due(self, now):
+        """ Complete every open bar whose end is at or before {now}, returns ticker -> [(bar start, price)] """
+        done = dict()
+        for ticker, bar in list(self.open.items()):
+            if bar[0] + self.step <= now:
+                del self.open[ticker]
+                self.closed[ticker] = bar[0]
+                done[ticker] = [(bar[0], bar[1])]
+        return done
+
+
+class QuoteStream(object):
+    """ Ingestion loop, polls {feed} for {tickers}() every {period} seconds on its own thread, builds bars and
+        hands completed ones to {on_bars} as ticker -> (int64 ns bar starts, prices)
+    """
+
+    def __init__(self, feed, minutes, tickers, on_bars, period=5.0):
+        self.feed = feed
+        self.builder = BarBuilder(minutes)
+        self.tickers = tickers
+        self.on_bars = on_bars
+        self.period = period
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def step(self):
+        """ One poll, returns the completed bars handed on """
+        bars = defaultdict(list)
+        for ticker, ts, price in self.feed.poll(self.tickers()):
+            bars[ticker].extend(self.builder.add(ticker, ts, price))
+        for ticker, done in self.builder.close_due(self.feed.now()).items():
+            bars[ticker].extend(done)
+        completed = {ticker: (np.array([b[0] for b in done], dtype=np.int64), np.array([b[1] for b in done]))
+                     for ticker, done in bars.items() if done}
+        if completed:
+            self.on_bars(completed)
+        return completed
+
+    def run(self):
+        while not self.stopped.wait(self.period):
+            try:
+                self.step()
+            except Exception as e:  # keep streaming through a bad poll
+                print("Quote stream step failed: {0}".format(e))
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
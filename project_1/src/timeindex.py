@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+
+QUERY_DT_FORMAT = '%Y-%m-%d-%H:%M'
+
+
+def parse_query_datetime(datetimes):
+    """ Query datetime string(s) in YYYY-MM-DD-HH:MM format to Timestamp or DatetimeIndex """
+    return pd.to_datetime(datetimes, format=QUERY_DT_FORMAT)
+
+
+def to_int64(dt, unit='ns'):
+    """ Timestamp or DatetimeIndex {dt} as int64 counts of {unit} """
+    dtype = 'datetime64[{0}]'.format(unit)
+    if isinstance(dt, pd.Timestamp):
+        return dt.to_datetime64().astype(dtype).astype(np.int64)
+    return np.asarray(dt.values).astype(dtype).view(np.int64)
+
+
+def nearest_positions(ts, targets):
+    """ Positions in sorted int64 {ts} closest to {targets}, ties go to the earlier bar
+
+        Binary search, O(log n) per target and no temporary of the size of {ts}.
+    """
+    if len(ts) == 1:
+        return np.zeros(np.shape(targets), dtype=np.int64)
+    pos = np.searchsorted(ts, targets)  # first bar at or after target
+    pos = np.clip(pos, 1, len(ts) - 1)
+    left = ts[pos - 1]
+    right = ts[pos]
+    return pos - ((targets - left) <= (right - targets))
+
+
+def range_positions(ts, start, end):
+    """ Slice [lo, hi) of sorted int64 {ts} holding the bars from {start} to {end}, both inclusive """
+    return int(np.searchsorted(ts, start, 'left')), int(np.searchsorted(ts, end, 'right'))
+
+
+def downsample(ts, price, signal, step):
+    """ OHLC bars of {step} ns from sorted int64 {ts} and {price}, labelled by bucket start like the bars are,
+        signal is the one of the last bar in each bucket
+    """
+    buckets = ts - ts % step
+    if not len(ts):  # no bars in the span, no buckets
+        return {'datetime': buckets.view('datetime64[ns]'), 'open': price, 'high': price, 'low': price,
+                'close': price, 'signal': signal}
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(ts)] - 1
+    return {'datetime': buckets[starts].view('datetime64[ns]'),
+            'open': price[starts],
+            'high': np.maximum.reduceat(price, starts),
+            'low': np.minimum.reduceat(price, starts),
+            'close': price[ends],
+            'signal': signal[ends]}
@@ -0,0 +1,71 @@
+import os
+import sys
+import unittest
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from backtest import PriceMatrix, sweep, backtest_pool, evaluate, positions, SWEEP_COLUMNS
+from signal_engine import SignalEngine
+from store import TickerBlock
+from signal_engine_test import random_frame, WINDOW
+
+
+class BacktestTest(unittest.TestCase):
+    """ Parameter Sweep Backtest Unit Tests"""
+    def setUp(self):
+        # Tickers of different lengths, AAPL starting later than the others
+        self.blocks = [TickerBlock.from_frame(random_frame('IBM', 300, 0)),
+                       TickerBlock.from_frame(random_frame('AAPL', 200, 1)[-150:]),
+                       TickerBlock.from_frame(random_frame('MSFT', 250, 2))]
+        self.matrix = PriceMatrix.from_blocks(self.blocks)
+
+    def testMatchesSignalEngine(self):
+        """ Test the live strategy's configuration reproduces the signal engine's positions and PnL """
+        SignalEngine(WINDOW).run_blocks(self.blocks)
+        row = evaluate(self.matrix, WINDOW, 1.0, [np.inf], 1.0)[0]
+        self.assertAlmostEqual(row[3], sum(np.nansum(block['pnl']) for block in self.blocks), places=6)
+
+        avg, std = self.matrix.rolling(WINDOW)
+        signal = (self.matrix.prices > avg + std).astype(np.int8) - (self.matrix.prices < avg - std).astype(np.int8)
+        position = positions(signal, np.inf)
+        for j, block in enumerate(self.blocks):
+            np.testing.assert_array_equal(signal[:len(block), j], block['signal'])
+            np.testing.assert_array_equal(position[:len(block), j], block['position'])
+
+    def testCap(self):
+        """ Test capped positions against stepping one bar at a time """
+        signal = np.random.default_rng(3).integers(-1, 2, size=(500, 4)).astype(np.int8)
+        position = positions(signal, 3)
+        expected = np.zeros(4)
+        for t in range(1, 500):
+            expected = np.clip(expected + signal[t - 1], -3, 3)
+            np.testing.assert_array_equal(position[t], expected)
+        self.assertEqual(np.abs(position).max(), 3)
+
+    def testGrid(self):
+        """ Test one row per configuration in grid order, metrics finite and tighter caps trade less """
+        result = sweep(self.matrix, [WINDOW, 26], [0.5, 1.0], [2, np.inf])
+        self.assertListEqual(list(result.columns), SWEEP_COLUMNS)
+        self.assertEqual(len(result), 8)
+        self.assertListEqual(result['window'].tolist(), [WINDOW] * 4 + [26] * 4)
+        self.assertListEqual(result['cap'].tolist()[:2], [2, np.inf])
+        self.assertTrue(np.isfinite(result[['pnl', 'sharpe', 'turnover']].to_numpy()).all())
+        capped = result[result['cap'] == 2]['turnover'].to_numpy()
+        uncapped = result[result['cap'] == np.inf]['turnover'].to_numpy()
+        self.assertTrue((capped <= uncapped).all())
+
+    def testProcesses(self):
+        """ Test worker processes, of a pool per sweep or one kept, return the same results as running in process """
+        grid = ([WINDOW, 20, 26], [0.5, 1.0], [3, np.inf])
+        inline = sweep(self.matrix, *grid, processes=1)
+        parallel = sweep(self.matrix, *grid, processes=2)
+        self.assertTrue(inline.equals(parallel))
+        pool = backtest_pool(2)  # kept by the caller across sweeps
+        try:
+            for _ in range(2):
+                self.assertTrue(inline.equals(sweep(self.matrix, *grid, processes=2, pool=pool)))
+        finally:
+            pool.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
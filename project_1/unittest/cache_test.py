@@ -0,0 +1,158 @@
+import os
+import sys
+import time
+import tempfile
+import threading
+import unittest
+import numpy as np
+import pandas as pd
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from cache import FrameCache, ResponseCache
+from server import Server
+from server_test import FakeRetriever, EmptyRetriever, CountingRetriever
+
+
+class FrameCacheTest(unittest.TestCase):
+    """ On-disk Frame Cache Unit Tests"""
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = FrameCache(self.tmp.name, {'av': 3600, 'fh': 0}, 1 << 20)
+        self.df = FakeRetriever(num_bars=100).retrieve('IBM')
+        self.df.index = self.df.index.astype('datetime64[ns]')  # cache resolution, pandas may default coarser
+
+    def testRoundTrip(self):
+        """ Test a cached frame reads back equal, and a hit skips the loader """
+        loads = []
+        load = lambda: loads.append(1) or self.df
+        self.cache.fetch('av', 'IBM', '30min', load)
+        df = self.cache.fetch('av', 'IBM', '30min', load)
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(self.cache.hits, 1)
+        pd.testing.assert_frame_equal(df, self.df, check_freq=False)
+
+    def testStringIndex(self):
+        """ Test an upstream frame still indexed by datetime strings is cached as datetimes """
+        df = self.df.copy()
+        df.index = df.index.strftime('%Y-%m-%d %H:%M:%S')
+        self.cache.put('av', 'IBM', '30min', df)
+        self.assertTrue((self.cache.get('av', 'IBM', '30min').index == self.df.index).all())
+
+    def testTTL(self):
+        """ Test expired entries miss and a zero TTL provider is not cached """
+        self.cache.put('av', 'IBM', '30min', self.df)
+        self.cache.put('fh', 'IBM', '30min', self.df)
+        self.assertIsNone(self.cache.get('fh', 'IBM', '30min'))
+        path = self.cache.file('av', 'IBM', '30min')
+        os.utime(path, (time.time(), time.time() - 7200))
+        self.assertIsNone(self.cache.get('av', 'IBM', '30min'))
+        self.cache.evict()
+        self.assertFalse(os.path.exists(path))
+
+    def testSizeEviction(self):
+        """ Test least recently used entries go first once over the size limit """
+        entry = len(self.df) * 16 + 128
+        self.cache.max_bytes = 3 * entry
+        for i, ticker in enumerate(['A', 'B', 'C']):
+            self.cache.put('av', ticker, '30min', self.df)
+            os.utime(self.cache.file('av', ticker, '30min'), (time.time() - 100 + i, time.time()))
+        self.cache.get('av', 'A', '30min')  # A becomes most recently used
+        self.cache.put('av', 'D', '30min', self.df)
+        self.assertIsNone(self.cache.get('av', 'B', '30min'))
+        for ticker in ['A', 'C', 'D']:
+            self.assertIsNotNone(self.cache.get('av', ticker, '30min'), ticker)
+        self.assertLessEqual(self.cache.nbytes(), self.cache.max_bytes)
+
+    def testWarmRestart(self):
+        """ Test a restarted server and a re-added ticker load from the cache without calling upstream """
+        cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        try:
+            av = CountingRetriever()
+            server = Server(['IBM', 'AAPL'], 0, av=av, fh=EmptyRetriever())
+            self.assertEqual(av.calls, 2)
+            restarted = Server(['IBM', 'AAPL'], 0, av=av, fh=EmptyRetriever())
+            self.assertEqual(av.calls, 2)
+            np.testing.assert_array_equal(restarted.data.block('IBM')['price'], server.data.block('IBM')['price'])
+
+            restarted.delete_ticker('AAPL')
+            restarted.add_ticker('AAPL')
+            self.assertEqual(av.calls, 2)
+            server.reporter.flush(timeout=10)
+            restarted.reporter.flush(timeout=10)
+        finally:
+            os.chdir(cwd)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+
+class ResponseCacheTest(unittest.TestCase):
+    """ In memory reply cache Unit Tests """
+    def testCoalesce(self):
+        """ Test concurrent misses on one key compute once and all get the result """
+        cache = ResponseCache(4)
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            release.wait(10)
+            return b'reply'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get('k', compute))) for _ in range(8)]
+        for t in threads:
+            t.start()
+        while cache.misses + cache.coalesced < 8:
+            time.sleep(0.01)
+        release.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(calls), 1)
+        self.assertListEqual(results, [b'reply'] * 8)
+        self.assertEqual((cache.misses, cache.coalesced), (1, 7))
+        self.assertEqual(cache.get('k', lambda: b'other'), b'reply')
+        self.assertEqual(cache.hits, 1)
+
+    def testEvictionAndClear(self):
+        """ Test the least recently used entry goes first and a clear drops results computed across it """
+        cache = ResponseCache(2)
+        cache.get('a', lambda: b'1')
+        cache.get('b', lambda: b'2')
+        cache.get('a', lambda: b'x')
+        cache.get('c', lambda: b'3')
+        self.assertListEqual(list(cache.entries), ['a', 'c'])
+
+        def stale():
+            cache.clear()  # data changed while this was computed
+            return b'old'
+        self.assertEqual(cache.get('d', stale), b'old')
+        self.assertNotIn('d', cache.entries)
+        self.assertEqual(cache.nbytes(), 0)
+
+    def testClearDuringFlight(self):
+        """ Test a request after a clear does not join a computation started before it """
+        cache = ResponseCache(4)
+        release = threading.Event()
+        results = []
+        t = threading.Thread(target=lambda: results.append(cache.get('k', lambda: release.wait(10) and b'old')))
+        t.start()
+        while not cache.misses:
+            time.sleep(0.01)
+        cache.clear()  # data changed while the first reply is computed
+        self.assertEqual(cache.get('k', lambda: b'new'), b'new')
+        release.set()
+        t.join()
+        self.assertListEqual(results, [b'old'])
+        self.assertEqual((cache.misses, cache.coalesced), (2, 0))
+        self.assertEqual(cache.get('k', lambda: b'other'), b'new')
+
+    def testError(self):
+        """ Test a failed computation reaches its caller and is not cached """
+        cache = ResponseCache(2)
+        self.assertRaises(ValueError, cache.get, 'k', lambda: int('x'))
+        self.assertEqual(cache.get('k', lambda: b'ok'), b'ok')
+
+
+if __name__ == '__main__':
+    unittest.main()
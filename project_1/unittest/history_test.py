@@ -0,0 +1,178 @@
+import os
+import sys
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from history import HistoryStore, HISTORY_DTYPE
+from signal_engine import SignalEngine
+from server import Server
+from message import Query
+from constant import *
+from server_test import FakeRetriever, EmptyRetriever, FlatFillRetriever, ServerTestCase
+
+
+def bars(n, start='2024-01-02 09:30', seed=0):
+    ts = pd.date_range(start, periods=n, freq='30min').as_unit('ns').asi8
+    return ts, 100 + np.cumsum(np.random.default_rng(seed).normal(0, 1, n))
+
+
+class HistoryStoreTest(unittest.TestCase):
+    """ Memory-mapped history store Unit Tests """
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = HistoryStore(self.tmp.name, stride=16)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def testAppendOnlyNew(self):
+        """ Test overlapping appends keep one record per bar, in order, across a reopen """
+        ts, price = bars(500)
+        self.assertEqual(self.store.append('IBM', ts[:100], price[:100]), 100)
+        self.assertEqual(self.store.append('IBM', ts[:250], price[:250]), 150)
+        self.assertEqual(self.store.append('IBM', ts[:250], price[:250]), 0)
+        self.store.append('IBM', ts, price)
+        reopened = HistoryStore(self.tmp.name, stride=16)
+        records = reopened.records('IBM')  # reads the index with the row count
+        self.assertIsInstance(records, np.memmap)
+        np.testing.assert_array_equal(records['ts'], ts)
+        np.testing.assert_array_equal(records['price'], price)
+        np.testing.assert_array_equal(reopened.index['IBM'], ts[::16])
+        self.assertEqual(reopened.tickers(), ['IBM'])
+        self.assertNotIn('AAPL', reopened)
+
+    def testLocate(self):
+        """ Test time lookups through the sparse index agree with a binary search of every timestamp """
+        ts, price = bars(1000)
+        self.store.append('IBM', ts, price)
+        step = ts[1] - ts[0]
+        for t in [ts[0] - step, ts[0], ts[0] + 1, ts[17], ts[16] - 1, ts[500] + step // 2, ts[-1], ts[-1] + 1]:
+            for side in ['left', 'right']:
+                self.assertEqual(self.store.locate('IBM', t, side), np.searchsorted(ts, t, side))
+        records = self.store.slice('IBM', ts[100], ts[199])
+        np.testing.assert_array_equal(records['ts'], ts[100:200])
+        self.assertEqual(self.store.range('AAPL', ts[0], ts[-1]), (0, 0))
+
+    def testUnsafeTickers(self):
+        """ Test tickers holding path separators stay inside the history directory under their own names """
+        ts, price = bars(40)
+        for ticker in ['../x', 'a/b']:
+            self.assertEqual(self.store.append(ticker, ts, price), 40)
+        self.assertFalse(os.path.exists(os.path.join(os.path.dirname(self.tmp.name), 'x.hist')))
+        reopened = HistoryStore(self.tmp.name, stride=16)
+        self.assertEqual(reopened.tickers(), ['../x', 'a/b'])
+        np.testing.assert_array_equal(reopened.records('a/b')['ts'], ts)
+
+    def testTornRecord(self):
+        """ Test a record half written by an interrupted append is dropped and the index rebuilt """
+        ts, price = bars(100)
+        self.store.append('IBM', ts[:50], price[:50])
+        with open(self.store.file('IBM'), 'ab') as f:
+            f.write(b'\x01' * (HISTORY_DTYPE.itemsize // 2))
+        os.remove(self.store.file('IBM', 'hidx'))
+        reopened = HistoryStore(self.tmp.name, stride=16)
+        self.assertEqual(reopened.num_rows('IBM'), 50)
+        reopened.append('IBM', ts, price)
+        np.testing.assert_array_equal(reopened.records('IBM')['ts'], ts)
+        reopened = HistoryStore(self.tmp.name, stride=16)
+        self.assertEqual(reopened.num_rows('IBM'), 100)
+        np.testing.assert_array_equal(reopened.index['IBM'], ts[::16])
+
+    def testSignalSlice(self):
+        """ Test the signal of a slice of a long series matches the one calculated over all of it """
+        ts, price = bars(2000)
+        self.store.append('IBM', ts, price)
+        engine = SignalEngine(13)
+        full = engine.run(price, [0, len(price)])['signal']
+        records = self.store.records('IBM')
+        for lo, hi in [(0, 5), (0, 600), (7, 40), (1500, 2000)]:
+            np.testing.assert_array_equal(engine.signal_slice(records['price'], lo, hi), full[lo:hi])
+
+
+class HistoryServerTest(ServerTestCase):
+    """ Range queries and backtests served from the history """
+    def setUp(self):
+        super(HistoryServerTest, self).setUp()
+        self.server = self.track(Server(['IBM'], 0, av=FakeRetriever(), fh=EmptyRetriever()))
+        # Bars from before the held ones, then a report appends what is held
+        self.server.history = HistoryStore('history')
+        self.old_ts, self.old_price = bars(200)
+        self.server.history.append('IBM', self.old_ts, self.old_price)
+        self.server.refresh_data()
+
+    def testRangeBeforeHeld(self):
+        """ Test a range reaching past the held bars is read from the history with the signal over all of it """
+        block = self.server.data.block('IBM')
+        self.server.chunk_rows = 64
+        response = self.server.process_query(Query('data', {'ticker': 'IBM', 'from': '2024-01-02-09:30',
+                                                            'to': '2024-02-03-12:00'}))
+        self.assertEqual(response.result, SUCCESS)
+        ts = np.concatenate([self.old_ts, block['ts']])
+        price = np.concatenate([self.old_price, block['price']])
+        hi = np.searchsorted(ts, pd.Timestamp('2024-02-03 12:00').value, 'right')
+        np.testing.assert_array_equal(response.data['datetime'].view(np.int64), ts[:hi])
+        np.testing.assert_array_equal(response.data['price'], price[:hi])
+        signal = SignalEngine(self.server.window_size()).run(price, [0, len(price)])['signal']
+        np.testing.assert_array_equal(response.data['signal'], signal[:hi])
+
+        # Downsampled from the history matches downsampling the joined bars
+        response = self.server.process_query(Query('data', {'ticker': 'IBM', 'from': '2024-01-02-09:30',
+                                                            'to': '2024-02-03-12:00', 'interval': 'day'}))
+        day = (24 * 60 * 60 * 10 ** 9)
+        self.assertEqual(len(response.data['datetime']), len(np.unique(ts[:hi] - ts[:hi] % day)))
+
+    def testRangeAcrossHistoryEnd(self):
+        """ Test a range from the history on to held bars newer than its last one gets both, no bucket split """
+        block = self.server.data.block('IBM')
+        self.server.history = HistoryStore('final')  # the session from held bar 250 on is not final yet
+        self.server.history.append('IBM', np.concatenate([self.old_ts, block['ts'][:250]]),
+                                   np.concatenate([self.old_price, block['price'][:250]]))
+        self.server.chunk_rows = 64
+        arg = {'ticker': 'IBM', 'from': '2024-01-02-09:30', 'to': '2024-03-30-16:00'}
+        response = self.server.process_query(Query('data', arg))
+        ts = np.concatenate([self.old_ts, block['ts']])
+        price = np.concatenate([self.old_price, block['price']])
+        np.testing.assert_array_equal(response.data['datetime'].view(np.int64), ts)
+        np.testing.assert_array_equal(response.data['price'], price)
+        signal = SignalEngine(self.server.window_size()).run(price[:450], [0, 450])['signal']
+        np.testing.assert_array_equal(response.data['signal'], np.concatenate([signal, block['signal'][250:]]))
+
+        # Held bar 250 starts half way through a 120min bucket
+        response = self.server.process_query(Query('data', dict(arg, interval='120min')))
+        expected = pd.Series(price, index=pd.DatetimeIndex(ts)).resample('120min').ohlc().dropna()
+        np.testing.assert_array_equal(response.data['datetime'], expected.index)
+        np.testing.assert_array_equal(response.data['close'], expected['close'])
+
+    def testFinalBarsOnly(self):
+        """ Test only Alpha Vantage bars before the session in progress are recorded, never the flat fill """
+        av = FakeRetriever()
+        self.server.cache = None  # every pull reaches the stand-ins
+        self.server.retrievers.update({'av': av, 'fh': FlatFillRetriever(av)})
+        self.server.refresh_data()
+        block = self.server.data.block('IBM')
+        self.assertEqual(len(block), 313)  # held with the flat fill of the session
+        records = self.server.history.records('IBM')
+        np.testing.assert_array_equal(records['ts'], np.concatenate([self.old_ts, block['ts'][:300]]))
+
+        # Upstream bars of the session in progress are left for a pull after it
+        av.num_bars = 320
+        self.server.session_start = lambda: block['ts'][310]
+        self.server.refresh_data()
+        records = self.server.history.records('IBM')
+        np.testing.assert_array_equal(records['ts'], np.concatenate([self.old_ts, block['ts'][:310]]))
+
+    def testBacktestSpan(self):
+        """ Test a backtest over a span of the history, and the error without history """
+        response = self.server.process_query(Query('backtest', {'windows': [7], 'from': '2024-01-02-09:30',
+                                                                'to': '2024-02-03-12:00'}))
+        self.assertEqual(response.result, SUCCESS)
+        self.assertEqual(len(response.data['pnl']), 1)
+        self.server.history = None
+        response = self.server.process_query(Query('backtest', {'from': '2024-01-02-09:30', 'to': '2024-02-03-12:00'}))
+        self.assertEqual(response.result, ERROR)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import sys
+import unittest
+import numpy as np
+import pandas as pd
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from macro import MacroPanel, MacroEngine, MACRO_PATH, MACRO_COLUMNS, asof
+from server import Server
+from client import Client
+from constant import *
+from server_test import FakeRetriever, EmptyRetriever, ServerTestCase
+
+
+class MacroPanelTest(unittest.TestCase):
+    """ Asset and macro release panel Unit Tests """
+    @classmethod
+    def setUpClass(cls):
+        cls.panel = MacroPanel.load()
+
+    def testLoad(self):
+        """ Test prices line up with the file by day and releases are sorted growth numbers """
+        df = pd.read_csv(os.path.join(MACRO_PATH, 'asset_prices.csv'), index_col=0)
+        df.index = pd.to_datetime(df.index, format='%m/%d/%Y')
+        self.assertListEqual(self.panel.assets, ['ES1', 'PT1', 'CADUSD', 'DXY'])
+        np.testing.assert_array_equal(self.panel.ts.view('datetime64[ns]'), df.index.to_numpy().astype('datetime64[ns]'))
+        np.testing.assert_array_equal(self.panel.prices[:, 1], df['PT1 Index'].to_numpy())
+        for name, (ts, values) in self.panel.releases.items():
+            self.assertTrue((np.diff(ts) > 0).all(), name)
+        levels = pd.read_csv(os.path.join(MACRO_PATH, 'CA_HomeSales.csv'))['actual_value'].to_numpy()
+        np.testing.assert_allclose(self.panel.releases['CA_HomeSales'][1], (levels[1:] / levels[:-1] - 1) * 100)
+
+    def testAsof(self):
+        """ Test each day takes the latest release known on it, never a later one """
+        release_ts = np.array([10, 20, 30])
+        values = np.array([1.0, 2.0, 3.0])
+        np.testing.assert_array_equal(asof(release_ts, values, np.array([5, 10, 19, 20, 35])),
+                                      [np.nan, 1.0, 1.0, 2.0, 3.0])
+        self.assertTrue(np.isnan(asof(release_ts[:0], values[:0], np.array([5]))).all())
+
+    def testIncremental(self):
+        """ Test days appended one at a time give the columns of calculating all of them at once """
+        full = MacroEngine(self.panel).overlay('PT1', 'CA')
+        n = len(self.panel) - 250
+        panel = MacroPanel(self.panel.ts[:n], self.panel.prices[:n], self.panel.assets, dict(self.panel.releases))
+        engine = MacroEngine(panel)
+        engine.overlay('PT1', 'CA')
+        for i in range(n, len(self.panel)):
+            panel.append(self.panel.ts[i], self.panel.prices[i])
+            if i % 50 == 0:
+                engine.overlay('PT1', 'CA')
+        result = engine.overlay('PT1', 'CA')
+        for col in MACRO_COLUMNS:
+            if full[col].dtype.kind == 'f':
+                np.testing.assert_allclose(result[col], full[col], rtol=1e-9, equal_nan=True, err_msg=col)
+            else:
+                np.testing.assert_array_equal(result[col], full[col], err_msg=col)
+        with self.assertRaises(ValueError):
+            panel.append(self.panel.ts[0], self.panel.prices[0])
+
+    def testOverlay(self):
+        """ Test the position follows momentum only with the regime, PnL is on the next day's return """
+        r = MacroEngine(self.panel).overlay('ES1', 'US', lookback=21)
+        trend = np.nan_to_num(np.sign(r['momentum']))
+        self.assertTrue(((r['position'] == 0) | ((r['position'] == r['regime']) & (trend == r['regime']))).all())
+        np.testing.assert_allclose(r['pnl'][1:], r['position'][:-1] * r['return'][1:], equal_nan=True)
+        self.assertTrue((r['regime'] != 0).any() and (r['position'] != 0).any())
+        with self.assertRaises(ValueError):
+            MacroEngine(self.panel).overlay('ES1', 'JP')
+
+
+class MacroServerTest(ServerTestCase):
+    """ macro instruction round trips """
+    def setUp(self):
+        super(MacroServerTest, self).setUp()
+        self.server = self.serve(Server(['IBM'], 0, workers=2, av=FakeRetriever(), fh=EmptyRetriever()))
+
+    def testMacro(self):
+        """ Test an overlay query over a span of days and a bad one """
+        with Client('127.0.0.1:{0}'.format(self.server.port)) as c:
+            df = c.macro('CADUSD', 'CA', '2020-01-01', '2020-12-31', lookback=21, against='DXY')
+            self.assertListEqual(list(df.columns), MACRO_COLUMNS[1:])
+            self.assertEqual(df.index[0], pd.Timestamp('2020-01-01'))
+            self.assertEqual(df.index[-1], pd.Timestamp('2020-12-31'))
+            self.assertTrue(df['corr'].notna().all())
+            self.assertEqual(c.request('macro', {'asset': 'ES1', 'country': 'US', 'to': '2020/12/31'}).result, ERROR)
+            self.assertEqual(c.prep_request('macro ES1 US 2020-01-01').arg['from'], '2020-01-01')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import sys
+import math
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from metrics import Metrics, quantile, summarize, render_prometheus, LATENCY_BUCKETS
+
+
+class MetricsTest(unittest.TestCase):
+    """ Metrics Registry Unit Tests"""
+    def setUp(self):
+        self.metrics = Metrics()
+
+    def testHistogram(self):
+        """ Test observations land in the first bucket at or above them, count and sum kept """
+        for value in [1e-5, 1.5e-5, 0.3, 100.0]:
+            self.metrics.observe('lat', value, inst='data')
+        series = self.metrics.snapshot()['histograms']['lat'][0]
+        self.assertDictEqual(series['labels'], {'inst': 'data'})
+        self.assertEqual(series['count'], 4)
+        self.assertAlmostEqual(series['sum'], 100.300025)
+        self.assertEqual(series['counts'][0], 1)
+        self.assertEqual(series['counts'][1], 1)
+        self.assertEqual(series['counts'][-1], 1)  # past the last finite bound
+
+    def testQuantile(self):
+        """ Test quantiles interpolate inside the bucket holding the rank """
+        for _ in range(100):
+            self.metrics.observe('lat', 0.0015)
+        series = self.metrics.snapshot()['histograms']['lat'][0]
+        p50 = quantile(series, 0.5)
+        self.assertTrue(LATENCY_BUCKETS[7] < p50 <= LATENCY_BUCKETS[8], p50)
+        self.assertTrue(math.isnan(quantile({'count': 0, 'buckets': [], 'counts': []}, 0.5)))
+        row = summarize(self.metrics.snapshot())[0]
+        self.assertEqual(row['count'], 100)
+        self.assertAlmostEqual(row['mean'], 0.0015)
+
+    def testTimer(self):
+        """ Test the timer records once even when the block raises """
+        with self.assertRaises(ValueError):
+            with self.metrics.timer('stage', stage='sort'):
+                raise ValueError
+        self.assertEqual(self.metrics.snapshot()['histograms']['stage'][0]['count'], 1)
+
+    def testPrometheus(self):
+        """ Test exposition format, one TYPE per family with the series of every snapshot under it """
+        self.metrics.observe('lat', 0.002, inst='data')
+        self.metrics.inc('errors', inst='add')
+        self.metrics.set('bytes', 37, ticker='IBM')
+        other = Metrics()
+        other.observe('lat', 0.004, inst='data')
+        text = render_prometheus([(self.metrics.snapshot(), {'shard': '0'}), (other.snapshot(), {'shard': '1'})])
+        lines = text.splitlines()
+        self.assertEqual(lines.count('# TYPE lat histogram'), 1)
+        self.assertIn('# TYPE errors counter', lines)
+        self.assertIn('errors{inst="add",shard="0"} 1', lines)
+        self.assertIn('bytes{shard="0",ticker="IBM"} 37', lines)
+        self.assertIn('lat_bucket{inst="data",le="+Inf",shard="1"} 1', lines)
+        self.assertIn('lat_count{inst="data",shard="0"} 1', lines)
+        buckets = [int(line.rsplit(' ', 1)[1]) for line in lines if line.startswith('lat_bucket') and 'shard="0"' in line]
+        self.assertEqual(buckets, sorted(buckets))  # cumulative
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import os
+import sys
+import unittest
+import numpy as np
+import pandas as pd
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from portfolio import Portfolio, PORTFOLIO_COLUMNS, apply_caps
+from signal_engine import SignalEngine
+from store import TickerBlock
+from server import Server
+from client import Client
+from constant import *
+from server_test import FakeRetriever, EmptyRetriever, ServerTestCase
+
+
+def block(n, offset=0, seed=0):
+    """ Block of {n} 30min bars starting {offset} bars late, with the signal engine's analytics """
+    ts = pd.date_range('2024-01-02 09:30', periods=n + offset, freq='30min').as_unit('ns').asi8[offset:]
+    price = 100 + np.cumsum(np.random.default_rng(seed).normal(0, 1, n))
+    b = TickerBlock.from_prices(ts, price)
+    b.set_analytics(SignalEngine(5).run(price, [0, n]))
+    return b
+
+
+class PortfolioTest(unittest.TestCase):
+    """ Portfolio aggregation and caps Unit Tests """
+    def setUp(self):
+        self.tickers = ['IBM', 'AAPL', 'MSFT']
+        self.blocks = [block(300, 0, 0), block(250, 40, 1), block(280, 7, 2)]
+
+    def testUncapped(self):
+        """ Test uncapped portfolio PnL is the sum of each ticker's own PnL, on every bar time """
+        columns = Portfolio().update(self.tickers, self.blocks)
+        times = np.unique(np.concatenate([b['ts'] for b in self.blocks]))
+        np.testing.assert_array_equal(columns['datetime'], times)
+        self.assertAlmostEqual(columns['pnl'].sum(), sum(np.nansum(b['pnl']) for b in self.blocks))
+        np.testing.assert_allclose(columns['equity'], np.cumsum(columns['pnl']))
+        self.assertTrue((columns['drawdown'] <= 0).all())
+
+    def testCaps(self):
+        """ Test every bar keeps within the ticker, gross and net caps """
+        portfolio = Portfolio(ticker_cap=4, gross_cap=800, net_cap=150)
+        columns = portfolio.update(self.tickers, self.blocks)
+        self.assertTrue((columns['gross'] <= 800 + 1e-6).all())
+        self.assertTrue((np.abs(columns['net']) <= 150 + 1e-6).all())
+        self.assertTrue((np.abs(portfolio.position) <= 4).all())
+        self.assertTrue((columns['gross'] > 0).any())
+
+        position = apply_caps(np.array([10.0, 5.0, -2.0]), np.array([10.0, 20.0, 10.0]), 8, np.inf, 100)
+        np.testing.assert_allclose(position, [16 / 3, 10 / 3, -2.0])  # clipped, then longs cut to net 100
+
+    def testIncremental(self):
+        """ Test bars appended between updates give the columns of taking them all in at once """
+        full = Portfolio(ticker_cap=4, gross_cap=800, net_cap=150).update(self.tickers, self.blocks)
+        portfolio = Portfolio(ticker_cap=4, gross_cap=800, net_cap=150)
+        growing = [TickerBlock() for _ in self.blocks]
+        for hi in [50, 51, 120, 300]:
+            for g, b in zip(growing, self.blocks):
+                n = len(g)
+                m = max(n, np.searchsorted(b['ts'], self.blocks[0]['ts'][hi - 1], 'right'))
+                g.append(b['ts'][n:m], b['price'][n:m], {col: b[col][n:m] for col in b.cols if col not in
+                                                         ['ts', 'price']})
+            columns = portfolio.update(self.tickers, [g.snapshot() for g in growing])
+        for col in PORTFOLIO_COLUMNS:
+            np.testing.assert_allclose(columns[col], full[col], err_msg=col)
+
+        # A replaced block starts over
+        uid = portfolio.uids[0]
+        portfolio.update(self.tickers, [block(10)] + self.blocks[1:])
+        self.assertNotEqual(portfolio.uids[0], uid)
+
+
+class PortfolioServerTest(ServerTestCase):
+    """ portfolio instruction round trips """
+    def setUp(self):
+        super(PortfolioServerTest, self).setUp()
+        self.server = self.serve(Server(['IBM', 'AAPL'], 0, workers=2, av=FakeRetriever(), fh=EmptyRetriever()))
+
+    def testPortfolio(self):
+        """ Test an uncapped and a capped query over a span of bars, and bad caps """
+        with Client('127.0.0.1:{0}'.format(self.server.port)) as c:
+            df, position = c.portfolio()
+            self.assertListEqual(list(df.columns), PORTFOLIO_COLUMNS[1:])
+            self.assertListEqual(list(position.index), ['IBM', 'AAPL'])
+            held = sum(np.nansum(self.server.data.block(t)['pnl']) for t in ['IBM', 'AAPL'])
+            self.assertAlmostEqual(df['pnl'].sum(), held)
+
+            df, position = c.portfolio(ticker_cap=3, gross_cap=500, start='2024-02-01-09:30', end='2024-02-05-16:00')
+            self.assertTrue((df['gross'] <= 500 + 1e-6).all())
+            self.assertTrue((position.abs() <= 3).all())
+            self.assertGreaterEqual(df.index[0], pd.Timestamp('2024-02-01 09:30'))
+            self.assertLessEqual(df.index[-1], pd.Timestamp('2024-02-05 16:00'))
+            self.assertEqual(c.request('portfolio', {'net_cap': -1}).result, ERROR)
+            self.assertEqual(c.request('portfolio', {'gross_cap': 'all'}).result, ERROR)
+            self.assertEqual(c.prep_request('portfolio 5 1000').arg, {'ticker_cap': 5.0, 'gross_cap': 1000.0})
+
+
+if __name__ == '__main__':
+    unittest.main()
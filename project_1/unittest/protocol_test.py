@@ -0,0 +1,110 @@
+import os
+import sys
+import socket
+import threading
+import unittest
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from protocol import encode, decode, send_message, recv_message, send_payload, recv_payload, HEADER, MAGIC, \
+    ProtocolError, encode_message, encode_response, send_encoded, decode_message, K_QUERY, T_DICT, T_STR, _LEN
+from message import Query, Response
+from constant import *
+
+
+class ProtocolTest(unittest.TestCase):
+    """ Wire Protocol Unit Tests"""
+    def setUp(self):
+        self.a, self.b = socket.socketpair()
+
+    def testRoundTrip(self):
+        """ Test plain values survive encode/decode """
+        values = [None, True, False, 0, -1, 2 ** 62, 1.5, float('inf'), '', 'IBM', 'ünï', b'\x00raw',
+                  [], [1.0, 2.5], [1, -2], ['IBM', 'AAPL'], [1, 'a', None, [2.0]], {'a': [1.0], 2: {'b': None}}]
+        for value in values:
+            self.assertEqual(decode(encode(value)), value)
+
+    def testArray(self):
+        """ Test numpy arrays are sent as raw buffers """
+        for arr in [np.arange(10, dtype=np.float64), np.array([-1, 0, 1], dtype=np.int8),
+                    np.zeros((3, 2), dtype=np.float32), np.array(['2024-03-08T09:30'], dtype='datetime64[ns]')]:
+            out = decode(encode(arr))
+            self.assertEqual(out.dtype, arr.dtype)
+            np.testing.assert_array_equal(out, arr)
+        self.assertLess(len(encode(np.zeros(1000))), 8100)
+
+    def testRejects(self):
+        """ Test objects and malformed payloads are refused """
+        self.assertRaises(ProtocolError, encode, object())
+        self.assertRaises(ProtocolError, encode, np.array(['x'], dtype=object))
+        self.assertRaises(ProtocolError, decode, encode([1.0, 2.0])[:-1])
+        self.assertRaises(ProtocolError, decode, b'Z')
+        self.assertRaises(ProtocolError, decode, encode(1) + b'N')
+
+    def testMalformedMessages(self):
+        """ Test unhashable keys, bad UTF-8 and randomly corrupted payloads only ever raise ProtocolError """
+        valid = encode_message(Query('data', {'ticker': 'IBM', 'from': '2024-03-08-09:30', 'to': '2024-03-08-16:00'}))
+        payloads = [K_QUERY + T_DICT + _LEN.pack(1) + encode([1]) + encode(None),
+                    K_QUERY + T_DICT + _LEN.pack(1) + T_STR + _LEN.pack(2) + b'\xff\xfe' + encode(None),
+                    K_QUERY + encode({'inst': 'data'}), b'x' + valid[1:], b'']
+        rng = np.random.default_rng(0)
+        for _ in range(2000):
+            payload = bytearray(valid[:rng.integers(1, len(valid) + 1)])
+            for pos in rng.integers(0, len(payload), rng.integers(1, 4)):
+                payload[pos] = rng.integers(0, 256)
+            payloads.append(bytes(payload))
+        for payload in payloads:
+            try:
+                self.assertIsInstance(decode_message(payload), Query)
+            except ProtocolError:
+                pass
+
+        # Over a connection it reads as an error, not a dead reader
+        send_payload(self.a, payloads[0])
+        self.assertRaises(ProtocolError, recv_message, self.b)
+
+    def testMessages(self):
+        """ Test query and response framing over a socket """
+        send_message(self.a, Query('data', '2024-03-08-12:30'))
+        query = recv_message(self.b)
+        self.assertEqual((query.inst, query.arg), ('data', '2024-03-08-12:30'))
+
+        send_message(self.b, Response(DATA, SUCCESS, {'ticker': ['IBM'], 'price': np.array([195.5])}))
+        response = recv_message(self.a)
+        self.assertEqual((response.inst, response.result), (DATA, SUCCESS))
+        self.assertEqual(response.data['price'][0], 195.5)
+
+    def testEncodedResponse(self):
+        """ Test a reply encoded once then tagged per request reads as the same message sent whole """
+        response = Response(DATA, SUCCESS, {'ticker': ['IBM'], 'price': np.array([195.5])}, req_id=7)
+        prefix = encode_response(response)
+        self.assertEqual(prefix + encode(7), encode_message(response))
+        send_encoded(self.a, prefix, 8)
+        received = recv_message(self.b)
+        self.assertEqual((received.inst, received.result, received.req_id), (DATA, SUCCESS, 8))
+        self.assertEqual(received.data['price'][0], 195.5)
+
+    def testMultiFrame(self):
+        """ Test payloads larger than one frame are reassembled """
+        payload = os.urandom(FRAME_SIZE * 3 + 17)
+        t = threading.Thread(target=send_payload, args=(self.a, payload))
+        t.start()
+        self.assertEqual(bytes(recv_payload(self.b)), payload)
+        t.join()
+
+    def testVersion(self):
+        """ Test frames from another protocol version are refused """
+        self.a.sendall(HEADER.pack(MAGIC, PROTOCOL_VERSION + 1, 1, 0))
+        self.assertRaises(ProtocolError, recv_payload, self.b)
+
+    def testClosed(self):
+        """ Test a clean close reads as no message """
+        self.a.close()
+        self.assertIsNone(recv_message(self.b))
+
+    def tearDown(self):
+        self.a.close()
+        self.b.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
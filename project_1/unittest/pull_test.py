@@ -0,0 +1,136 @@
+import os
+import sys
+import json
+import time
+import threading
+import unittest
+import pandas as pd
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from data_retriever import DataRetrieverAV, DataRetrieverFH, DataRetrieverPdAV, DataRetrieverPdFH, RateLimiter
+from server import Server
+from message import Query
+from constant import *
+from server_test import ServerTestCase
+
+DELAY = 0.1  # upstream latency of every stub call
+MAX_CONNECTIONS = 4
+QUOTE_TIME = 1709931600  # 2024-03-08 16:00 EST
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """ Answers Alpha Vantage /query and Finn Hub /quote calls, symbol BAD fails and NOTE hits the call limit """
+
+    def do_GET(self):
+        stub = self.server
+        url = urlparse(self.path)
+        symbol = parse_qs(url.query)['symbol'][0]
+        with stub.lock:
+            stub.calls.append((url.path, symbol))
+            stub.in_flight[url.path] = stub.in_flight.get(url.path, 0) + 1
+            stub.max_in_flight[url.path] = max(stub.max_in_flight.get(url.path, 0), stub.in_flight[url.path])
+        time.sleep(DELAY)
+        with stub.lock:
+            stub.in_flight[url.path] -= 1
+
+        if symbol == 'BAD':
+            self.send_response(500)
+            self.end_headers()
+            return
+        if url.path == '/query':
+            if symbol == 'NOTE':
+                body = {'Note': 'API call frequency exceeded'}
+            else:
+                index = pd.date_range('2024-03-07 09:30', '2024-03-07 16:00', freq='30min')
+                body = {'Time Series (30min)': {dt.strftime('%Y-%m-%d %H:%M:%S'): {
+                    '1. open': '1', '2. high': '1', '3. low': '1', '4. close': str(100.0 + i), '5. volume': '1'}
+                    for i, dt in enumerate(index)}}
+        else:
+            body = {'c': 150.0, 't': QUOTE_TIME}
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class ParallelPullTest(ServerTestCase):
+    """ Concurrent upstream pull against a local stub HTTP server """
+    def setUp(self):
+        super(ParallelPullTest, self).setUp()
+        self.stub = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        self.stub.lock = threading.Lock()
+        self.stub.calls, self.stub.in_flight, self.stub.max_in_flight = [], dict(), dict()
+        threading.Thread(target=self.stub.serve_forever, daemon=True).start()
+        base = 'http://127.0.0.1:{0}'.format(self.stub.server_address[1])
+        self.av = DataRetrieverAV('key', base + '/query?', '30min', max_connections=MAX_CONNECTIONS)
+        self.fh = DataRetrieverFH('token', base + '/quote?', '30min', max_connections=MAX_CONNECTIONS)
+
+    def testConcurrentStartup(self):
+        """ Test tickers are pulled concurrently over a bounded number of connections per provider """
+        tickers = ['T{0}'.format(i) for i in range(8)]
+        start = time.perf_counter()
+        server = self.track(Server(list(tickers), 0, av=self.av, fh=self.fh))
+        elapsed = time.perf_counter() - start
+
+        self.assertListEqual(server.tickers, tickers)
+        self.assertEqual(len(self.stub.calls), 2 * len(tickers))
+        self.assertLess(elapsed, 2 * len(tickers) * DELAY / 2)  # sequential would take every call's latency
+        for path in ['/query', '/quote']:
+            self.assertGreater(self.stub.max_in_flight[path], 1)
+            self.assertLessEqual(self.stub.max_in_flight[path], MAX_CONNECTIONS)
+        block = server.data.block('T0')
+        self.assertEqual(len(block), 14 + 14)  # trailing day from AV, quote day flat filled from FH
+        self.assertEqual(block['price'][-1], 150.0)
+
+    def testFailuresReported(self):
+        """ Test failed tickers are reported and skipped without aborting the others """
+        server = self.track(Server(['IBM', 'BAD', 'NOTE'], 0, av=self.av, fh=self.fh))
+        self.assertListEqual(server.tickers, ['IBM'])
+
+        failures = server.refresh_data()
+        self.assertSetEqual(set(failures), set())
+
+        response = server.process_query(Query('add', 'NOTE'))
+        self.assertEqual(response.result, ERROR)
+        self.assertIn('API call frequency exceeded', response.data)
+
+        server.tickers.append('BAD')  # a held ticker whose upstream starts failing
+        response = server.process_query(Query('report'))
+        self.assertEqual(response.result, SUCCESS)
+        self.assertListEqual(list(response.data), ['BAD'])
+        self.assertIn('500', response.data['BAD'])
+
+    def testPandasRetrievers(self):
+        """ Test the saved data files replayed through the pandas retrievers stitch like live data """
+        server = self.track(Server(['IBM', 'AAPL', 'MSFT'], 0, av=DataRetrieverPdAV(), fh=DataRetrieverPdFH()))
+        self.assertListEqual(server.tickers, ['IBM', 'AAPL', 'MSFT'])
+        block = server.data.block('IBM')
+        self.assertTrue((block['ts'][1:] > block['ts'][:-1]).all())
+        self.assertEqual(block['ts'][-1], pd.Timestamp('2024-03-08 16:00').value)
+        self.assertEqual(block['price'][-1], 195.95)
+
+    def testRateLimit(self):
+        """ Test calls beyond the burst are spread over the period """
+        limiter = RateLimiter(5, period=0.5)
+        start = time.perf_counter()
+        threads = [threading.Thread(target=limiter.acquire) for _ in range(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertGreaterEqual(time.perf_counter() - start, 0.45)
+
+    def tearDown(self):
+        self.stub.shutdown()
+        self.stub.server_close()
+        super(ParallelPullTest, self).tearDown()
+
+
+if __name__ == '__main__':
+    unittest.main()
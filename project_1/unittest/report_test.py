@@ -0,0 +1,108 @@
+import os
+import sys
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from report import ColumnarReportWriter, CsvReportWriter, BackgroundReporter, open_report
+from signal_engine import SignalEngine, RollingState
+from store import TickerBlock, BLOCK_DTYPES
+from signal_engine_test import random_frame, WINDOW
+
+
+class ReportWriterTest(unittest.TestCase):
+    """ Report Writer Unit Tests"""
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'report')
+        self.engine = SignalEngine(WINDOW)
+        self.blocks = {ticker: TickerBlock.from_frame(random_frame(ticker, 200, seed))
+                       for seed, ticker in enumerate(['IBM', 'AAPL'])}
+        self.engine.run_blocks(list(self.blocks.values()))
+
+    def snapshot(self):
+        return {ticker: block.snapshot() for ticker, block in self.blocks.items()}
+
+    def assertReportEqual(self, report):
+        self.assertListEqual(list(report), list(self.blocks))
+        for ticker, block in self.blocks.items():
+            pd.testing.assert_frame_equal(report[ticker].frame(ticker), block.frame(ticker))
+
+    def testRoundTrip(self):
+        """ Test the memory-mapped report reads back the bars and analytics written """
+        ColumnarReportWriter(self.path).write(self.snapshot())
+        report = open_report(self.path)
+        self.assertIsInstance(report['IBM']['price'], np.memmap)
+        self.assertReportEqual(report)
+
+    def testAppendOnly(self):
+        """ Test new bars are appended without rewriting the bars already on disk """
+        writer = ColumnarReportWriter(self.path)
+        writer.write(self.snapshot())
+        price_file = writer.file('IBM', 'price')
+        before = open(price_file, 'rb').read()
+
+        block = self.blocks['IBM']
+        state = RollingState.from_block(block, WINDOW)
+        prices = block['price'][-1] + np.arange(1, 6, dtype=np.float64)
+        ts = block['ts'][-1] + np.arange(1, 6) * 1800 * 10 ** 9
+        block.append(ts, prices, state.update(prices))
+        untouched = os.stat(writer.file('AAPL', 'price')).st_mtime_ns
+        writer.write(self.snapshot())
+
+        after = open(price_file, 'rb').read()
+        self.assertEqual(after[:len(before)], before)
+        self.assertEqual(len(after), len(before) + 5 * 8)
+        self.assertEqual(os.stat(writer.file('AAPL', 'price')).st_mtime_ns, untouched)
+        self.assertReportEqual(open_report(self.path))
+
+    def testReplaceAndDelete(self):
+        """ Test a replaced block is rewritten and a deleted ticker's files are removed """
+        writer = ColumnarReportWriter(self.path)
+        writer.write(self.snapshot())
+        self.blocks['IBM'] = TickerBlock.from_frame(random_frame('IBM', 50, 7))
+        self.engine.run_blocks([self.blocks['IBM']])
+        del self.blocks['AAPL']
+        writer.write(self.snapshot())
+
+        self.assertReportEqual(open_report(self.path))
+        self.assertFalse(any(name.startswith('AAPL.') for name in os.listdir(self.path)))
+        self.assertEqual(len(os.listdir(self.path)), len(BLOCK_DTYPES) + 1)
+
+    def testUnsafeTickers(self):
+        """ Test tickers holding path separators stay inside the report and read back under their own names """
+        self.blocks = {'../x': self.blocks['IBM'], 'a/b': self.blocks['AAPL'], 'c%2Fd': self.blocks['IBM']}
+        writer = ColumnarReportWriter(self.path)
+        writer.write(self.snapshot())
+        self.assertFalse(os.path.exists(os.path.join(self.tmp.name, 'x.price.bin')))
+        self.assertEqual(len(os.listdir(self.path)), 3 * len(BLOCK_DTYPES) + 1)
+        self.assertReportEqual(open_report(self.path))
+
+        del self.blocks['a/b']
+        writer.write(self.snapshot())
+        self.assertEqual(len(os.listdir(self.path)), 2 * len(BLOCK_DTYPES) + 1)
+        self.assertReportEqual(open_report(self.path))
+
+    def testCsv(self):
+        """ Test the text backend still writes the stacked report """
+        path = os.path.join(self.tmp.name, 'report.csv')
+        CsvReportWriter(path).write(self.snapshot())
+        df = pd.read_csv(path, index_col=0)
+        self.assertEqual(len(df), 400)
+        self.assertListEqual(df['ticker'].unique().tolist(), ['IBM', 'AAPL'])
+
+    def testBackground(self):
+        """ Test writes happen off the caller's thread and flush waits for them """
+        reporter = BackgroundReporter(ColumnarReportWriter(self.path))
+        reporter.submit(self.snapshot())
+        self.assertTrue(reporter.flush(timeout=10))
+        self.assertIsNone(reporter.error)
+        self.assertReportEqual(open_report(self.path))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
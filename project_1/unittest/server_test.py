@@ -0,0 +1,456 @@
+import os
+import sys
+import time
+import socket
+import tempfile
+import threading
+import unittest
+import numpy as np
+import pandas as pd
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from server import Server, join_chunks
+from message import Query, Response
+from protocol import recv_message, encode_message
+from client import Client
+from report import open_report
+from store import TickerBlock
+from signal_engine import SignalEngine
+from constant import *
+
+
+class FakeRetriever(object):
+    """ Stand-in for the upstream data retrievers, serves random walk bars after an optional delay """
+    def __init__(self, num_bars=300, delay=0.0):
+        self.num_bars = num_bars
+        self.delay = delay
+
+    def retrieve(self, ticker):
+        time.sleep(self.delay)
+        rng = np.random.default_rng(sum(map(ord, ticker)))
+        index = pd.date_range('2024-02-01 09:30', periods=self.num_bars, freq='30min', name='datetime')
+        df = pd.DataFrame({'price': 100 + np.cumsum(rng.normal(0, 1, self.num_bars)).round(2)}, index=index)
+        df['ticker'] = ticker
+        return df
+
+    def process_data(self, df, ticker):
+        return df
+
+
+class CountingRetriever(FakeRetriever):
+    """ FakeRetriever counting upstream calls """
+    def __init__(self, *args, **kwargs):
+        super(CountingRetriever, self).__init__(*args, **kwargs)
+        self.calls = 0
+
+    def retrieve(self, ticker):
+        self.calls += 1
+        return super(CountingRetriever, self).retrieve(ticker)
+
+
+class EmptyRetriever(FakeRetriever):
+    """ Stand-in for the live quote retriever when there is no live session """
+    def retrieve(self, ticker):
+        return pd.DataFrame({'price': [], 'ticker': []}, index=pd.DatetimeIndex([], name='datetime'))
+
+
+class FlatFillRetriever(FakeRetriever):
+    """ Stand-in for the live quote retriever during a session, the latest quote flat filled over the {num_bars}
+        bars after the last one of Alpha Vantage stand-in {av}
+    """
+    def __init__(self, av, num_bars=13):
+        super(FlatFillRetriever, self).__init__(num_bars)
+        self.av = av
+
+    def retrieve(self, ticker):
+        index = pd.date_range('2024-02-01 09:30', periods=self.av.num_bars + self.num_bars, freq='30min',
+                              name='datetime')[self.av.num_bars:]
+        return pd.DataFrame({'price': 100.0, 'ticker': ticker}, index=index)
+
+
+def serve(server):
+    """ Run {server} on a background thread, returned once it is listening """
+    ready = threading.Event()
+    threading.Thread(target=server.run, kwargs={'ready': lambda port: ready.set()}, daemon=True).start()
+    ready.wait(10)
+    return server
+
+
+def request(port, query):
+    """ Send one {query} to the server on a fresh connection and return its response """
+    with Client('127.0.0.1:{0}'.format(port)) as c:
+        return c.receive(c.send(query))
+
+
+class ServerTestCase(unittest.TestCase):
+    """ Base of the tests run in a temporary working directory, where the servers' report, cache and history land """
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        self.servers = []
+
+    def track(self, server):
+        """ Flush the report {server} writes in the background before the directory goes """
+        self.servers.append(server)
+        return server
+
+    def serve(self, server):
+        """ Run {server} on a background thread, returned once it is listening """
+        if server not in self.servers:
+            self.track(server)
+        return serve(server)
+
+    def tearDown(self):
+        for server in self.servers:
+            server.reporter.flush(timeout=10)
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+
+class ServerTest(ServerTestCase):
+    """ Server Unit Tests"""
+    def setUp(self):
+        super(ServerTest, self).setUp()
+        self.av = FakeRetriever()
+        self.server = self.serve(Server(['IBM', 'AAPL'], 0, workers=4, av=self.av, fh=EmptyRetriever()))
+        self.port = self.server.port
+
+    def testData(self):
+        """ Test data snapshot across tickers """
+        response = request(self.port, Query('data', '2024-02-05-12:30'))
+        self.assertEqual(response.result, SUCCESS)
+        self.assertListEqual(response.data['ticker'], ['IBM', 'AAPL'])
+
+    def testQueryMany(self):
+        """ Test the batch lookup agrees with single lookups """
+        dts = ['2024-02-01-08:00', '2024-02-02-10:15', '2024-02-05-12:30', '2024-03-30-12:30']
+        batch = self.server.query_many('IBM', dts)
+        single = pd.concat([self.server.query('IBM', dt) for dt in dts])
+        pd.testing.assert_frame_equal(batch, single)
+
+    def testRange(self):
+        """ Test a range query streams back the bars between its ends in chunks """
+        self.server.chunk_rows = 32
+        with Client('127.0.0.1:{0}'.format(self.port)) as c:
+            chunks = list(c.range_chunks('IBM', '2024-02-02-09:30', '2024-02-05-16:00'))
+            self.assertGreater(len(chunks), 1)
+            bars = pd.concat(chunks)
+            block = self.server.data.block('IBM')
+            index = pd.DatetimeIndex(block['ts'].view('datetime64[ns]'))
+            inside = (index >= '2024-02-02 09:30') & (index <= '2024-02-05 16:00')
+            np.testing.assert_array_equal(bars['price'], block['price'][inside])
+            np.testing.assert_array_equal(bars.index, index[inside])
+            self.assertEqual(len(c.data_range('IBM', '2024-03-02-09:30', '2024-03-05-16:00')), 0)
+            self.assertEqual(len(c.data_range('IBM', '2024-03-02-09:30', '2024-03-05-16:00', interval='60min')), 0)
+            with self.assertRaises(RuntimeError):
+                c.data_range('NOPE', '2024-02-02-09:30', '2024-02-05-16:00')
+            with self.assertRaises(RuntimeError):
+                c.data_range('IBM', '2024-02-05-09:30', '2024-02-02-16:00')
+            self.assertEqual(c.request('data', '2024-02-05-12:30').result, SUCCESS)  # connection still in step
+
+    def testRangeDownsample(self):
+        """ Test OHLC downsampling matches pandas resampling and buckets are not split over chunks """
+        self.server.chunk_rows = 5
+        with Client('127.0.0.1:{0}'.format(self.port)) as c:
+            bars = c.data_range('IBM', '2024-02-01-09:30', '2024-02-07-16:00', interval='120min')
+        block = self.server.data.block('IBM')
+        prices = pd.Series(block['price'], index=pd.DatetimeIndex(block['ts'].view('datetime64[ns]')))
+        expected = prices.resample('120min').ohlc().dropna()
+        self.assertFalse(bars.index.has_duplicates)
+        np.testing.assert_array_equal(bars.index, expected.index)
+        np.testing.assert_array_equal(bars[['open', 'high', 'low', 'close']].values, expected.values)
+        response = self.server.process_query(Query('data', {'ticker': 'IBM', 'from': '2024-02-01-09:30',
+                                                            'to': '2024-02-07-16:00', 'interval': 'day'}))
+        self.assertEqual(len(response.data['close']), len(prices.resample('D').last().dropna()))
+
+    def testLateBars(self):
+        """ Test bars falling between held ones are merged in and the bars from them on recalculated """
+        held = self.server.data.block('IBM')
+        ts, price = held['ts'].copy(), held['price'].copy()
+        late = ts[[100, 200]] + 15 * 60 * 10 ** 9  # half way through two held bars
+        step = 30 * 60 * 10 ** 9
+        with self.server.lock.write():
+            count = self.server.append_prices('IBM', np.append(late, ts[-1] + step), np.array([90.0, 95.0, 99.0]))
+        self.assertEqual(count, len(ts) - 101 + 3)
+        expected = TickerBlock.from_prices(np.append(np.insert(ts, [101, 201], late), ts[-1] + step),
+                                           np.append(np.insert(price, [101, 201], [90.0, 95.0]), 99.0))
+        SignalEngine(self.server.window_size()).run_blocks([expected])
+        block = self.server.data.block('IBM')
+        np.testing.assert_array_equal(block['ts'], expected['ts'])
+        np.testing.assert_array_equal(block['price'], expected['price'])
+        np.testing.assert_array_equal(block['signal'], expected['signal'])
+        np.testing.assert_allclose(block['pnl'], expected['pnl'], equal_nan=True)
+
+    def testLargeResponse(self):
+        """ Test a data snapshot far beyond one frame is streamed back whole """
+        tickers = ['T{0:04d}'.format(i) for i in range(2000)]
+        for ticker in tickers:
+            self.server.data.put(ticker, self.server.data.block('IBM'))
+        self.server.tickers.extend(tickers)
+        response = request(self.port, Query('data', '2024-02-05-12:30'))
+        self.assertEqual(response.result, SUCCESS)
+        self.assertEqual(len(response.data['ticker']), 2002)
+        self.assertEqual(len(response.data['price']), 2002)
+
+    def testReadsNotBlockedByAdd(self):
+        """ Test data queries are served while a slow add is pulling upstream data """
+        self.av.delay = 1.0
+        add = threading.Thread(target=lambda: self.assertEqual(request(self.port, Query('add', 'MSFT')).result,
+                                                               SUCCESS))
+        add.start()
+        time.sleep(0.1)
+
+        latencies = []
+
+        def read():
+            start = time.perf_counter()
+            self.assertEqual(request(self.port, Query('data', '2024-02-05-12:30')).result, SUCCESS)
+            latencies.append(time.perf_counter() - start)
+
+        readers = [threading.Thread(target=read) for _ in range(6)]
+        for t in readers:
+            t.start()
+        for t in readers:
+            t.join()
+        self.assertEqual(len(latencies), len(readers))
+        self.assertLess(max(latencies), 0.5)
+
+        add.join()
+        response = request(self.port, Query('data', '2024-02-05-12:30'))
+        self.assertListEqual(response.data['ticker'], ['IBM', 'AAPL', 'MSFT'])
+
+    def testPersistentPipeline(self):
+        """ Test many requests on one connection, pipelined replies matched to their requests """
+        dts = ['2024-02-0{0}-1{1}:30'.format(d, h) for d in range(1, 9) for h in range(0, 6)]
+        with Client('127.0.0.1:{0}'.format(self.port)) as c:
+            sock = c.sock
+            expected = [c.request('data', dt).data['price'].tolist() for dt in dts]
+            responses = c.pipeline([Query('data', dt) for dt in dts] + [Query('bogus')])
+            self.assertIs(c.sock, sock)
+        self.assertListEqual([r.data['price'].tolist() for r in responses[:-1]], expected)
+        self.assertEqual(responses[-1].result, ERROR)
+
+    def testDeleteAndReport(self):
+        """ Test delete then report refresh """
+        self.assertEqual(request(self.port, Query('delete', 'AAPL')).result, SUCCESS)
+        self.assertEqual(request(self.port, Query('report')).result, SUCCESS)
+        response = request(self.port, Query('data', '2024-02-05-12:30'))
+        self.assertListEqual(response.data['ticker'], ['IBM'])
+        self.assertTrue(self.server.reporter.flush(timeout=10))
+        self.assertListEqual(list(open_report()), ['IBM'])
+
+    def testReAddOrder(self):
+        """ Test a startup ticker deleted and added again goes after the others, as a new one does """
+        for inst, ticker in [('delete', 'IBM'), ('add', 'MSFT'), ('add', 'IBM')]:
+            self.assertEqual(request(self.port, Query(inst, ticker)).result, SUCCESS)
+        self.assertListEqual(self.server.tickers, ['AAPL', 'MSFT', 'IBM'])
+
+    def testSnapshotCache(self):
+        """ Test repeated snapshots are served from the cache until add, delete or report change the data """
+        with Client('127.0.0.1:{0}'.format(self.port)) as c:
+            first = c.data('2024-02-05-12:30')
+            responses = c.pipeline([Query('data', '2024-02-05-12:30') for _ in range(5)])
+            self.assertTrue(all(r.data['ticker'] == ['IBM', 'AAPL'] for r in responses))
+            np.testing.assert_array_equal(responses[-1].data['price'], first['price'].to_numpy())
+            self.assertEqual(self.server.snapshots.misses, 1)
+            self.assertEqual(self.server.snapshots.hits + self.server.snapshots.coalesced, 5)
+            # Any time resolving to the same bars shares the reply
+            hits = self.server.snapshots.hits
+            for dt in ['2024-02-05-12:20', '2024-02-05-12:45', '2024-02-05-12:16']:
+                np.testing.assert_array_equal(c.data(dt)['price'], first['price'].to_numpy())
+            self.assertEqual(self.server.snapshots.hits, hits + 3)
+            self.assertListEqual(c.data('2024-02-05-12:46')['price'].tolist(),
+                                 self.server.snapshot('2024-02-05-12:46')['price'].tolist())
+            self.assertEqual(self.server.snapshots.misses, 2)
+            minutes = pd.Timestamp('2024-01-31 00:00') + pd.to_timedelta(
+                np.random.default_rng(0).integers(0, 10 * 24 * 60, 200), unit='min')
+            dts = [dt.strftime('%Y-%m-%d-%H:%M') for dt in minutes]
+            for response, dt in zip(c.pipeline([Query('data', dt) for dt in dts]), dts):
+                np.testing.assert_array_equal(response.data['price'], self.server.snapshot(dt)['price'], err_msg=dt)
+
+            misses = self.server.snapshots.misses
+            self.assertEqual(c.add('MSFT').result, SUCCESS)
+            self.assertListEqual(list(c.data('2024-02-05-12:30').index), ['IBM', 'AAPL', 'MSFT'])
+            self.assertEqual(c.delete('IBM').result, SUCCESS)
+            self.assertListEqual(list(c.data('2024-02-05-12:30').index), ['AAPL', 'MSFT'])
+            version = self.server.version
+            self.assertEqual(c.report().result, SUCCESS)
+            self.assertGreater(self.server.version, version)
+            c.data('2024-02-05-12:30')
+            self.assertEqual(self.server.snapshots.misses, misses + 3)
+            self.assertEqual(c.request('data', '2024-02-05').result, ERROR)
+
+    def testBadDatetime(self):
+        """ Test a malformed snapshot datetime gets a data error reply, cached or not, and is not logged """
+        with self.assertNoLogs(level='ERROR'), Client('127.0.0.1:{0}'.format(self.port)) as c:
+            for snapshots in [self.server.snapshots, None]:
+                self.server.snapshots = snapshots
+                for arg in ['2024-02-05', 'noon', 5]:
+                    response = c.request('data', arg)
+                    self.assertEqual((response.inst, response.result), (DATA, ERROR))
+                    self.assertIn('Invalid datetime', response.data)
+
+    def testUnexpectedError(self):
+        """ Test a request failing unexpectedly gets an error reply and its traceback is logged """
+        def fail(query, conn=None, send_lock=None):
+            raise RuntimeError("boom")
+        self.server.process_query = fail
+        a, b = socket.socketpair()
+        with a, b, self.assertLogs(level='ERROR') as logs:
+            self.server.handle(a, threading.Lock(), Query('report', req_id=3))
+            response = recv_message(b)
+        self.assertEqual((response.result, response.req_id), (ERROR, 3))
+        self.assertIn("'report'", logs.output[0])
+        self.assertIn('RuntimeError: boom', logs.output[0])
+
+    def testBacktest(self):
+        """ Test a parameter sweep over the held tickers, the live configuration matching the held PnL """
+        with Client('127.0.0.1:{0}'.format(self.port)) as c:
+            result = c.backtest(windows=[self.server.window_size(), 26], bands=[1.0, 2.0], caps=[5.0])
+            default = c.backtest()
+        self.assertEqual(len(result), 4)
+        held = sum(np.nansum(self.server.data.block(ticker)['pnl']) for ticker in ['IBM', 'AAPL'])
+        self.assertAlmostEqual(default['pnl'][0], held, places=6)
+
+    def testBacktestPool(self):
+        """ Test configured worker processes start once at bind, serve every backtest and match running in process """
+        self.assertIsNone(self.server.backtest_pool)  # 0 runs sweeps in the server process
+        server = Server(['IBM', 'AAPL'], 0, av=FakeRetriever(), fh=EmptyRetriever())
+        server.backtest_processes = 2
+        self.serve(server)
+        pool = server.backtest_pool
+        grid = {'windows': [server.window_size(), 26], 'bands': [1.0, 2.0]}
+        with Client('127.0.0.1:{0}'.format(server.port)) as c:
+            results = [c.backtest(**grid) for _ in range(2)]
+        with Client('127.0.0.1:{0}'.format(self.port)) as c:
+            inline = c.backtest(**grid)
+        self.assertIs(server.backtest_pool, pool)
+        for result in results:
+            self.assertTrue(result.equals(inline))
+        server.close()
+
+    def testStats(self):
+        """ Test request latencies, pull stages, payload sizes and ticker memory are reported """
+        with Client('127.0.0.1:{0}'.format(self.port)) as c:
+            c.data('2024-02-05-12:30')
+            c.request('bogus')
+            stats = c.stats()
+            text = c.stats('prometheus')
+        latency = {series['labels']['inst']: series['count'] for series in stats['histograms']['trading_request_seconds']}
+        self.assertEqual(latency['data'], 1)
+        self.assertEqual(latency['unknown'], 1)
+        stages = {series['labels']['stage'] for series in stats['histograms']['trading_pull_stage_seconds']}
+        self.assertTrue({'retrieve', 'process_data', 'concat', 'dedupe', 'sort'} <= stages)
+        self.assertIn('trading_calculate_seconds', stats['histograms'])
+        self.assertIn('trading_response_bytes', stats['histograms'])
+        memory = {series['labels']['ticker']: series['value'] for series in stats['gauges']['trading_ticker_bytes']}
+        self.assertEqual(memory['IBM'], self.server.data.block('IBM').nbytes())
+        self.assertIn('# TYPE trading_request_seconds histogram', text)
+        self.assertIn('trading_ticker_bars{ticker="AAPL"} 300', text)
+
+
+class StartupTest(ServerTestCase):
+    """ Fast Start and Warm Start Unit Tests"""
+    def start(self, tickers, av, **kwargs):
+        return self.track(Server(list(tickers), 0, av=av, fh=EmptyRetriever(), **kwargs))
+
+    def testWarmStart(self):
+        """ Test a restart holds the reported tickers as saved without pulling or calculating, then grows """
+        first = self.start(['IBM', 'AAPL'], FakeRetriever())
+        first.reporter.flush(timeout=10)
+        warm = self.start(['AAPL', 'IBM', 'MSFT'], FakeRetriever())
+        self.assertListEqual(warm.tickers, ['AAPL', 'IBM', 'MSFT'])
+        stitched = [series['count'] for series in warm.metrics.snapshot()['histograms']['trading_pull_stage_seconds']
+                    if series['labels']['stage'] == 'concat']
+        self.assertListEqual(stitched, [1])  # only MSFT was pulled
+        for ticker in ['IBM', 'AAPL']:
+            for name in ['ts', 'price', 'signal', 'position', 'pnl']:
+                np.testing.assert_array_equal(warm.data.block(ticker)[name], first.data.block(ticker)[name])
+        for chunk in warm.range_chunks('AAPL', '2024-02-02-09:30', '2024-02-05-16:00'):  # mapped columns go out
+            self.assertGreater(len(encode_message(Response(CHUNK, SUCCESS, chunk))), 0)
+
+        # New bars continue from the saved rolling state and are appended to the report
+        last = pd.Timestamp(warm.data.block('IBM')['ts'][-1])
+        bars = pd.DataFrame({'price': [150.0, 151.0]}, index=pd.DatetimeIndex(
+            [last + pd.Timedelta(minutes=30), last + pd.Timedelta(minutes=60)], name='datetime'))
+        warm.append_bars('IBM', bars)
+        full = TickerBlock.from_prices(warm.data.block('IBM')['ts'], warm.data.block('IBM')['price'])
+        SignalEngine(warm.window_size()).run_blocks([full])
+        np.testing.assert_array_equal(warm.data.block('IBM')['signal'], full['signal'])
+        warm.save_data()
+        warm.reporter.flush(timeout=10)
+        self.assertIsNone(warm.reporter.error)
+        self.assertEqual(len(open_report('report')['IBM']), 302)
+
+        # Brought up to date in the background once bound
+        self.assertFalse(warm.warm.is_alive())
+        warm.cache = None  # the pull reaches the stand-in
+        warm.retrievers['av'] = FakeRetriever(num_bars=320, delay=0.2)
+        self.serve(warm).close()  # waits for the refresh and its report write
+        self.assertEqual(len(warm.data.block('IBM')), 320)
+        self.assertEqual(len(warm.data.block('MSFT')), 300)  # pulled at startup, not warm started
+        self.assertEqual(len(open_report('report')['IBM']), 320)
+
+        # A report of another bar interval is not started from
+        other = self.start(['IBM'], FakeRetriever(), interval='60min')
+        self.assertIn('trading_calculate_seconds', other.metrics.snapshot()['histograms'])
+
+    def testFastStart(self):
+        """ Test the server answers before its tickers load, a ticker asked for loads on first access """
+        av = FakeRetriever(delay=0.5)
+        start = time.perf_counter()
+        server = self.serve(self.start(['IBM', 'AAPL', 'MSFT'], av, fast_start=True))
+        with Client('127.0.0.1:{0}'.format(server.port)) as c:
+            self.assertEqual(c.request('data', '2024-02-05-12:30').result, SUCCESS)
+            self.assertLess(time.perf_counter() - start, 0.4)
+            self.assertEqual(c.delete('MSFT').result, SUCCESS)
+            self.assertEqual(len(c.data_range('AAPL', '2024-02-02-09:30', '2024-02-02-16:00')), 14)
+            server.loader.join(5)
+            self.assertListEqual(c.data('2024-02-05-12:30').index.tolist(), ['IBM', 'AAPL'])
+            stats = c.stats()
+        gauges = {name: series[0]['value'] for name, series in stats['gauges'].items()}
+        self.assertEqual(gauges['trading_tickers_pending'], 0)
+        self.assertLess(gauges['trading_time_to_first_response_seconds'], 0.4)
+
+    def testFirstAccessWhileLoading(self):
+        """ Test a ticker asked for while the loader is pulling it is waited for, not pulled again """
+        av = CountingRetriever(delay=0.5)
+        server = self.start(['IBM', 'AAPL'], av, fast_start=True)
+        while 'IBM' not in server.loading:
+            time.sleep(0.01)
+        chunks = server.range_chunks('IBM', '2024-02-02-09:30', '2024-02-02-16:00')
+        self.assertEqual(len(join_chunks(list(chunks))['price']), 14)
+        server.loader.join(5)
+        self.assertEqual(av.calls, 2)
+
+
+class RefreshTest(ServerTestCase):
+    """ Incremental Refresh Unit Tests"""
+    def setUp(self):
+        super(RefreshTest, self).setUp()
+        self.av = FakeRetriever()
+        self.server = self.track(Server(['IBM', 'AAPL'], 0, av=self.av, fh=FlatFillRetriever(self.av)))
+        self.server.incremental = True
+        self.server.cache = None  # every pull reaches the stand-ins
+
+    def testRevisedBars(self):
+        """ Test flat filled bars revised by the next pull are recalculated, matching a full recompute """
+        uid = self.server.data.block('IBM').uid
+        for num_bars in [313, 313, 330]:  # the session's real bars arrive, a repeat pull, then more sessions
+            self.av.num_bars = num_bars
+            self.assertEqual(self.server.refresh_data(), dict())
+            frames, _ = self.server.pull_many(['IBM', 'AAPL'])
+            blocks, _ = self.server.prepare_blocks(frames)
+            for ticker in ['IBM', 'AAPL']:
+                block = self.server.data.block(ticker)
+                np.testing.assert_array_equal(block['ts'], blocks[ticker]['ts'])
+                np.testing.assert_array_equal(block['price'], blocks[ticker]['price'])
+                for col in ['signal', 'position']:
+                    np.testing.assert_array_equal(block[col], blocks[ticker][col], err_msg=col)
+                for col in ['rolling_avg', 'pnl']:
+                    np.testing.assert_allclose(block[col], blocks[ticker][col], equal_nan=True, err_msg=col)
+        self.assertNotEqual(self.server.data.block('IBM').uid, uid)  # held bars were replaced, not appended to
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import os
+import sys
+import tempfile
+import unittest
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from shard import ShardedServer, shard_of
+from server import Server
+from client import Client
+from message import Query
+from server_test import FakeRetriever, EmptyRetriever, serve
+from constant import *
+
+TICKERS = ['IBM', 'AAPL', 'MSFT', 'GOOG', 'AMZN', 'TSLA']
+
+
+class ShardedServerTest(unittest.TestCase):
+    """ Sharded Server Unit Tests"""
+    @classmethod
+    def setUpClass(cls):
+        cls.cwd = os.getcwd()
+        cls.tmp = tempfile.TemporaryDirectory()
+        os.chdir(cls.tmp.name)  # shard reports land under shards/ here
+        cls.server = serve(ShardedServer(list(TICKERS), 0, 3, workers=2, av=FakeRetriever(), fh=EmptyRetriever()))
+        cls.port = cls.server.port
+        # Same tickers in one process, results must not change with sharding
+        cls.single = Server(list(TICKERS), 0, av=FakeRetriever(), fh=EmptyRetriever())
+
+    def testPartition(self):
+        """ Test every shard owns some of the tickers and ownership is stable """
+        owners = [shard_of(ticker, 3) for ticker in TICKERS]
+        self.assertEqual(owners, [shard_of(ticker, 3) for ticker in TICKERS])
+        self.assertTrue(all(0 <= s < 3 for s in owners))
+
+    def testDataMatchesSingleProcess(self):
+        """ Test the merged snapshot equals the unsharded server's, tickers in the same order """
+        with Client('127.0.0.1:{0}'.format(self.port)) as c:
+            responses = c.pipeline([Query('data', dt) for dt in ['2024-02-02-10:30', '2024-02-06-15:00']])
+        for response, dt in zip(responses, ['2024-02-02-10:30', '2024-02-06-15:00']):
+            expected = self.single.snapshot(dt)
+            self.assertListEqual(response.data['ticker'], TICKERS)
+            np.testing.assert_array_equal(response.data['price'], expected['price'])
+            np.testing.assert_array_equal(response.data['signal'], expected['signal'])
+
+    def testRange(self):
+        """ Test a range query is relayed from the owning shard """
+        with Client('127.0.0.1:{0}'.format(self.port)) as c:
+            bars = c.data_range('MSFT', '2024-02-02-09:30', '2024-02-05-16:00', interval='60min')
+            with self.assertRaises(RuntimeError):
+                c.data_range('NOPE', '2024-02-02-09:30', '2024-02-05-16:00')
+        expected = self.single.process_query(Query('data', {'ticker': 'MSFT', 'from': '2024-02-02-09:30',
+                                                            'to': '2024-02-05-16:00', 'interval': '60min'}))
+        np.testing.assert_array_equal(bars.index, expected.data['datetime'])
+        np.testing.assert_array_equal(bars['close'], expected.data['close'])
+
+    def testAddDeleteReport(self):
+        """ Test add/delete routed to the owning shard and report fanned out """
+        with Client('127.0.0.1:{0}'.format(self.port)) as c:
+            self.assertEqual(c.add('NVDA').result, SUCCESS)
+            self.assertIn('NVDA', c.data('2024-02-02-10:30').index)
+            self.assertEqual(c.delete('NVDA').result, SUCCESS)
+            self.assertNotIn('NVDA', c.data('2024-02-02-10:30').index)
+            self.assertEqual(c.delete('NVDA').result, ERROR)
+            self.assertEqual(c.report().result, SUCCESS)
+            self.assertEqual(c.request('backtest').result, ERROR)
+
+    def testSubscribe(self):
+        """ Test subscribing on the front end to a held ticker, and to one that is not held """
+        with Client('127.0.0.1:{0}'.format(self.port)) as c:
+            self.assertEqual(c.subscribe('IBM'), "Subscribed to IBM")
+            response = c.request('subscribe', 'NOPE')
+            self.assertEqual(response.result, ERROR)
+            self.assertIn('not held', response.data)
+            self.assertEqual(c.unsubscribe('IBM').result, SUCCESS)
+
+    def testStats(self):
+        """ Test shard metrics are gathered and labelled by shard """
+        with Client('127.0.0.1:{0}'.format(self.port)) as c:
+            c.data('2024-02-02-10:30')
+            stats = c.stats()
+            text = c.stats('prometheus')
+        self.assertEqual(len(stats['shards']), 3)
+        self.assertIn('trading_request_seconds', stats['front']['histograms'])
+        self.assertEqual(text.count('# TYPE trading_request_seconds histogram'), 1)
+        self.assertIn('shard="2"', text)
+
+    def testFastStart(self):
+        """ Test shards bind before their tickers load with fast start, a ticker asked for loads on first access """
+        with tempfile.TemporaryDirectory() as path:
+            os.chdir(path)  # no reports to warm start from
+            server = ShardedServer(list(TICKERS), 0, 2, av=FakeRetriever(delay=2.0), fh=EmptyRetriever(),
+                                   fast_start=True)
+            try:
+                self.assertListEqual(server.tickers, TICKERS)
+                with Client('127.0.0.1:{0}'.format(serve(server).port)) as c:
+                    pending = [shard['gauges']['trading_tickers_pending'][0]['value'] for shard in c.stats()['shards']]
+                    self.assertGreater(sum(pending), 0)
+                    self.assertEqual(len(c.data_range('MSFT', '2024-02-02-09:30', '2024-02-02-16:00')), 14)
+            finally:
+                server.close()
+                os.chdir(self.tmp.name)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.close()
+        cls.single.reporter.flush(timeout=10)
+        os.chdir(cls.cwd)
+        cls.tmp.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
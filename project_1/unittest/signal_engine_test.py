@@ -0,0 +1,128 @@
+import os
+import sys
+import unittest
+import numpy as np
+import pandas as pd
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from signal_engine import SignalEngine, RollingState, SIGNAL_COLUMNS
+from server import Server
+from store import ColumnarStore, TickerBlock
+from metrics import Metrics
+WINDOW = 13
+
+
+def legacy_calculate_all(df, window):
+    """ Row by row reference implementation the server used before vectorization """
+
+    def sig(p, avg, std):
+        if p > avg + std:
+            return 1
+        elif p < avg - std:
+            return -1
+        else:
+            return 0
+
+    df['rolling_avg'] = df['price'].rolling(window).mean()
+    df['rolling_std'] = df['price'].rolling(window).std()
+    df['signal'] = df.apply(lambda x: sig(x.price, x.rolling_avg, x.rolling_std), axis=1)
+    df['position'] = df['signal'].cumsum().shift().fillna(0)
+    df['unit_return_dollar'] = df['price'].diff()
+    df['pnl'] = df['position'].shift().fillna(0) * df['unit_return_dollar']
+    return df
+
+
+def random_frame(ticker, n, seed):
+    """ Random walk price frame in the server's data layout """
+    rng = np.random.default_rng(seed)
+    index = pd.date_range('2024-02-01 09:30', periods=n, freq='30min', name='datetime')
+    df = pd.DataFrame({'price': 100 + np.cumsum(rng.normal(0, 1, n)).round(2)}, index=index)
+    df['ticker'] = ticker
+    return df
+
+
+class SignalEngineTest(unittest.TestCase):
+    """ SignalEngine Unit Tests"""
+    def setUp(self):
+        self.engine = SignalEngine(WINDOW)
+        self.lengths = {'IBM': 600, 'AAPL': 5, 'MSFT': 1, 'TSLA': 250}
+
+    def testMatchesLegacy(self):
+        """ Test batch results are bit identical to the row by row calculation """
+        frames = {t: random_frame(t, n, i) for i, (t, n) in enumerate(self.lengths.items())}
+        expected = {t: legacy_calculate_all(df.copy(), WINDOW) for t, df in frames.items()}
+        self.engine.run_frames(frames)
+        for ticker in self.lengths:
+            for col in SIGNAL_COLUMNS:
+                np.testing.assert_array_equal(frames[ticker][col].to_numpy(), expected[ticker][col].to_numpy(),
+                                              err_msg='{0} {1} mismatch'.format(ticker, col))
+
+    def testServerCalculateAll(self):
+        """ Test the server's per ticker and all ticker calculations over the store agree with the engine """
+        frames = {t: random_frame(t, n, i) for i, (t, n) in enumerate(self.lengths.items())}
+        expected = self.engine.run_frames({t: df.copy() for t, df in frames.items()})
+        server = Server.__new__(Server)  # skip config and data pull
+        server.interval = '30min'
+        server.engine = self.engine
+        server.metrics = Metrics()
+        for calculate in (server.calculate_all, None):
+            server.states = dict()
+            server.data = ColumnarStore()
+            for ticker, df in frames.items():
+                server.data.put(ticker, TickerBlock.from_frame(df))
+            if calculate:
+                for ticker in frames:
+                    calculate(ticker)
+            else:
+                server.calculate_all_tickers()
+            for ticker in frames:
+                block = server.data.block(ticker)
+                np.testing.assert_array_equal(block['signal'], expected[ticker]['signal'])
+                np.testing.assert_array_equal(block['position'], expected[ticker]['position'])
+                np.testing.assert_array_equal(block['pnl'], expected[ticker]['pnl'])
+                np.testing.assert_array_equal(block.unit_return(), expected[ticker]['unit_return_dollar'])
+                self.assertIn(ticker, server.states)
+
+    def testOffsets(self):
+        """ Test segment offsets from bar counts """
+        offsets = SignalEngine.build_offsets([3, 0, 2])
+        self.assertListEqual(offsets.tolist(), [0, 3, 3, 5])
+
+    def testEmpty(self):
+        """ Test empty input """
+        result = self.engine.run(np.array([]), np.array([0]))
+        self.assertEqual(len(result['pnl']), 0)
+
+
+class RollingStateTest(unittest.TestCase):
+    """ RollingState Unit Tests"""
+    def setUp(self):
+        self.engine = SignalEngine(WINDOW)
+        self.full = self.engine.run_frames({'IBM': random_frame('IBM', 2000, 7)})['IBM']
+
+    def check(self, seed_bars, chunk):
+        """ Seed state from the first {seed_bars} bars, feed the rest {chunk} bars at a time """
+        head = self.engine.run_frames({'IBM': self.full[['price', 'ticker']].iloc[:seed_bars].copy()})['IBM']
+        state = RollingState.from_frame(head, WINDOW)
+        prices = self.full['price'].to_numpy()[seed_bars:]
+        parts = [state.update(prices[i:i + chunk]) for i in range(0, len(prices), chunk)]
+        for col in SIGNAL_COLUMNS:
+            result = np.concatenate([part[col] for part in parts])
+            expected = self.full[col].to_numpy()[seed_bars:]
+            if col in ('signal', 'position'):
+                np.testing.assert_array_equal(result, expected, err_msg=col)
+            else:
+                np.testing.assert_allclose(result, expected, rtol=1e-9, atol=1e-9, err_msg=col)
+
+    def testMatchesFullRecompute(self):
+        """ Test incremental updates agree with recomputing the full history """
+        self.check(500, 1)
+        self.check(500, 37)
+
+    def testColdStart(self):
+        """ Test state seeded before the first window fills """
+        self.check(1, 5)
+        self.check(WINDOW - 1, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
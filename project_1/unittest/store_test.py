@@ -0,0 +1,64 @@
+import os
+import sys
+import unittest
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from store import ColumnarStore, TickerBlock, REPORT_COLUMNS
+from signal_engine import SignalEngine
+from signal_engine_test import random_frame, legacy_calculate_all, WINDOW
+
+
+class ColumnarStoreTest(unittest.TestCase):
+    """ ColumnarStore Unit Tests"""
+    def setUp(self):
+        self.frames = {t: random_frame(t, 500, i) for i, t in enumerate(['IBM', 'AAPL', 'MSFT'])}
+        self.store = ColumnarStore()
+        for ticker, df in self.frames.items():
+            self.store.put(ticker, TickerBlock.from_frame(df))
+        SignalEngine(WINDOW).run_blocks([self.store.block(t) for t in self.store])
+
+    def testFrame(self):
+        """ Test a block exported as a frame matches the legacy per ticker frame """
+        expected = legacy_calculate_all(self.frames['IBM'].copy(), WINDOW)
+        df = self.store.frame('IBM')
+        self.assertListEqual(list(df.columns), REPORT_COLUMNS)
+        self.assertTrue(df.index.equals(expected.index))
+        for col in ['price', 'signal', 'position', 'unit_return_dollar', 'pnl']:
+            np.testing.assert_array_equal(df[col].to_numpy(), expected[col].to_numpy(), err_msg=col)
+        np.testing.assert_allclose(df['rolling_avg'], expected['rolling_avg'], rtol=1e-6)
+
+    def testInterning(self):
+        """ Test ids survive delete and re-add """
+        tid = self.store.ids['AAPL']
+        self.store.remove('AAPL')
+        self.assertNotIn('AAPL', self.store)
+        self.assertListEqual(list(self.store), ['IBM', 'MSFT'])
+        self.assertRaises(KeyError, self.store.block, 'AAPL')
+        self.store.put('AAPL', TickerBlock.from_frame(self.frames['AAPL']))
+        self.assertEqual(self.store.ids['AAPL'], tid)
+        self.assertEqual(len(self.store), 3)
+
+    def testAppend(self):
+        """ Test appends grow geometrically and keep earlier bars """
+        block = TickerBlock.from_frame(self.frames['IBM'].iloc[:10])
+        ts = self.store.block('IBM')['ts']
+        price = self.store.block('IBM')['price']
+        grows = 0
+        for i in range(10, 500):
+            capacity = block.capacity
+            block.append(ts[i:i + 1], price[i:i + 1])
+            grows += block.capacity != capacity
+        np.testing.assert_array_equal(block['ts'], ts)
+        np.testing.assert_array_equal(block['price'], price)
+        self.assertLess(grows, 10)
+
+    def testMemory(self):
+        """ Test bytes per bar against the DataFrame layout it replaces """
+        legacy = sum(legacy_calculate_all(df.copy(), WINDOW).memory_usage(deep=True).sum()
+                     for df in self.frames.values())
+        self.assertLess(self.store.nbytes(), legacy / 2)
+        self.assertEqual(self.store.nbytes() / self.store.num_bars(), 37)
+
+
+if __name__ == '__main__':
+    unittest.main()
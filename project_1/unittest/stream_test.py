@@ -0,0 +1,104 @@
+import os
+import sys
+import time
+import unittest
+import numpy as np
+import pandas as pd
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from stream import BarBuilder, FakeQuoteFeed, QuoteStream, quote_time
+from server import Server
+from client import Client
+from signal_engine import SignalEngine
+from store import TickerBlock
+from server_test import FakeRetriever, EmptyRetriever, ServerTestCase
+from constant import *
+
+T = lambda s: pd.Timestamp(s).value
+
+
+class BarBuilderTest(unittest.TestCase):
+    """ Bar Building Unit Tests"""
+    def testBars(self):
+        """ Test last quote of each bar, completion on a later quote or the clock, late quotes dropped """
+        builder = BarBuilder(30)
+        self.assertListEqual(builder.add('IBM', T('2024-03-08 09:31'), 10.0), [])
+        self.assertListEqual(builder.add('IBM', T('2024-03-08 09:59'), 11.0), [])
+        self.assertListEqual(builder.add('IBM', T('2024-03-08 10:00'), 12.0), [(T('2024-03-08 09:30'), 11.0)])
+        self.assertListEqual(builder.add('IBM', T('2024-03-08 09:45'), 99.0), [])  # bar already completed
+        self.assertDictEqual(builder.close_due(T('2024-03-08 10:29')), dict())
+        self.assertDictEqual(builder.close_due(T('2024-03-08 10:30')), {'IBM': [(T('2024-03-08 10:00'), 12.0)]})
+        self.assertListEqual(builder.add('IBM', T('2024-03-08 10:10'), 13.0), [])  # dropped, bar closed
+
+    def testQuoteTime(self):
+        """ Test Finn Hub quote time lands in the same frame as the flat filled bars """
+        self.assertEqual(quote_time(1709931600), T('2024-03-08 16:00'))
+
+
+class StreamTest(ServerTestCase):
+    """ Streaming Ingestion Unit Tests"""
+    def setUp(self):
+        super(StreamTest, self).setUp()
+        self.feed = FakeQuoteFeed()
+        self.server = Server(['IBM', 'AAPL'], 0, workers=2, av=FakeRetriever(), fh=EmptyRetriever(), feed=self.feed)
+        self.server.stream.period = 3600  # steps are driven by the test
+        self.port = self.serve(self.server).port
+        self.last = pd.Timestamp(self.server.data.block('IBM')['ts'][-1])
+
+    def quote_bars(self, ticker, prices):
+        """ Push one quote per 30min bar after the last held bar, then move the clock past the last one """
+        for i, price in enumerate(prices):
+            self.feed.push(ticker, self.last + pd.Timedelta(minutes=30 * (i + 1) + 5), price)
+        self.feed.advance(self.last + pd.Timedelta(minutes=30 * (len(prices) + 1)))
+
+    def testIngestMatchesRecalculation(self):
+        """ Test streamed bars get the analytics a full recalculation of the series gives """
+        prices = 100 + np.cumsum(np.random.default_rng(5).normal(0, 1, 40))
+        self.quote_bars('IBM', prices)
+        completed = self.server.stream.step()
+        np.testing.assert_array_equal(completed['IBM'][1], prices)
+
+        block = self.server.data.block('IBM')
+        self.assertEqual(block['ts'][-1], (self.last + pd.Timedelta(minutes=30 * 40)).value)
+        full = TickerBlock.from_prices(block['ts'], block['price'])
+        SignalEngine(self.server.window_size()).run_blocks([full])
+        np.testing.assert_array_equal(block['signal'], full['signal'])
+        np.testing.assert_array_equal(block['position'], full['position'])
+        np.testing.assert_allclose(block['rolling_avg'], full['rolling_avg'], rtol=1e-6)
+
+    def testPushToSubscriber(self):
+        """ Test subscribed clients get new bars pushed, others and unsubscribed clients do not """
+        with Client('127.0.0.1:{0}'.format(self.port)) as c, Client('127.0.0.1:{0}'.format(self.port)) as other:
+            c.subscribe('IBM')
+            other.subscribe('AAPL')
+            self.assertEqual(c.request('subscribe', 'NOPE').result, ERROR)
+
+            self.quote_bars('IBM', [150.0, 151.0])
+            self.server.stream.step()
+            update = c.next_update(timeout=5)
+            self.assertEqual(update['ticker'], 'IBM')
+            self.assertListEqual(update['price'].tolist(), [150.0, 151.0])
+            self.assertEqual(update['datetime'][0], np.datetime64(self.last + pd.Timedelta(minutes=30)))
+            self.assertIsNone(other.next_update(timeout=0.2))
+
+            # Replies to requests still arrive alongside pushes
+            self.assertEqual(c.request('data', '2024-02-05-12:30').result, SUCCESS)
+            c.unsubscribe('IBM')
+            self.quote_bars('IBM', [150.0, 151.0, 152.0])
+            self.server.stream.step()
+            self.assertIsNone(c.next_update(timeout=0.2))
+
+    def testBackgroundLoop(self):
+        """ Test the ingestion thread polls on its own """
+        stream = QuoteStream(self.feed, 30, lambda: ['IBM'], self.server.ingest_bars, period=0.05)
+        stream.start()
+        self.quote_bars('IBM', [150.0])
+        for _ in range(100):
+            if self.server.data.block('IBM')['price'][-1] == 150.0:
+                break
+            time.sleep(0.05)
+        stream.stop()
+        self.assertEqual(self.server.data.block('IBM')['price'][-1], 150.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
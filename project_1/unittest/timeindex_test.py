@@ -0,0 +1,49 @@
+import os
+import sys
+import unittest
+import numpy as np
+import pandas as pd
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from timeindex import parse_query_datetime, to_int64, nearest_positions, downsample
+
+
+class TimeIndexTest(unittest.TestCase):
+    """ Nearest Bar Lookup Unit Tests"""
+    def setUp(self):
+        # Two trading days of 30min bars, gap overnight
+        self.index = pd.DatetimeIndex(list(pd.date_range('2024-03-07 09:30', '2024-03-07 16:00', freq='30min')) +
+                                      list(pd.date_range('2024-03-08 09:30', '2024-03-08 16:00', freq='30min')))
+        self.queries = ['2024-03-01-12:00', '2024-03-07-09:30', '2024-03-07-09:45', '2024-03-07-09:46',
+                        '2024-03-07-20:00', '2024-03-08-03:00', '2024-03-08-12:14', '2024-03-09-00:00']
+
+    def testMatchesLinearScan(self):
+        """ Test binary search picks the same bar as the previous abs().idxmin() scan, ties included """
+        ts = to_int64(self.index)
+        for q in self.queries:
+            dt = parse_query_datetime(q)
+            expected = pd.Series(dt - self.index).abs().idxmin()
+            self.assertEqual(nearest_positions(ts, to_int64(dt)), expected, q)
+
+    def testBatch(self):
+        """ Test many query times in one search """
+        ts = to_int64(self.index)
+        dts = parse_query_datetime(self.queries)
+        expected = [pd.Series(dt - self.index).abs().idxmin() for dt in dts]
+        self.assertListEqual(nearest_positions(ts, to_int64(dts)).tolist(), expected)
+
+    def testSingleBar(self):
+        """ Test a one bar series """
+        ts = to_int64(self.index[:1])
+        self.assertEqual(nearest_positions(ts, to_int64(parse_query_datetime(self.queries[-1]))), 0)
+
+    def testDownsampleEmpty(self):
+        """ Test a span without bars downsamples to empty OHLC columns """
+        ts = to_int64(self.index)
+        bars = downsample(ts[:0], np.zeros(0), np.zeros(0, dtype=np.int8), 60 * 60 * 10 ** 9)
+        self.assertListEqual(list(bars), ['datetime', 'open', 'high', 'low', 'close', 'signal'])
+        self.assertTrue(all(len(values) == 0 for values in bars.values()))
+        self.assertEqual(bars['datetime'].dtype, np.dtype('datetime64[ns]'))
+
+
+if __name__ == '__main__':
+    unittest.main()